@@ -1,15 +1,26 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Query
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Query, Request
 from pydantic import BaseModel
 from app.services.analysis import AnalysisService
-from app.services.dependencies import get_analysis_service
+from app.services.dependencies import get_analysis_service, get_code_executor, get_llm_service
+from app.services.llm import LLMService
+from app.services.executor import CodeExecutor
+from app.services.export import EXPORT_FORMATS, XLSX_MAX_ROWS, export_stream, gzip_stream
+from app.core.config import settings
+from app.core.logger import get_logger
 import os
 import uuid
+import json
+import asyncio
 from typing import List, Dict, Any, Optional
-from io import StringIO
 from fastapi.responses import StreamingResponse
 
 router = APIRouter()
 
+logger = get_logger(__name__)
+
+# SSE连接空闲时发送心跳的间隔（秒）
+SSE_KEEPALIVE_SECONDS = 15
+
 class AnalysisRequest(BaseModel):
     query: str
     session_id: str
@@ -20,6 +31,7 @@ class ProcessStep(BaseModel):
     attempt: Optional[int] = None
     traceback: Optional[str] = None
     reason: Optional[str] = None
+    timings: Optional[Dict[str, float]] = None
 
 class AnalysisResponse(BaseModel):
     status: str
@@ -30,6 +42,9 @@ class AnalysisResponse(BaseModel):
     fixed_code: Optional[str] = None
     process_steps: Optional[List[ProcessStep]] = None
     user_notice: Optional[str] = None
+    code_language: Optional[str] = None
+    query_plan: Optional[str] = None
+    timings: Optional[Dict[str, float]] = None
 
 class CreateSessionRequest(BaseModel):
     session_name: str = None
@@ -41,6 +56,9 @@ class SessionResponse(BaseModel):
 class AnalysisRequestBody(BaseModel):
     query: str
 
+class BatchAnalysisRequest(BaseModel):
+    queries: List[str]
+
 @router.post("/analyze", response_model=AnalysisResponse)
 async def analyze_with_body(request: AnalysisRequest):
     """
@@ -52,6 +70,77 @@ async def analyze_with_body(request: AnalysisRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def _sse_event(event: str, data) -> str:
+    """格式化一条SSE事件"""
+    payload = json.dumps(data, ensure_ascii=False, default=str)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+def _sse_response(queue: asyncio.Queue, task: asyncio.Task, finish) -> StreamingResponse:
+    """
+    推送 queue 中的 (事件, 数据)，task 结束后推送 finish(task结果) 返回的事件
+
+    连接空闲时发送心跳，客户端断开连接时取消 task。
+    """
+    async def event_stream():
+        try:
+            while True:
+                getter = asyncio.create_task(queue.get())
+                done, _ = await asyncio.wait(
+                    {getter, task},
+                    timeout=SSE_KEEPALIVE_SECONDS,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if getter in done:
+                    yield _sse_event(*getter.result())
+                    continue
+                getter.cancel()
+                if not done:
+                    # 保持连接，避免代理超时断开
+                    yield ": keep-alive\n\n"
+                    continue
+                # 任务结束，推送剩余事件和最终结果
+                while not queue.empty():
+                    yield _sse_event(*queue.get_nowait())
+                try:
+                    result = task.result()
+                except Exception as e:
+                    result = {"status": "error", "message": f"分析过程出错: {str(e)}"}
+                for event in finish(result):
+                    yield _sse_event(*event)
+                break
+        finally:
+            # 客户端断开连接时取消分析
+            if not task.done():
+                task.cancel()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.post("/analyze/stream")
+async def analyze_stream(
+    request: AnalysisRequest,
+    analysis_service: AnalysisService = Depends(get_analysis_service)
+):
+    """
+    流式分析（SSE）：实时推送大模型输出的token和每个分析步骤，最后推送完整结果
+    
+    事件类型: token（大模型输出片段）、step（分析步骤）、result（最终结果）、done
+    """
+    queue = asyncio.Queue()
+    
+    def emit(event, data):
+        queue.put_nowait((event, data))
+    
+    task = asyncio.create_task(analysis_service.analyze(request.query, request.session_id, emit=emit))
+    
+    def finish(result):
+        return [("result", result), ("done", {"status": result.get("status")})]
+    
+    return _sse_response(queue, task, finish)
+
 @router.post("/load/{filename}/{session_id}")
 async def load_file(filename: str, session_id: str):
     """
@@ -83,7 +172,7 @@ async def list_sessions(analysis_service: AnalysisService = Depends(get_analysis
     列出所有会话
     """
     try:
-        sessions = analysis_service.list_sessions()
+        sessions = await analysis_service.list_sessions()
         return {"status": "success", "sessions": sessions}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -97,7 +186,7 @@ async def close_session(
     关闭指定会话
     """
     try:
-        result = analysis_service.close_session(session_id)
+        result = await analysis_service.close_session(session_id)
         if result["status"] == "error":
             raise HTTPException(status_code=404, detail=result["message"])
         return result
@@ -105,11 +194,14 @@ async def close_session(
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/history/{session_id}")
-async def get_history(session_id: str):
+async def get_history(
+    session_id: str,
+    analysis_service: AnalysisService = Depends(get_analysis_service)
+):
     """
     获取指定会话的分析历史
     """
-    history = analysis_service.get_analysis_history(session_id)
+    history = await analysis_service.get_analysis_history(session_id)
     return {"session_id": session_id, "history": history}
 
 @router.post("/create_session")
@@ -127,34 +219,65 @@ async def create_session_legacy(analysis_service: AnalysisService = Depends(get_
 async def upload_file(
     session_id: str,
     file: UploadFile = File(...),
+    mode: str = Query("replace", description="replace: 替换数据; append: 上传追加了新行的完整文件; delta: 只上传新增的行"),
+    key: Optional[str] = Query(None, description="追加时按该列更新已有的行"),
+    name: Optional[str] = Query(None, description="作为命名数据集加入会话，分析代码中按该变量名引用"),
     analysis_service: AnalysisService = Depends(get_analysis_service)
 ):
     """
     上传数据文件
     """
     try:
-        print(f"接收到文件上传请求: 会话ID={session_id}, 文件名={file.filename}")
+        logger.info("接收到文件上传请求", extra={"fields": {"session_id": session_id, "filename": file.filename}})
         
         # 检查文件类型
         if not file.filename.endswith(('.csv', '.xlsx', '.xls')):
             error_msg = "不支持的文件格式，请上传CSV或Excel文件"
-            print(f"文件上传失败: {error_msg}")
+            logger.warning("文件上传失败", extra={"fields": {"session_id": session_id, "error": error_msg}})
             raise HTTPException(status_code=400, detail=error_msg)
         
-        result = await analysis_service.upload_file(session_id, file)
-        print(f"文件上传处理结果: {result}")
+        if mode not in ("replace", "append", "delta"):
+            raise HTTPException(status_code=400, detail=f"不支持的上传模式: {mode}")
+        
+        result = await analysis_service.upload_file(session_id, file, mode=mode, key=key, name=name)
         
         if result.get("status") == "error":
-            print(f"文件上传服务错误: {result.get('message')}")
+            logger.warning("文件上传服务错误", extra={"fields": {"session_id": session_id, "error": result.get("message")}})
             raise HTTPException(status_code=500, detail=result.get("message"))
         
         return result
     except Exception as e:
-        print(f"文件上传异常: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        if isinstance(e, HTTPException):
+            raise e
+        logger.exception("文件上传异常", extra={"fields": {"session_id": session_id}})
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/datasets/{session_id}")
+async def list_datasets(
+    session_id: str,
+    analysis_service: AnalysisService = Depends(get_analysis_service)
+):
+    """
+    获取会话数据目录中的数据集
+    """
+    datasets = await analysis_service.list_datasets(session_id)
+    if datasets is None:
+        raise HTTPException(status_code=404, detail="会话不存在")
+    return {"session_id": session_id, "datasets": datasets}
+
+@router.delete("/datasets/{session_id}/{name}")
+async def remove_dataset(
+    session_id: str,
+    name: str,
+    analysis_service: AnalysisService = Depends(get_analysis_service)
+):
+    """
+    从会话数据目录中移除数据集
+    """
+    if not await analysis_service.remove_dataset(session_id, name):
+        raise HTTPException(status_code=404, detail="数据集不存在")
+    return {"status": "success", "message": f"数据集 {name} 已移除"}
+
 @router.get("/load/{session_id}/{filename}")
 async def load_data(
     session_id: str,
@@ -185,6 +308,57 @@ async def analyze_data(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def _batch_queries(request: BatchAnalysisRequest) -> list:
+    """校验批量查询，返回去掉首尾空白的查询列表"""
+    queries = [query.strip() for query in request.queries]
+    if not queries:
+        raise HTTPException(status_code=400, detail="查询列表不能为空")
+    if len(queries) > settings.BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=400, detail=f"一次最多提交 {settings.BATCH_MAX_QUERIES} 个查询")
+    if not all(queries):
+        raise HTTPException(status_code=400, detail="查询不能为空")
+    return queries
+
+@router.post("/analyze/{session_id}/batch")
+async def analyze_batch(
+    session_id: str,
+    request: BatchAnalysisRequest,
+    analysis_service: AnalysisService = Depends(get_analysis_service)
+):
+    """
+    批量分析：在同一会话的数据上并发分析多个查询，按提交顺序返回各查询的结果和汇总耗时
+    """
+    queries = _batch_queries(request)
+    result = await analysis_service.analyze_batch(queries, session_id)
+    if "results" not in result:
+        raise HTTPException(status_code=400, detail=result["message"])
+    return result
+
+@router.post("/analyze/{session_id}/batch/stream")
+async def analyze_batch_stream(
+    session_id: str,
+    request: BatchAnalysisRequest,
+    analysis_service: AnalysisService = Depends(get_analysis_service)
+):
+    """
+    流式批量分析（SSE）：每个查询完成时立即推送其结果，全部完成后推送汇总
+
+    事件类型: result（单个查询的结果，含 index、query、elapsed、response）、summary（汇总耗时和成功数）、done
+    """
+    queries = _batch_queries(request)
+    queue = asyncio.Queue()
+    
+    def on_result(item):
+        queue.put_nowait(("result", item))
+    
+    task = asyncio.create_task(analysis_service.analyze_batch(queries, session_id, on_result=on_result))
+    
+    def finish(result):
+        summary = {key: value for key, value in result.items() if key != "results"}
+        return [("summary", summary), ("done", {"status": result.get("status")})]
+    
+    return _sse_response(queue, task, finish)
+
 @router.delete("/session/{session_id}")
 async def close_session_legacy(
     session_id: str,
@@ -194,7 +368,7 @@ async def close_session_legacy(
     关闭会话（老接口，建议使用/sessions/{session_id}）
     """
     try:
-        result = analysis_service.close_session(session_id)
+        result = await analysis_service.close_session(session_id)
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -209,7 +383,7 @@ async def get_analysis_result(
     """
     try:
         # 获取最新的分析历史记录
-        history = analysis_service.get_analysis_history(session_id)
+        history = await analysis_service.get_analysis_history(session_id)
         if not history:
             return {"status": "error", "message": "没有找到分析历史"}
         
@@ -250,9 +424,11 @@ async def get_session_info(
     """
     try:
         # 检查会话是否存在
-        session = analysis_service.sessions.get(session_id)
+        session = await analysis_service.sessions.load(session_id)
         if not session:
             raise HTTPException(status_code=404, detail=f"会话 {session_id} 不存在")
+        # 数据可能已被换出到磁盘，重新加载
+        await analysis_service.sessions.ensure_data(session_id)
         
         # 提取会话信息（排除大型数据对象）
         session_info = {
@@ -283,7 +459,7 @@ async def save_common_query(
     """
     保存常用查询
     """
-    result = analysis_service.save_common_query(session_id, query, name)
+    result = await analysis_service.save_common_query(session_id, query, name)
     if result["status"] == "error":
         raise HTTPException(status_code=400, detail=result["message"])
     return result
@@ -296,7 +472,7 @@ async def get_common_queries(
     """
     获取常用查询列表
     """
-    queries = analysis_service.get_common_queries(session_id)
+    queries = await analysis_service.get_common_queries(session_id)
     return {"session_id": session_id, "queries": queries}
 
 @router.delete("/common-queries/{session_id}")
@@ -308,7 +484,7 @@ async def delete_common_query(
     """
     删除常用查询
     """
-    result = analysis_service.delete_common_query(session_id, query)
+    result = await analysis_service.delete_common_query(session_id, query)
     if result["status"] == "error":
         raise HTTPException(status_code=400, detail=result["message"])
     return result
@@ -316,30 +492,85 @@ async def delete_common_query(
 @router.get("/download/{download_id}")
 async def download_data(
     download_id: str,
+    request: Request,
+    format: str = Query("csv", description="导出格式: csv / parquet / xlsx"),
     analysis_service: AnalysisService = Depends(get_analysis_service)
 ):
     """
-    下载完整数据
+    下载完整数据（逐批编码输出，不在内存中生成整个文件）
     """
     try:
-        df = analysis_service.download_cache.get(download_id)
-        if df is None:
+        if format not in EXPORT_FORMATS:
+            raise HTTPException(status_code=400, detail=f"不支持的导出格式: {format}")
+        
+        info = analysis_service.result_store.describe(download_id)
+        if info is None:
             raise HTTPException(status_code=404, detail="下载链接已过期")
+        if format == "xlsx" and info["rows"] + 1 > XLSX_MAX_ROWS:
+            raise HTTPException(status_code=400, detail="数据行数超过Excel上限，请选择CSV或Parquet格式")
+        
+        schema = None
+        if format == "parquet":
+            # 开始输出前由整份结果确定列类型，避免后续批次类型不同时在已返回200后中断
+            try:
+                schema = await asyncio.to_thread(analysis_service.result_store.arrow_schema, download_id)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=f"数据包含无法导出为Parquet的列，请选择CSV格式: {e}")
+            if schema is None:
+                raise HTTPException(status_code=404, detail="下载链接已过期")
         
-        # 将DataFrame转换为CSV
-        csv_buffer = StringIO()
-        df.to_csv(csv_buffer, index=False)
-        csv_buffer.seek(0)
+        # 结果可能在内存或磁盘中，逐批读取并编码
+        batches = analysis_service.result_store.iter_batches(download_id)
+        content = export_stream(batches, format, schema)
         
         # 生成文件名
-        filename = f"analysis_result_{download_id[:8]}.csv"
+        export_info = EXPORT_FORMATS[format]
+        filename = f"analysis_result_{download_id[:8]}.{export_info['extension']}"
+        headers = {
+            "Content-Disposition": f"attachment; filename={filename}"
+        }
+        
+        # 客户端支持时对CSV做gzip压缩（Parquet和Excel本身已压缩）
+        if format == "csv" and "gzip" in request.headers.get("accept-encoding", ""):
+            content = gzip_stream(content)
+            headers["Content-Encoding"] = "gzip"
+            headers["Vary"] = "Accept-Encoding"
         
         return StreamingResponse(
-            iter([csv_buffer.getvalue()]),
-            media_type="text/csv",
-            headers={
-                "Content-Disposition": f"attachment; filename={filename}"
-            }
+            content,
+            media_type=export_info["media_type"],
+            headers=headers
         )
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
+        if isinstance(e, HTTPException):
+            raise e
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/sessions/stats/memory")
+async def get_session_memory_stats(analysis_service: AnalysisService = Depends(get_analysis_service)):
+    """
+    获取会话存储的内存使用情况
+    """
+    return {"status": "success", "stats": analysis_service.sessions.stats()}
+
+@router.get("/executor/stats")
+async def get_executor_stats(code_executor: CodeExecutor = Depends(get_code_executor)):
+    """
+    获取代码执行引擎的运行指标（进程池使用情况、排队深度等）
+    """
+    return {"status": "success", "stats": code_executor.stats()}
+
+@router.get("/llm/cache/stats")
+async def get_llm_cache_stats(llm_service: LLMService = Depends(get_llm_service)):
+    """
+    获取大模型响应缓存的命中情况
+    """
+    stats = llm_service.cache.stats() if llm_service.cache is not None else {"enabled": False}
+    return {"status": "success", "stats": stats}
+
+@router.get("/code-cache/stats")
+async def get_code_cache_stats(analysis_service: AnalysisService = Depends(get_analysis_service)):
+    """
+    获取分析代码缓存的命中情况
+    """
+    return {"status": "success", "stats": analysis_service.code_cache.stats()}
@@ -1,9 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, UploadFile, File
 from fastapi.responses import FileResponse
 from ..services.example_service import ExampleService
-from ..services.dependencies import get_example_service
+from ..services.example_index import SORT_FIELDS
+from ..services.analysis import AnalysisService
+from ..services.dependencies import get_example_service, get_analysis_service
 from pathlib import Path
 import urllib.parse
+import uuid
 from pydantic import BaseModel, Field
 from typing import List, Optional
 
@@ -34,11 +37,24 @@ async def create_example(
 
 @router.get("/examples")
 async def list_examples(
+    response: Response,
+    tag: Optional[List[str]] = Query(None, description="按标签筛选，多个标签时返回同时包含这些标签的示例"),
+    sort: str = Query("createdAt", description="排序字段: createdAt / name"),
+    order: str = Query("desc", description="asc / desc"),
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="每页数量，不传时返回全部"),
+    offset: int = Query(0, ge=0, description="跳过的数量"),
     example_service: ExampleService = Depends(get_example_service)
 ):
-    """获取示例列表"""
+    """获取示例列表（只含元信息），符合条件的总数在 X-Total-Count 响应头中"""
+    if sort not in SORT_FIELDS:
+        raise HTTPException(status_code=400, detail=f"不支持的排序字段: {sort}")
+    if order.lower() not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail=f"不支持的排序方向: {order}")
     try:
-        examples = await example_service.list_examples()
+        examples, total = await example_service.list_examples(
+            tags=tag, sort=sort, order=order, limit=limit, offset=offset
+        )
+        response.headers["X-Total-Count"] = str(total)
         return examples
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -77,6 +93,28 @@ async def delete_example(
         raise HTTPException(status_code=404, detail="示例不存在")
     return {"message": "示例删除成功"}
 
+@router.post("/examples/{example_id}/replay")
+async def replay_example(
+    example_id: str,
+    session_id: Optional[str] = Query(None, description="在该会话已加载的数据上重放；同时上传文件时文件替换会话数据"),
+    file: Optional[UploadFile] = File(None, description="新的数据文件"),
+    example_service: ExampleService = Depends(get_example_service),
+    analysis_service: AnalysisService = Depends(get_analysis_service)
+):
+    """在新数据上直接执行示例保存的代码，数据结构不兼容或执行失败时才调用大模型重新分析"""
+    if file is None and session_id is None:
+        raise HTTPException(status_code=400, detail="请上传数据文件或指定会话")
+    example = await example_service.get_example(example_id)
+    if not example:
+        raise HTTPException(status_code=404, detail="示例不存在")
+    session_id = session_id or f"replay_{uuid.uuid4().hex[:8]}"
+    if file is not None:
+        uploaded = await analysis_service.upload_file(session_id, file)
+        if uploaded.get("status") == "error":
+            raise HTTPException(status_code=400, detail=uploaded.get("message"))
+    result = await analysis_service.replay_example(session_id, example)
+    return {"session_id": session_id, **result}
+
 @router.get("/examples/{example_id}/file/{filename}")
 async def download_example_file(
     example_id: str,
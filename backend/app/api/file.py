@@ -1,9 +1,13 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
 from fastapi.responses import JSONResponse
 import pandas as pd
 from typing import Optional
 import os
 import tempfile
+import asyncio
+from app.services.dataset_cache import DatasetCache
+from app.services.dependencies import get_dataset_cache
+from app.services.upload import save_upload_file, UploadTooLargeError
 
 router = APIRouter()
 
@@ -13,7 +17,10 @@ if not os.path.exists(UPLOAD_DIR):
     os.makedirs(UPLOAD_DIR)
 
 @router.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
+async def upload_file(
+    file: UploadFile = File(...),
+    dataset_cache: DatasetCache = Depends(get_dataset_cache)
+):
     """
     上传CSV或Excel文件
     """
@@ -24,15 +31,15 @@ async def upload_file(file: UploadFile = File(...)):
         
         # 保存文件
         file_path = os.path.join(UPLOAD_DIR, file.filename)
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
+        try:
+            # 分块写入磁盘，同时检查大小限制并计算内容哈希
+            _, content_hash = await save_upload_file(file, file_path)
+        except UploadTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        dataset_cache.remember_hash(file_path, content_hash)
         
-        # 读取文件内容
-        if file.filename.endswith('.csv'):
-            df = pd.read_csv(file_path)
-        else:
-            df = pd.read_excel(file_path)
+        # 读取文件内容，同时生成列式缓存
+        df, _ = await asyncio.to_thread(dataset_cache.load, file_path)
         
         # 获取基本信息
         info = {
@@ -45,10 +52,15 @@ async def upload_file(file: UploadFile = File(...)):
         return JSONResponse(content=info)
     
     except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/info/{filename}")
-async def get_file_info(filename: str):
+async def get_file_info(
+    filename: str,
+    dataset_cache: DatasetCache = Depends(get_dataset_cache)
+):
     """
     获取文件的基本信息
     """
@@ -57,10 +69,8 @@ async def get_file_info(filename: str):
         if not os.path.exists(file_path):
             raise HTTPException(status_code=404, detail="文件不存在")
         
-        if filename.endswith('.csv'):
-            df = pd.read_csv(file_path)
-        else:
-            df = pd.read_excel(file_path)
+        # 优先从列式缓存读取
+        df, _ = await asyncio.to_thread(dataset_cache.load, file_path)
         
         info = {
             "rows": len(df),
@@ -0,0 +1,29 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from typing import List, Optional
+import time
+from ..services.dependencies import get_search_index
+from ..services.search_index import SearchIndex
+
+router = APIRouter()
+
+# 可检索的文档类型
+SEARCH_KINDS = ("example", "query")
+
+@router.get("/search")
+async def search(
+    q: str = Query("", description="检索词，支持中文和英文前缀"),
+    kind: Optional[str] = Query(None, description="只检索某类内容: example（分析示例）/ query（常用查询）"),
+    tag: Optional[List[str]] = Query(None, description="按标签筛选，多个标签时返回同时包含这些标签的内容"),
+    limit: int = Query(20, ge=1, le=100, description="返回的最大数量"),
+    search_index: SearchIndex = Depends(get_search_index)
+):
+    """检索分析示例和常用查询，结果按相关度排序"""
+    if kind is not None and kind not in SEARCH_KINDS:
+        raise HTTPException(status_code=400, detail=f"不支持的检索类型: {kind}")
+    started = time.perf_counter()
+    results = search_index.search(q, kind=kind, tags=tag, limit=limit)
+    return {
+        "query": q,
+        "results": results,
+        "took_ms": round((time.perf_counter() - started) * 1000, 3)
+    }
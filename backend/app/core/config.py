@@ -9,6 +9,27 @@ class Settings:
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
     OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
     
+    # 大模型响应缓存配置
+    LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+    LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", 1000))
+    LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", 86400))  # 缓存有效期（秒）
+    LLM_CACHE_DISK_PATH = os.getenv("LLM_CACHE_DISK_PATH", "")  # 为空时只使用内存缓存，例如 data/llm_cache.sqlite3
+    
+    # 大模型客户端配置
+    LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 60))  # 单次请求超时（秒）
+    LLM_POOL_MAX_CONNECTIONS = int(os.getenv("LLM_POOL_MAX_CONNECTIONS", 20))
+    LLM_POOL_MAX_KEEPALIVE = int(os.getenv("LLM_POOL_MAX_KEEPALIVE", 10))
+    LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", 30))  # 空闲连接保留时间（秒）
+    LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 8))  # 同时进行的请求数上限
+    LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", 0))  # 0表示不限制
+    LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", 0))  # 0表示不限制
+    LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 3))
+    LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", 0.5))  # 指数退避的初始等待（秒）
+    LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", 8))
+    LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"  # 慢请求对冲
+    LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", 0.95))  # 超过近期该分位耗时后发出对冲请求
+    LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", 20))  # 样本不足时不对冲
+    
     # 文件上传配置
     UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
     
@@ -16,6 +37,31 @@ class Settings:
     if not os.path.exists(UPLOAD_DIR):
         os.makedirs(UPLOAD_DIR)
     
+    # 数据集列式缓存目录
+    DATASET_CACHE_DIR = os.getenv("DATASET_CACHE_DIR", "data/dataset_cache")
+    BLOB_STORE_DIR = os.getenv("BLOB_STORE_DIR", "data/blobs")  # 上传文件和示例文件按内容哈希存放的目录
+    BLOB_GC_GRACE_SECONDS = int(os.getenv("BLOB_GC_GRACE_SECONDS", 3600))  # 未引用的文件超过此时间才清理
+    # 不小于此大小的数据文件不整体加载到内存，分析代码通过 LazyFrame 按需读取列式缓存（0表示不启用）
+    OUT_OF_CORE_THRESHOLD_MB = float(os.getenv("OUT_OF_CORE_THRESHOLD_MB", 50))
+    
+    # 分析结果存储配置
+    RESULT_STORE_DIR = os.getenv("RESULT_STORE_DIR", "data/results")
+    RESULT_MEMORY_BUDGET_MB = int(os.getenv("RESULT_MEMORY_BUDGET_MB", 256))  # 内存中结果的总量上限
+    RESULT_DISK_BUDGET_MB = int(os.getenv("RESULT_DISK_BUDGET_MB", 4096))  # 磁盘上结果的总量上限
+    RESULT_SPILL_THRESHOLD_MB = int(os.getenv("RESULT_SPILL_THRESHOLD_MB", 32))  # 超过此大小的结果直接落盘
+    RESULT_TTL = int(os.getenv("RESULT_TTL", 3600))  # 结果保留时间（秒）
+    
+    # 分析代码缓存配置
+    CODE_CACHE_FILE = os.getenv("CODE_CACHE_FILE", "data/code_cache/code_cache.json")
+    CODE_CACHE_MAX_ENTRIES = int(os.getenv("CODE_CACHE_MAX_ENTRIES", 5000))
+    
+    # 数据概要配置
+    DATA_INFO_TOKEN_BUDGET = int(os.getenv("DATA_INFO_TOKEN_BUDGET", 1500))  # 提示词中数据概要的token预算
+    DATA_INFO_SAMPLE_ROWS = int(os.getenv("DATA_INFO_SAMPLE_ROWS", 10))  # 样例数据最多展示的行数
+    
+    # 错误分析等提示词的token预算
+    PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", 3000))
+    
     # 允许的文件类型
     ALLOWED_EXTENSIONS = {'.csv', '.xlsx'}
     
@@ -23,9 +69,45 @@ class Settings:
     MAX_CONTENT_LENGTH = 100 * 1024 * 1024
     
     # 会话配置
-    SESSION_TIMEOUT = 1800  # 30分钟
+    SESSION_TIMEOUT = int(os.getenv("SESSION_TIMEOUT", 1800))  # 30分钟
+    SESSION_MEMORY_BUDGET_MB = int(os.getenv("SESSION_MEMORY_BUDGET_MB", 2048))  # 所有会话数据的内存预算
+    
+    # 状态后端：memory 只在当前进程内有效；sqlite 可被同一台机器上的多个工作进程共享，重启后保留
+    STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+    STATE_DB_PATH = os.getenv("STATE_DB_PATH", "data/state.sqlite3")
+    STATE_TTL = int(os.getenv("STATE_TTL", 7 * 86400))  # 持久化的会话超过此时间未更新则删除（秒）
+
+    # 示例配置
+    EXAMPLE_INDEX_PATH = os.getenv("EXAMPLE_INDEX_PATH", "data/example_index.sqlite3")  # 示例元信息索引
+    SEARCH_INDEX_PATH = os.getenv("SEARCH_INDEX_PATH", "data/search_index.sqlite3")  # 示例和常用查询的检索索引
     
     # 重试配置
     MAX_RETRIES = 5
+    
+    # 并行候选修复：代码执行出错时同时生成多个修复方案，取最先执行成功的一个
+    SPECULATIVE_FIX_ENABLED = os.getenv("SPECULATIVE_FIX_ENABLED", "false").lower() == "true"
+    SPECULATIVE_FIX_CANDIDATES = int(os.getenv("SPECULATIVE_FIX_CANDIDATES", 3))
+    
+    # SQL分析：能用一条SQL完成的查询由嵌入式引擎执行，不适合或失败时回到pandas代码流程
+    # 默认关闭：大模型判断不适合用SQL或SQL失败的查询，要比原流程多一次大模型调用
+    SQL_ANALYSIS_ENABLED = os.getenv("SQL_ANALYSIS_ENABLED", "false").lower() == "true"
+    SQL_ENGINE = os.getenv("SQL_ENGINE", "auto")  # auto / duckdb / sqlite / off
+    SQL_FIX_ATTEMPTS = int(os.getenv("SQL_FIX_ATTEMPTS", 1))  # SQL校验或执行失败后的修复次数
+    SQL_MAX_RESULT_ROWS = int(os.getenv("SQL_MAX_RESULT_ROWS", 100000))  # 查询结果最多返回的行数
+    
+    # 批量分析：同一会话上的多个查询并发分析
+    BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", 4))  # 所有批量请求中同时分析的查询数上限
+    BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", 50))  # 单个批量请求的查询数上限
+    
+    # 日志配置
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+    LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))  # 队列满时丢弃新日志
+    LOG_PAYLOAD_MAX_CHARS = int(os.getenv("LOG_PAYLOAD_MAX_CHARS", 2000))  # 代码、堆栈等内容截断长度
+    LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", 0.1))  # 提示词和模型输出的记录比例
+    
+    # 代码执行引擎配置
+    EXECUTOR_MAX_WORKERS = int(os.getenv("EXECUTOR_MAX_WORKERS", os.cpu_count() or 2))
+    EXECUTOR_TIMEOUT = float(os.getenv("EXECUTOR_TIMEOUT", 120))  # 单次执行超时（秒）
+    EXECUTOR_MEMORY_LIMIT_MB = int(os.getenv("EXECUTOR_MEMORY_LIMIT_MB", 4096))  # 0表示不限制
 
 settings = Settings() 
\ No newline at end of file
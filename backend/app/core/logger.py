@@ -0,0 +1,157 @@
+"""
+结构化日志
+
+日志记录在调用方只做截断和入队，格式化为JSON以及写出由后台线程完成，请求处理路径上的日志开销与内容大小无关。
+每条日志带有当前请求的关联ID，提示词、代码等大段内容按配置截断和抽样记录。
+"""
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+import uuid
+
+from app.core.config import settings
+
+# 当前请求的关联ID
+request_id_var = contextvars.ContextVar("request_id", default="-")
+
+_ROOT_LOGGER = "app"
+
+# 记录标准字段之外附加的结构化字段
+_FIELDS_ATTR = "fields"
+
+_listener = None
+_queue_handler = None
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def set_request_id(request_id: str = None):
+    """设置当前上下文的关联ID，返回用于恢复的token"""
+    return request_id_var.set(request_id or new_request_id())
+
+
+def reset_request_id(token):
+    request_id_var.reset(token)
+
+
+def truncate(text, limit: int = None) -> str:
+    """截断过长的日志内容，保留开头并注明原始长度"""
+    if text is None:
+        return None
+    text = str(text)
+    limit = limit or settings.LOG_PAYLOAD_MAX_CHARS
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}…(共{len(text)}字符)"
+
+
+def sample_payload(text, limit: int = None):
+    """按抽样率决定是否记录大段内容（提示词、模型输出等），未抽中时返回None"""
+    if text is None or random.random() >= settings.LOG_PAYLOAD_SAMPLE_RATE:
+        return None
+    return truncate(text, limit)
+
+
+def get_logger(name: str) -> logging.Logger:
+    """获取应用日志记录器，name 一般为模块名"""
+    if name.startswith(_ROOT_LOGGER + ".") or name == _ROOT_LOGGER:
+        return logging.getLogger(name)
+    return logging.getLogger(f"{_ROOT_LOGGER}.{name}")
+
+
+class JSONFormatter(logging.Formatter):
+    """每条日志输出为一行JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created))
+                    + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage()
+        }
+        fields = getattr(record, _FIELDS_ATTR, None)
+        if fields:
+            entry.update({key: value for key, value in fields.items() if value is not None})
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _RequestIdFilter(logging.Filter):
+    """在调用方线程记录关联ID"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    只入队不格式化的队列处理器
+
+    消息参数在入队时合并为字符串，异常堆栈截断后保存，其余格式化工作交给后台线程。队列满时丢弃日志并计数，不阻塞调用方。
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = truncate(logging.Formatter().formatException(record.exc_info))
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging():
+    """配置应用日志并启动后台写出线程，重复调用时不做任何事"""
+    global _listener, _queue_handler
+    if _listener is not None:
+        return
+
+    log_queue = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+    _queue_handler = _NonBlockingQueueHandler(log_queue)
+    _queue_handler.addFilter(_RequestIdFilter())
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JSONFormatter())
+
+    logger = logging.getLogger(_ROOT_LOGGER)
+    logger.setLevel(settings.LOG_LEVEL.upper())
+    logger.handlers = [_queue_handler]
+    logger.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging():
+    """写出队列中剩余的日志并停止后台线程"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def logging_stats() -> dict:
+    return {
+        "queued": _queue_handler.queue.qsize() if _queue_handler is not None else 0,
+        "dropped": _queue_handler.dropped if _queue_handler is not None else 0
+    }
@@ -0,0 +1,192 @@
+"""
+运行指标
+
+进程内的计数器和直方图，按Prometheus文本格式输出，由 /metrics 接口提供给监控系统抓取。
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+# 耗时直方图的默认分桶（秒），覆盖从毫秒级的代码执行到分钟级的大模型调用
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra: dict = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra.items())
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_series(key, value))
+        return lines
+
+    def _render_series(self, key: tuple, value) -> list:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+
+    type_name = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Histogram(_Metric):
+    """按分桶累计观测值的直方图"""
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+                self._values[key] = series
+            for idx, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["buckets"][idx] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def _render_series(self, key: tuple, value) -> list:
+        lines = []
+        for bound, count in zip(self.buckets, value["buckets"]):
+            labels = _format_labels(self.labelnames, key, {"le": _format_value(bound)})
+            lines.append(f"{self.name}_bucket{labels} {count}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(value['sum'])}")
+        lines.append(f"{self.name}_count{labels} {value['count']}")
+        return lines
+
+
+class Registry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Prometheus文本格式的Content-Type
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+ANALYSIS_STAGE_SECONDS = REGISTRY.register(Histogram(
+    "analysis_stage_duration_seconds",
+    "分析流程各阶段耗时",
+    ["stage", "attempt", "outcome"]
+))
+
+ANALYSIS_REQUESTS = REGISTRY.register(Counter(
+    "analysis_requests_total",
+    "分析请求数",
+    ["outcome"]
+))
+
+LLM_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "llm_request_duration_seconds",
+    "大模型调用耗时",
+    ["purpose", "outcome"]
+))
+
+LLM_REQUESTS = REGISTRY.register(Counter(
+    "llm_requests_total",
+    "大模型调用次数（含缓存命中）",
+    ["purpose", "outcome"]
+))
+
+LLM_TOKENS = REGISTRY.register(Counter(
+    "llm_tokens_total",
+    "大模型token用量，source为usage时取自接口返回，为estimate时为本地估算（流式调用不返回用量）",
+    ["purpose", "type", "source"]
+))
+
+
+LLM_RETRIES = REGISTRY.register(Counter(
+    "llm_retries_total",
+    "大模型调用重试次数",
+    ["error"]
+))
+
+LLM_HEDGED_REQUESTS = REGISTRY.register(Counter(
+    "llm_hedged_requests_total",
+    "发出对冲请求后成功返回的次数，winner为先返回的一方",
+    ["winner"]
+))
+
+LLM_RATE_LIMIT_WAIT_SECONDS = REGISTRY.register(Histogram(
+    "llm_rate_limit_wait_seconds",
+    "大模型调用因本地限流等待的时间"
+))
+
+
+@contextmanager
+def stage_timer(stage: str, attempt: int = 0):
+    """
+    记录一个阶段的耗时
+
+    正常结束记为success，抛出异常记为error；可在代码块内通过 span["outcome"] 修改结果标签。
+    """
+    span = {"outcome": "success"}
+    started = time.perf_counter()
+    try:
+        yield span
+    except BaseException:
+        span["outcome"] = "error"
+        raise
+    finally:
+        ANALYSIS_STAGE_SECONDS.observe(
+            time.perf_counter() - started, stage=stage, attempt=attempt, outcome=span["outcome"]
+        )
+
+
+def render_metrics() -> str:
+    return REGISTRY.render()
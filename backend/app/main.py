@@ -1,11 +1,19 @@
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from app.api import chat, file, analysis, example
+from fastapi.responses import JSONResponse, Response
+from app.api import chat, file, analysis, example, search
 from app.core.config import settings
-from app.services.dependencies import close_llm_service
+from app.core.metrics import render_metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from app.core.logger import setup_logging, shutdown_logging, get_logger, request_id_var, set_request_id, reset_request_id
+from app.services.upload import UploadSizeLimitMiddleware
+from app.services.dependencies import close_llm_service, close_code_executor, close_state_backend, close_search_index, get_code_executor, get_blob_store
+import asyncio
 import traceback
 
+# 日志在后台线程写出，应用创建前完成配置
+setup_logging()
+logger = get_logger(__name__)
+
 app = FastAPI(
     title="智能数据分析对话机器人",
     description="基于大模型的智能数据分析对话平台",
@@ -21,25 +29,58 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 在接收请求体时限制上传大小，超过限制的上传不会被完整接收
+app.add_middleware(UploadSizeLimitMiddleware)
+
+# 为每个请求设置关联ID，日志中据此串联同一请求的记录
+@app.middleware("http")
+async def request_id_middleware(request: Request, call_next):
+    token = set_request_id(request.headers.get("X-Request-ID"))
+    try:
+        response = await call_next(request)
+        response.headers["X-Request-ID"] = request_id_var.get()
+        return response
+    finally:
+        reset_request_id(token)
+
 # 注册路由
 app.include_router(chat.router, prefix="/api/chat", tags=["chat"])
 app.include_router(file.router, prefix="/api/file", tags=["file"])
 app.include_router(analysis.router, prefix="/api/analysis", tags=["analysis"])
 app.include_router(example.router, prefix="/api", tags=["examples"])
+app.include_router(search.router, prefix="/api", tags=["search"])
 
 # 注册启动和关闭事件
+@app.on_event("startup")
+async def startup_event():
+    """应用启动时执行的操作"""
+    # 预热代码执行引擎的子进程池
+    await get_code_executor()
+    # 清理已没有上传文件或示例引用的文件内容
+    await asyncio.to_thread(get_blob_store().collect)
+
 @app.on_event("shutdown")
 async def shutdown_event():
     """应用关闭时执行的操作"""
     await close_llm_service()
+    await close_code_executor()
+    close_state_backend()
+    close_search_index()
+    shutdown_logging()
 
 @app.get("/")
 async def root():
     return {"message": "欢迎使用智能数据分析对话机器人API"}
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus格式的运行指标"""
+    return Response(content=render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
     """全局异常处理"""
+    logger.error("未处理的异常", exc_info=exc, extra={"fields": {"path": request.url.path}})
     return JSONResponse(
         status_code=500,
         content={
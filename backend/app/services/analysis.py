@@ -1,11 +1,24 @@
 import pandas as pd
 import os
+import asyncio
 from dotenv import load_dotenv
 import traceback
 import json
 import time
 import numpy as np
-from app.services.dependencies import get_llm_service
+from app.services.dependencies import get_llm_service, get_code_executor, get_dataset_cache, get_search_index
+from app.services.executor import CodeExecutionError
+from app.services.upload import save_upload_file
+from app.services.session_store import SessionStore
+from app.services.result_store import ResultStore
+from app.services.dataset_cache import schema_fingerprint, schema_mismatches, parse_file
+from app.services.code_cache import CodeCache
+from app.services.profiler import summarize_dataset, summarize_appended
+from app.services.lazy_frame import LazyFrame, prompt_guide
+from app.services import sql_engine
+from app.core.config import settings
+from app.core.logger import get_logger, truncate
+from app.core.metrics import ANALYSIS_REQUESTS, stage_timer
 import matplotlib.pyplot as plt
 import io
 from io import StringIO
@@ -14,35 +27,31 @@ import seaborn as sns
 import shutil
 from fastapi import UploadFile
 import uuid
+import hashlib
+import keyword
+import re
+
+logger = get_logger(__name__)
+
+# 并行候选修复的策略：(策略, 温度)，候选数超过列表长度时循环使用
+SPECULATIVE_FIX_STRATEGIES = [
+    ("fix_code", 0.2),
+    ("analyze_error", 0.5),
+    ("fix_code", 0.9),
+]
+
+# SQL流程不单独生成分析计划，使用固定说明
+SQL_ANALYSIS_PLAN = "直接用SQL查询计算结果"
 
 load_dotenv()
 
 class AnalysisService:
     def __init__(self):
-        self.sessions = {}
+        self.sessions = SessionStore()  # 带内存预算和过期清理的会话存储，元信息写入状态后端
         self.common_queries = {}
-        self.download_cache = {}  # 用于存储可下载的数据
-        # 允许使用的模块
-        self.allowed_modules = {
-            'pandas': pd,
-            'numpy': np
-        }
-        # 允许使用的函数
-        self.allowed_functions = {
-            'len': len,
-            'list': list,
-            'dict': dict,
-            'str': str,
-            'int': int,
-            'float': float,
-            'sum': sum,
-            'min': min,
-            'max': max,
-            'sorted': sorted,
-            'isinstance': isinstance,
-            'print': print,
-            '__import__': self._safe_import  # 添加安全的导入函数
-        }
+        self.result_store = ResultStore(backend=self.sessions.backend)  # 用于存储可下载的数据
+        self.code_cache = CodeCache()  # 执行成功的分析代码
+        self.batch_semaphore = asyncio.Semaphore(settings.BATCH_MAX_CONCURRENCY)  # 批量分析的全局并发名额
         
         # 确保上传目录存在
         os.makedirs("uploads", exist_ok=True)
@@ -50,23 +59,25 @@ class AnalysisService:
         os.makedirs("data/common_queries", exist_ok=True)
         # 加载常用查询
         self._load_common_queries()
+        # 常用查询写入全文检索索引
+        self.search = get_search_index()
+        self._index_common_queries()
     
-    def _safe_import(self, name, *args, **kwargs):
-        """安全的导入函数，只允许导入预定义的模块"""
-        # 只允许导入pandas和numpy
-        allowed_imports = {
-            'pandas': pd,
-            'numpy': np
-        }
-        if name in allowed_imports:
-            return allowed_imports[name]
-        else:
-            raise ImportError(f"导入 '{name}' 被禁止，只允许导入: {', '.join(allowed_imports.keys())}")
-    
-    async def upload_file(self, session_id: str, file: UploadFile) -> dict:
+    async def upload_file(self, session_id: str, file: UploadFile, mode: str = "replace", key: str = None,
+                          name: str = None) -> dict:
         """
         上传文件到服务器
+        
+        mode 为 "replace" 时替换会话数据；为 "append" 时上传的是在原文件末尾追加了新行的完整文件，
+        校验原文件内容为其前缀后只解析新增部分；为 "delta" 时上传的文件只包含新增行。
+        追加时提供 key 则按该列更新已有的行（upsert），其余新行追加在末尾。
+        提供 name 时文件作为会话中的另一个数据集加入数据目录，不替换当前数据（会话还没有数据时作为主数据集）。
         """
+        session = await self.sessions.load(session_id)
+        if name is not None and session and session.get("data_key"):
+            return await self.add_dataset(session_id, session, file, name)
+        if mode != "replace" and session and session.get("data_key"):
+            return await self._upload_delta(session_id, session, file, mode, key)
         try:
             # 创建会话目录
             session_dir = os.path.join("uploads", session_id)
@@ -75,46 +86,42 @@ class AnalysisService:
             # 保存文件
             file_path = os.path.join(session_dir, file.filename)
             
-            # 确保文件流指针在开始位置
-            await file.seek(0)
-            
-            # 将文件内容写入磁盘
-            with open(file_path, "wb") as buffer:
-                # 读取所有内容并写入文件
-                contents = await file.read()
-                buffer.write(contents)
-            
-            # 重置文件指针以便后续操作可以再次读取
-            await file.seek(0)
-            
-            # 加载数据
-            if file.filename.endswith('.csv'):
-                data = pd.read_csv(file_path)
-            elif file.filename.endswith('.xlsx') or file.filename.endswith('.xls'):
-                data = pd.read_excel(file_path)
-            else:
-                # 如果文件格式不支持，删除已创建的文件
-                if os.path.exists(file_path):
-                    os.remove(file_path)
+            # 检查文件格式
+            if not file.filename.endswith(('.csv', '.xlsx', '.xls')):
                 return {
                     "status": "error",
                     "message": "不支持的文件格式，请上传CSV或Excel文件"
                 }
             
+            # 分块写入磁盘，同时检查大小限制并计算内容哈希
+            file_size, content_hash = await save_upload_file(file, file_path)
+            dataset_cache = await get_dataset_cache()
+            dataset_cache.remember_hash(file_path, content_hash)
+            
+            # 加载数据，首次解析时同时生成列式缓存
+            data, content_hash = await asyncio.to_thread(dataset_cache.load, file_path)
+            
             # 生成数据信息
-            data_info = get_data_info(data)
+            data_info = await asyncio.to_thread(get_data_info, data, content_hash)
             
             # 存储会话数据
-            self.sessions[session_id] = {
+            await self.sessions.put(session_id, {
                 "data": data,
                 "data_info": data_info,
+                "data_key": content_hash,  # 数据内容哈希，执行引擎按此键缓存数据
                 "file_path": file_path,
+                "file_size": file_size,  # 原始文件大小，追加上传时据此校验前缀
+                "datasets": session.get("datasets", {}) if session else {},  # 数据目录中的其他数据集
                 "analysis_history": []
-            }
+            })
             
             # 记录日志
-            print(f"文件已保存到: {file_path}")
-            print(f"会话 {session_id} 已成功加载数据: {file.filename}")
+            logger.info("会话已成功加载数据", extra={"fields": {
+                "session_id": session_id,
+                "filename": file.filename,
+                "file_path": file_path,
+                "shape": list(data.shape)
+            }})
             
             # 获取数据详情
             data_details = self.get_data_details(session_id)
@@ -126,15 +133,254 @@ class AnalysisService:
             }
         except Exception as e:
             # 记录错误信息
-            print(f"文件上传失败: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("文件上传失败", extra={"fields": {"session_id": session_id}})
+            
+            return {
+                "status": "error",
+                "message": f"文件上传失败: {str(e)}"
+            }
+    
+    async def add_dataset(self, session_id: str, session: dict, file: UploadFile, name: str) -> dict:
+        """
+        将文件作为命名数据集加入会话的数据目录
+
+        数据只在加入时解析一次，写入列式缓存并生成数据概要后即释放，分析时按变量名在代码中引用。
+        """
+        try:
+            name = dataset_variable_name(name)
+            if name == "df":
+                return {"status": "error", "message": "数据集名称不能为 df"}
+            if not file.filename.endswith(('.csv', '.xlsx', '.xls')):
+                return {"status": "error", "message": "不支持的文件格式，请上传CSV或Excel文件"}
+            
+            session_dir = os.path.join("uploads", session_id, "datasets")
+            os.makedirs(session_dir, exist_ok=True)
+            file_path = os.path.join(session_dir, f"{name}{os.path.splitext(file.filename)[1]}")
+            _, content_hash = await save_upload_file(file, file_path)
+            dataset_cache = await get_dataset_cache()
+            dataset_cache.remember_hash(file_path, content_hash)
+            data, content_hash = await asyncio.to_thread(dataset_cache.load, file_path)
+            
+            entry = {
+                "name": name,
+                "file_name": file.filename,
+                "file_path": file_path,
+                "data_key": content_hash,
+                "data_info": await asyncio.to_thread(get_data_info, data, content_hash),
+                "schema_fingerprint": schema_fingerprint(data),
+                "lazy": isinstance(data, LazyFrame),
+                "shape": {"rows": len(data), "columns": len(data.columns)},
+                "columns": [str(col) for col in data.columns]
+            }
+            # 无法写入列式缓存时只能将数据保留在内存中
+            if dataset_cache.existing_path(content_hash) is None:
+                entry["data"] = data
+            session.setdefault("datasets", {})[name] = entry
+            await self.sessions.save(session_id)
+            
+            logger.info("数据集已加入会话", extra={"fields": {
+                "session_id": session_id,
+                "dataset": name,
+                "shape": list(data.shape)
+            }})
+            return {
+                "status": "success",
+                "message": f"数据集 {name} 已加入会话，可在分析中按名称引用",
+                "dataset": self._dataset_summary(entry)
+            }
+        except Exception as e:
+            logger.exception("加入数据集失败", extra={"fields": {"session_id": session_id}})
+            return {"status": "error", "message": f"文件上传失败: {str(e)}"}
+    
+    async def list_datasets(self, session_id: str):
+        """列出会话数据目录中的数据集，会话不存在时返回None"""
+        session = await self.sessions.load(session_id)
+        if not session:
+            return None
+        return [self._dataset_summary(entry) for entry in session.get("datasets", {}).values()]
+    
+    async def remove_dataset(self, session_id: str, name: str) -> bool:
+        """从会话数据目录中移除数据集"""
+        session = await self.sessions.load(session_id)
+        if not session or name not in session.get("datasets", {}):
+            return False
+        del session["datasets"][name]
+        await self.sessions.save(session_id)
+        return True
+    
+    @staticmethod
+    def _dataset_summary(entry: dict) -> dict:
+        return {
+            "name": entry["name"],
+            "file_name": entry["file_name"],
+            "shape": entry["shape"],
+            "columns": entry["columns"]
+        }
+    
+    @staticmethod
+    def _catalog_refs(session: dict, dataset_cache) -> dict:
+        """执行引擎使用的数据集引用，没有列式缓存的数据集直接提供数据"""
+        refs = {}
+        for name, entry in session.get("datasets", {}).items():
+            data_path = dataset_cache.existing_path(entry["data_key"])
+            if data_path:
+                refs[name] = {"data_key": entry["data_key"], "data_path": data_path, "lazy": entry.get("lazy", False)}
+            elif entry.get("data") is not None:
+                refs[name] = {"data_key": entry["data_key"], "data": entry["data"]}
+            else:
+                # 列式缓存已被清理，从原始文件重新加载
+                data, _ = dataset_cache.load(entry["file_path"])
+                refs[name] = {"data_key": entry["data_key"], "data": data}
+        return refs
+    
+    @staticmethod
+    def _catalog_info(session: dict) -> str:
+        """数据目录中各数据集的概要，附加在提示词的数据信息之后"""
+        datasets = session.get("datasets") or {}
+        if not datasets:
+            return ""
+        parts = ["\n\n以下数据集也可以在代码中直接按变量名使用（df 为主数据集）："]
+        for name, entry in datasets.items():
+            kind = "，大数据集，类型为 LazyFrame，用法同 df" if entry.get("lazy") else ""
+            parts.append(f"\n### 变量 {name}（文件 {entry['file_name']}{kind}）\n{entry['data_info']}")
+        return "\n".join(parts)
+    
+    @staticmethod
+    def _session_fingerprint(session: dict, data: pd.DataFrame) -> str:
+        """主数据集和数据目录共同决定的结构指纹"""
+        fingerprint = schema_fingerprint(data)
+        datasets = session.get("datasets") or {}
+        if not datasets:
+            return fingerprint
+        parts = [fingerprint] + [f"{name}:{entry['schema_fingerprint']}" for name, entry in sorted(datasets.items())]
+        return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+    
+    async def _upload_delta(self, session_id: str, session: dict, file: UploadFile, mode: str, key: str = None) -> dict:
+        """追加上传：只解析新增的行，增量更新列式缓存和数据概要"""
+        try:
+            base = await self.sessions.ensure_data(session_id)
+            base_key = session.get("data_key")
+            base_path = session.get("file_path")
+            base_size = session.get("file_size")
+            if base is None:
+                return {"status": "error", "message": "会话数据不可用，请重新上传完整文件"}
+            if key is not None and key not in base.columns:
+                return {"status": "error", "message": f"主键列 {key} 不存在"}
+            if key is not None and isinstance(base, LazyFrame):
+                return {"status": "error", "message": "大数据集不支持按主键更新，请重新上传完整文件"}
+            
+            session_dir = os.path.join("uploads", session_id)
+            os.makedirs(session_dir, exist_ok=True)
+            stem, ext = os.path.splitext(file.filename)
+            if ext not in ('.csv', '.xlsx', '.xls'):
+                return {"status": "error", "message": "不支持的文件格式，请上传CSV或Excel文件"}
             
+            if mode == "append":
+                # 完整文件：原文件内容必须是新文件的前缀
+                file_path = os.path.join(session_dir, file.filename)
+                appendable = bool(base_path and base_size and base_path.endswith('.csv') and ext == '.csv')
+                file_size, content_hash, prefix_hash = await save_upload_file(
+                    file, file_path, prefix_size=base_size if appendable else 0
+                )
+                dataset_cache = await get_dataset_cache()
+                dataset_cache.remember_hash(file_path, content_hash)
+                if not appendable or prefix_hash != base_key or file_size <= base_size or \
+                        not await asyncio.to_thread(_ends_with_newline, file_path, base_size):
+                    # 无法确认是追加，按替换处理
+                    logger.info("追加上传的文件与原文件前缀不一致，改为替换数据", extra={"fields": {
+                        "session_id": session_id
+                    }})
+                    return await self._replace_session_data(session_id, session, file_path, file_size, content_hash)
+                delta = await asyncio.to_thread(_read_csv_tail, file_path, base_size, list(base.columns))
+                new_file_path = file_path
+            else:
+                # 增量文件：只包含新增的行
+                delta_path = os.path.join(session_dir, f"{stem}.delta-{uuid.uuid4().hex[:8]}{ext}")
+                _, delta_hash = await save_upload_file(file, delta_path)
+                delta = await asyncio.to_thread(parse_file, delta_path)
+                missing = set(base.columns) - set(delta.columns)
+                if missing or len(delta.columns) != len(base.columns):
+                    return {"status": "error", "message": f"增量文件的列与已有数据不一致，缺少: {sorted(map(str, missing))}"}
+                delta = delta[list(base.columns)]
+                content_hash = hashlib.sha256(f"{base_key}+{delta_hash}:{key or ''}".encode("utf-8")).hexdigest()
+                # 增量文件本身不代表完整数据，完整数据只保存在列式缓存中
+                new_file_path = None
+                file_size = None
+            
+            dataset_cache = await get_dataset_cache()
+            if key is not None:
+                # 按主键更新：删除旧行后需要重新写入缓存和扫描统计量
+                data = await asyncio.to_thread(_upsert_frame, base, delta, key)
+                cached = await asyncio.to_thread(dataset_cache.write, content_hash, data)
+                data_info = await asyncio.to_thread(get_data_info, data, content_hash)
+            elif isinstance(base, LazyFrame):
+                # 大数据集只在列式缓存上追加，不加载已有数据
+                cached = await asyncio.to_thread(dataset_cache.append, base_key, content_hash, delta)
+                if not cached:
+                    return {"status": "error", "message": "新增数据的列类型与已有数据不一致，请重新上传完整文件"}
+                data = LazyFrame(dataset_cache.sidecar_path(content_hash))
+                data_info = await asyncio.to_thread(summarize_appended, data, content_hash, base_key, delta)
+            else:
+                data = await asyncio.to_thread(pd.concat, [base, delta], ignore_index=True)
+                cached = await asyncio.to_thread(dataset_cache.append, base_key, content_hash, delta)
+                if not cached:
+                    cached = await asyncio.to_thread(dataset_cache.write, content_hash, data)
+                data_info = await asyncio.to_thread(summarize_appended, data, content_hash, base_key, delta)
+            
+            session.update({
+                "data": data,
+                "data_info": data_info,
+                # 未能写入列式缓存时数据无法重新加载，不设置内容哈希以免被换出
+                "data_key": content_hash if cached or new_file_path else None,
+                "file_path": new_file_path,
+                "file_size": file_size,
+                "file_name": file.filename
+            })
+            await self.sessions.put(session_id, session)
+            
+            logger.info("会话数据已追加", extra={"fields": {
+                "session_id": session_id,
+                "mode": mode,
+                "key": key,
+                "delta_rows": len(delta),
+                "shape": list(data.shape)
+            }})
+            return {
+                "status": "success",
+                "message": f"已追加 {len(delta)} 行数据",
+                "upload_mode": "upsert" if key is not None else mode,
+                "delta_rows": len(delta),
+                "data_details": self.get_data_details(session_id)
+            }
+        except Exception as e:
+            logger.exception("追加上传失败", extra={"fields": {"session_id": session_id}})
             return {
                 "status": "error",
                 "message": f"文件上传失败: {str(e)}"
             }
     
+    async def _replace_session_data(self, session_id: str, session: dict, file_path: str,
+                                    file_size: int, content_hash: str) -> dict:
+        """用已保存的完整文件替换会话数据"""
+        dataset_cache = await get_dataset_cache()
+        data, content_hash = await asyncio.to_thread(dataset_cache.load, file_path)
+        data_info = await asyncio.to_thread(get_data_info, data, content_hash)
+        session.update({
+            "data": data,
+            "data_info": data_info,
+            "data_key": content_hash,
+            "file_path": file_path,
+            "file_size": file_size,
+            "file_name": os.path.basename(file_path)
+        })
+        await self.sessions.put(session_id, session)
+        return {
+            "status": "success",
+            "message": "文件与原数据不是追加关系，已替换会话数据",
+            "upload_mode": "replace",
+            "data_details": self.get_data_details(session_id)
+        }
+    
     async def load_data(self, session_id: str, filename: str) -> dict:
         """
         加载数据文件到内存
@@ -151,27 +397,29 @@ class AnalysisService:
                         "message": f"文件 {filename} 不存在"
                     }
             
-            # 根据文件类型加载数据
-            if filename.endswith('.csv'):
-                data = pd.read_csv(file_path)
-            elif filename.endswith('.xlsx') or filename.endswith('.xls'):
-                data = pd.read_excel(file_path)
-            else:
+            # 检查文件格式
+            if not filename.endswith(('.csv', '.xlsx', '.xls')):
                 return {
                     "status": "error",
                     "message": "不支持的文件格式，请上传CSV或Excel文件"
                 }
             
+            # 优先从列式缓存加载数据
+            dataset_cache = await get_dataset_cache()
+            data, content_hash = await asyncio.to_thread(dataset_cache.load, file_path)
+            
             # 生成数据信息
-            data_info = get_data_info(data)
+            data_info = await asyncio.to_thread(get_data_info, data, content_hash)
             
             # 存储会话数据
-            self.sessions[session_id] = {
+            await self.sessions.put(session_id, {
                 "data": data,
                 "data_info": data_info,
+                "data_key": content_hash,  # 数据内容哈希，执行引擎按此键缓存数据
                 "file_path": file_path,
+                "file_size": os.path.getsize(file_path),
                 "analysis_history": []
-            }
+            })
             
             # 获取数据详情
             data_details = self.get_data_details(session_id)
@@ -193,23 +441,25 @@ class AnalysisService:
         加载数据文件到指定会话（兼容旧接口）
         """
         try:
-            if file_path.endswith('.csv'):
-                data = pd.read_csv(file_path)
-            elif file_path.endswith('.xlsx'):
-                data = pd.read_excel(file_path)
-            else:
+            if not file_path.endswith(('.csv', '.xlsx')):
                 raise ValueError("不支持的文件格式")
             
+            # 优先从列式缓存加载数据
+            dataset_cache = await get_dataset_cache()
+            data, content_hash = await asyncio.to_thread(dataset_cache.load, file_path)
+            
             # 生成数据信息
-            data_info = get_data_info(data)
+            data_info = await asyncio.to_thread(get_data_info, data, content_hash)
             
             # 存储会话数据
-            self.sessions[session_id] = {
+            await self.sessions.put(session_id, {
                 "data": data,
                 "data_info": data_info,
+                "data_key": content_hash,  # 数据内容哈希，执行引擎按此键缓存数据
                 "file_path": file_path,
+                "file_size": os.path.getsize(file_path),
                 "analysis_history": []
-            }
+            })
             
             return {
                 "status": "success",
@@ -232,7 +482,7 @@ class AnalysisService:
         if df is None:
             return None
         
-        info = get_data_info(df)
+        info = get_data_info(df, session.get("data_key"))
         return info
     
     def get_data_details(self, session_id: str):
@@ -247,7 +497,7 @@ class AnalysisService:
         
         # 获取文件路径
         file_path = session.get("file_path", "")
-        file_name = os.path.basename(file_path) if file_path else "unknown"
+        file_name = session.get("file_name") or (os.path.basename(file_path) if file_path else "unknown")
         
         # 处理前10行数据，将 nan 值替换为空字符串
         sample_data = df.head(10).fillna('').to_dict(orient='records')
@@ -261,33 +511,301 @@ class AnalysisService:
             },
             "columns": df.columns.tolist(),
             "dtypes": df.dtypes.astype(str).to_dict(),
-            "sample_data": sample_data
+            "sample_data": sample_data,
+            "out_of_core": isinstance(df, LazyFrame),
+            "datasets": [self._dataset_summary(entry) for entry in session.get("datasets", {}).values()]
         }
         
         return details
     
-    async def analyze(self, query: str, session_id: str):
+    @staticmethod
+    def _emit(emit, event: str, data):
+        """向流式接口推送事件（未提供emit时忽略）"""
+        if emit is not None:
+            emit(event, data)
+    
+    @staticmethod
+    def _token_emitter(emit, stage: str):
+        """大模型逐token输出的回调，stage标明当前所处步骤"""
+        if emit is None:
+            return None
+        return lambda content: emit("token", {"stage": stage, "content": content})
+    
+    async def _speculative_fix(self, current_code, error_message, traceback_message,
+            data, data_info, attempt, analysis_record, attempts_history, query,
+            data_key=None, data_path=None, emit=None, datasets=None):
+        """
+        并行候选修复
+
+        按不同策略和温度同时生成多个修复方案，各自在执行引擎的独立子进程中运行，取最先执行成功的一个，
+        其余候选立即取消。全部失败时返回None，由调用方回到逐步修复流程。
+        """
+        llm_service = await get_llm_service()
+        code_executor = await get_code_executor()
+        error = f"{error_message}\n{traceback_message}"
+        
+        async def run_candidate(strategy, temperature):
+            if strategy == "fix_code":
+                code = await llm_service.fix_code(
+                    code=current_code, error=error, query=query, data_info=data_info,
+                    temperature=temperature
+                )
+            else:
+                error_analysis = await llm_service.analyze_error(
+                    code=current_code, error=error, temperature=temperature
+                )
+                if error_analysis["plan"] == "获取信息":
+                    # 获取信息后再分析一次
+                    info_result = await code_executor.run(
+                        error_analysis["code"], data=data, data_key=data_key,
+                        data_path=data_path, mode="info", datasets=datasets
+                    )
+                    error_analysis = await llm_service.analyze_error(
+                        code=current_code, error=error_message, info_code=error_analysis["code"],
+                        run_info_result=info_result, temperature=temperature
+                    )
+                if error_analysis["plan"] != "修复代码":
+                    raise CodeExecutionError("候选修复未给出修复后的代码")
+                code = error_analysis["code"]
+            try:
+                result = await code_executor.run(code, data=data, data_key=data_key, data_path=data_path,
+                                                 datasets=datasets)
+            except CodeExecutionError as e:
+                # 附带候选代码，便于记录尝试历史
+                e.code = code
+                raise
+            return strategy, temperature, code, result
+        
+        candidates = [
+            SPECULATIVE_FIX_STRATEGIES[idx % len(SPECULATIVE_FIX_STRATEGIES)]
+            for idx in range(max(1, settings.SPECULATIVE_FIX_CANDIDATES))
+        ]
+        tasks = [asyncio.create_task(run_candidate(strategy, temperature)) for strategy, temperature in candidates]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                try:
+                    strategy, temperature, code, result = await next_done
+                except Exception as e:
+                    if isinstance(e, CodeExecutionError):
+                        candidate_error, candidate_traceback = e.error_message, e.traceback
+                    else:
+                        candidate_error, candidate_traceback = f"{type(e).__name__}: {str(e)}", ""
+                    logger.info("候选修复失败", extra={"fields": {
+                        "attempt": attempt,
+                        "error": truncate(candidate_error)
+                    }})
+                    if getattr(e, "code", None):
+                        attempts_history.append({
+                            "code": e.code,
+                            "error": candidate_error,
+                            "traceback": candidate_traceback
+                        })
+                    continue
+                
+                self._append_step(analysis_record, {
+                    "type": "fixed_code",
+                    "content": code,
+                    "attempt": attempt,
+                    "reason": f"并行生成的{len(tasks)}个候选修复中最先执行成功的方案（策略: {strategy}, 温度: {temperature}）"
+                }, emit)
+                return {
+                    'status': 'fixed_code',
+                    'code': code,
+                    'attempt': attempt,
+                    'executed_result': result
+                }
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        
+        self._append_step(analysis_record, {
+            "type": "fix_error",
+            "content": f"并行生成的{len(tasks)}个候选修复均执行失败，改为逐步分析错误",
+            "attempt": attempt
+        }, emit)
+        return None
+    
+    def _append_step(self, analysis_record, step: dict, emit=None):
+        """记录分析步骤，并在流式接口中立即推送"""
+        analysis_record["process_steps"].append(step)
+        self._emit(emit, "step", step)
+    
+    async def analyze(self, query: str, session_id: str, emit=None):
         """
         分析用户查询
+        
+        emit(event, data) 为可选的事件回调，用于流式接口实时推送大模型token和每个分析步骤。
+        各阶段耗时和请求结果记录到运行指标中。
+        """
+        with stage_timer("total") as span:
+            try:
+                response = await self._analyze(query, session_id, emit)
+            finally:
+                # 已完成的分析历史追加写入状态后端
+                await self.sessions.save(session_id)
+            span["outcome"] = response.get("status", "error")
+        ANALYSIS_REQUESTS.inc(outcome=span["outcome"])
+        return response
+    
+    async def analyze_batch(self, queries: list, session_id: str, on_result=None):
         """
+        并发分析同一会话上的多个查询
+
+        所有批量请求共用 BATCH_MAX_CONCURRENCY 个并发名额，大模型调用另受客户端的并发上限约束，
+        代码在执行引擎的子进程池中并行执行。各查询共用会话中已加载的数据和数据概要，相同的查询只分析一次。
+        on_result(result) 在每个查询完成时调用，result 为 {"index", "query", "elapsed", "response"}。
+        返回 {"status", "results": 按输入顺序排列的结果, "timings": 汇总耗时}。
+        """
+        started = time.perf_counter()
+        session = await self.sessions.load(session_id)
+        # 开始前确保数据已加载，避免各查询同时重新加载
+        if not session or await self.sessions.ensure_data(session_id) is None:
+            return {"status": "error", "message": f"会话 {session_id} 未加载数据，请先上传数据文件"}
+        
+        unique_queries = list(dict.fromkeys(queries))
+        results = [None] * len(queries)
+        durations = []
+        
+        async def run_query(query):
+            async with self.batch_semaphore:
+                query_started = time.perf_counter()
+                try:
+                    response = await self.analyze(query, session_id)
+                except Exception as e:
+                    response = {"status": "error", "message": f"分析过程出错: {str(e)}"}
+                return query, response, time.perf_counter() - query_started
+        
+        tasks = [asyncio.create_task(run_query(query)) for query in unique_queries]
         try:
-            # 获取会话数据
-            session = self.sessions.get(session_id)
+            for next_done in asyncio.as_completed(tasks):
+                query, response, elapsed = await next_done
+                durations.append(elapsed)
+                for index, item in enumerate(queries):
+                    if item != query:
+                        continue
+                    results[index] = {"index": index, "query": query, "elapsed": round(elapsed, 3), "response": response}
+                    if on_result is not None:
+                        on_result(results[index])
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        
+        succeeded = sum(1 for item in results if item["response"].get("status") == "success")
+        wall = time.perf_counter() - started
+        timings = {
+            "total": round(wall, 3),
+            "sum": round(sum(durations), 3),
+            "max": round(max(durations, default=0.0), 3),
+            "mean": round(sum(durations) / len(durations), 3) if durations else 0.0,
+            # 逐个串行分析所需时间与实际耗时之比
+            "speedup": round(sum(durations) / wall, 2) if wall > 0 else 0.0
+        }
+        logger.info("批量分析完成", extra={"fields": {
+            "session_id": session_id,
+            "queries": len(queries),
+            "unique_queries": len(unique_queries),
+            "succeeded": succeeded,
+            "timings": timings
+        }})
+        return {
+            "status": "success" if succeeded == len(results) else "partial" if succeeded else "error",
+            "succeeded": succeeded,
+            "failed": len(results) - succeeded,
+            "results": results,
+            "timings": timings
+        }
+    
+    async def replay_example(self, session_id: str, example: dict, emit=None):
+        """
+        在会话当前的数据上重放示例保存的最终代码，不调用大模型
+
+        会话数据需包含示例记录的列且类型大类一致。数据不兼容、示例没有代码或代码执行失败时，
+        以示例的用户需求走完整的分析流程。返回结果的 replay 字段说明是否直接重放及回到大模型流程的原因。
+        """
+        session = await self.sessions.load(session_id)
+        data = await self.sessions.ensure_data(session_id) if session else None
+        if data is None:
+            return {"status": "error", "message": f"会话 {session_id} 未加载数据，请先上传数据文件"}
+        
+        process = example.get("analysisProcess") or {}
+        query = process.get("userQuery") or example.get("name") or ""
+        code = process.get("code")
+        language = process.get("code_language") or (
+            "sql" if any(step.get("type") == "sql" for step in process.get("process_steps") or []) else "python"
+        )
+        reason = self._replay_blocker(process, data)
+        response = None
+        if reason is None:
+            dataset_cache = await get_dataset_cache()
+            data_path = dataset_cache.existing_path(session.get("data_key"))
+            datasets = await asyncio.to_thread(self._catalog_refs, session, dataset_cache)
+            with stage_timer("replay") as span:
+                try:
+                    response = await self._run_stored_code(
+                        session_id, session, query, code, language, process.get("plan"), data, data_path, "replayed_code",
+                        emit, datasets
+                    )
+                    reason = None if response else "没有可用的SQL引擎"
+                except CodeExecutionError as e:
+                    reason = f"示例代码执行失败: {e.error_message}"
+                finally:
+                    await self.sessions.save(session_id)
+                span["outcome"] = "success" if response else "fallback"
+        
+        if response:
+            ANALYSIS_REQUESTS.inc(outcome="success")
+            # 相同结构数据上的相同需求之后可直接命中代码缓存
+            await self.code_cache.put(self._session_fingerprint(session, data), query, code, process.get("plan"),
+                                      language=language)
+            response["replay"] = {"replayed": True, "example_id": example.get("id")}
+            return response
+        
+        logger.info("示例无法直接重放，改为调用大模型分析", extra={"fields": {
+            "session_id": session_id,
+            "example_id": example.get("id"),
+            "reason": truncate(reason)
+        }})
+        self._emit(emit, "step", {"type": "replay_fallback", "content": reason})
+        if not query:
+            return {"status": "error", "message": f"示例无法直接重放（{reason}），且没有记录用户需求"}
+        response = await self.analyze(query, session_id, emit)
+        response["replay"] = {"replayed": False, "example_id": example.get("id"), "reason": reason}
+        return response
+    
+    @staticmethod
+    def _replay_blocker(process: dict, data):
+        """示例不能直接在数据上重放的原因，可以重放时返回None；示例没有记录数据结构时直接尝试执行"""
+        if not process.get("code"):
+            return "示例没有保存代码"
+        recorded = (process.get("originalFile") or {}).get("data_details") or {}
+        problems = schema_mismatches(recorded.get("columns") or [], recorded.get("dtypes") or {}, data)
+        if problems:
+            return "数据与示例不兼容: " + "; ".join(problems[:5]) + (" 等" if len(problems) > 5 else "")
+        return None
+    
+    async def _analyze(self, query: str, session_id: str, emit=None):
+        """分析流程"""
+        try:
+            # 获取会话数据，先载入其他工作进程的更新
+            session = await self.sessions.load(session_id)
             if not session:
                 # 如果会话不存在，创建一个空会话
-                self.sessions[session_id] = {
+                await self.sessions.put(session_id, {
                     "data": None,
                     "data_info": None,
                     "file_path": None,
                     "analysis_history": []
-                }
+                })
                 # 返回更友好的错误消息
                 return {
                     "status": "error",
                     "message": f"会话 {session_id} 未加载数据，请先上传数据文件"
                 }
             
-            data = session["data"]
+            # 数据可能因内存预算被换出，此处透明地重新加载
+            data = await self.sessions.ensure_data(session_id)
             data_info = session["data_info"]
             
             if data is None:
@@ -296,21 +814,69 @@ class AnalysisService:
                     "message": "请先上传并加载数据文件"
                 }
             
+            # 列式缓存文件，执行引擎的子进程可直接从中加载数据
+            dataset_cache = await get_dataset_cache()
+            data_path = dataset_cache.existing_path(session.get("data_key"))
+            
+            # 会话中的其他数据集，代码引用到时才在子进程中加载
+            datasets = await asyncio.to_thread(self._catalog_refs, session, dataset_cache)
+            catalog_info = self._catalog_info(session)
+            sql_data_info = data_info + catalog_info
+            
+            # 大数据集以 LazyFrame 提供给分析代码，需要在提示词中说明用法
+            if isinstance(data, LazyFrame):
+                data_info = prompt_guide() + "\n\n" + data_info
+            data_info = data_info + catalog_info
+            
+            # 数据结构指纹，相同结构上的相同查询可直接复用缓存的代码或大模型响应
+            fingerprint = self._session_fingerprint(session, data)
+            
+            # 优先执行相同结构数据上已成功的代码，失败时再走大模型流程
+            cached_entry = self.code_cache.get(fingerprint, query)
+            if cached_entry:
+                with stage_timer("cached_code") as span:
+                    cached_response = await self._run_cached_code(
+                        session_id, session, query, fingerprint, cached_entry, data, data_path, emit, datasets
+                    )
+                    span["outcome"] = "hit" if cached_response else "miss"
+                if cached_response:
+                    return cached_response
+            
+            # 能用一条SQL完成的查询由嵌入式引擎直接执行，不适合或失败时回到生成pandas代码的流程；
+            # 明显需要绘图、建模的需求不尝试SQL
+            engine = sql_engine.engine_name(data) if sql_engine.suits_sql(query) else None
+            if engine:
+                with stage_timer("sql") as span:
+                    sql_response = await self._analyze_sql(
+                        session_id, session, query, fingerprint, sql_data_info, engine, data, data_path, datasets, emit
+                    )
+                    span["outcome"] = "success" if sql_response else "fallback"
+                if sql_response:
+                    return sql_response
+            
             # 获取LLM服务
             llm_service = await get_llm_service()
             
             # 生成分析计划
-            analysis_plan = await llm_service.generate_analysis_plan(
-                data_info=data_info,
-                query=query
-            )
+            with stage_timer("generate_plan"):
+                analysis_plan = await llm_service.generate_analysis_plan(
+                    data_info=data_info,
+                    query=query,
+                    schema_fingerprint=fingerprint,
+                    on_token=self._token_emitter(emit, "analysis_plan")
+                )
+            self._emit(emit, "step", {"type": "analysis_plan", "content": analysis_plan})
             
             # 生成分析代码
-            analysis_code = await llm_service.generate_analysis_code(
-                analysis_plan=analysis_plan,
-                data_info=data_info,
-                query=query
-            )
+            with stage_timer("generate_code"):
+                analysis_code = await llm_service.generate_analysis_code(
+                    analysis_plan=analysis_plan,
+                    data_info=data_info,
+                    query=query,
+                    schema_fingerprint=fingerprint,
+                    on_token=self._token_emitter(emit, "initial_code")
+                )
+            self._emit(emit, "step", {"type": "initial_code", "content": analysis_code})
             
             # 先记录初始流程，后续会根据执行情况更新
             analysis_record = {
@@ -332,7 +898,7 @@ class AnalysisService:
                 ]
             }
             
-            # 添加到会话历史
+            # 添加到本进程的会话历史，分析结束后再追加写入状态后端
             session["analysis_history"].append(analysis_record)
             
             # 开始执行和错误处理流程
@@ -342,45 +908,51 @@ class AnalysisService:
             
             # 当前正在处理的代码
             current_code = analysis_code
+            # 并行候选修复中已执行成功的结果，无需再次执行
+            executed_result = None
             
             while attempt < max_attempts:
                 attempt += 1
                 
                 try:
-                    # 创建一个隔离的命名空间
-                    code_globals = {
-                        "pd": pd,
-                        "np": np,
-                        "StringIO": StringIO,
-                        "io": io,
-                        "base64": base64,
-                    }
-        
-                    # 创建一个临时模块来执行代码
-                    import sys
-                    module = type(sys)('data_analysis_module')
-                    # 打印执行的代码
-                    print(f"\n=============== 执行分析代码 (尝试 {attempt}/{max_attempts}) ===============")
-                    print(current_code)
-                    print("==========================================\n")
-                    code_obj = compile(current_code, '<string>', 'exec')
-                    local_vars = {"df": session["data"]}
-                    exec(code_obj, code_globals, local_vars)
-                    
-                    # 获取分析结果
-                    result = local_vars.get("result", None)
+                    logger.debug("执行分析代码", extra={"fields": {
+                        "session_id": session_id,
+                        "attempt": attempt,
+                        "max_attempts": max_attempts,
+                        "code": truncate(current_code)
+                    }})
+                    # 在执行引擎的子进程中运行代码，事件循环只等待结果
+                    if executed_result is not None:
+                        result = executed_result["value"]
+                        executed_result = None
+                    else:
+                        code_executor = await get_code_executor()
+                        with stage_timer("execute", attempt):
+                            result = await code_executor.run(
+                                current_code,
+                                data=data,
+                                data_key=session.get("data_key"),
+                                data_path=data_path,
+                                datasets=datasets
+                            )
                     
                     # 格式化结果
-                    formatted_result = self._format_result(result)
+                    with stage_timer("format_result", attempt):
+                        formatted_result = await self._format_result(result)
                     
                     # 更新分析记录
                     analysis_record["result"] = formatted_result
                     analysis_record["status"] = "success"
-                    analysis_record["process_steps"].append({
+                    self._append_step(analysis_record, {
                         "type": "success",
                         "content": "代码执行成功",
                         "attempt": attempt
-                    })
+                    }, emit)
+                    
+                    self.sessions.add_history(session_id, analysis_record)
+                    
+                    # 记录最终可用的代码，相同结构数据上的相同查询可直接复用
+                    await self.code_cache.put(fingerprint, query, current_code, analysis_plan)
                     
                     # 执行成功，返回结果
                     return {
@@ -392,14 +964,21 @@ class AnalysisService:
                     }
                 
                 except Exception as e:
-                    error_message = f"{type(e).__name__}: {str(e)}"
-                    traceback_message = traceback.format_exc()
+                    if isinstance(e, CodeExecutionError):
+                        # 子进程中的错误信息和堆栈
+                        error_message = e.error_message
+                        traceback_message = e.traceback
+                    else:
+                        error_message = f"{type(e).__name__}: {str(e)}"
+                        traceback_message = traceback.format_exc()
                     
-                    # 记录完整错误信息用于调试
-                    print(f"\n=============== 执行错误 (尝试 {attempt}/{max_attempts}) ===============")
-                    print(error_message)
-                    print(traceback_message)
-                    print("==========================================\n")
+                    logger.warning("分析代码执行错误", extra={"fields": {
+                        "session_id": session_id,
+                        "attempt": attempt,
+                        "max_attempts": max_attempts,
+                        "error": truncate(error_message),
+                        "traceback": truncate(traceback_message)
+                    }})
                     
                     # 记录本次尝试
                     attempt_record = {
@@ -409,41 +988,56 @@ class AnalysisService:
                     }
                     attempts_history.append(attempt_record)
                     
+                    if len(attempts_history) == 1:
+                        # 大模型生成的代码执行失败，不再让相同的查询从缓存中得到同样的计划和代码
+                        await llm_service.forget_analysis(data_info=data_info, query=query,
+                                                          analysis_plan=analysis_plan,
+                                                          schema_fingerprint=fingerprint)
+                    
                     # 更新流程记录
-                    analysis_record["process_steps"].append({
+                    self._append_step(analysis_record, {
                         "type": "error",
                         "content": error_message,
                         "traceback": traceback_message,
                         "attempt": attempt
-                    })
+                    }, emit)
                     
                     # 如果已达到最大尝试次数，退出循环
                     if attempt >= max_attempts:
                         break
 
-                    result = await self.process_error(current_code, error_message, traceback_message,
-                        data, data_info, max_attempts, attempt, analysis_record, attempts_history, query)
+                    with stage_timer("process_error", attempt) as span:
+                        result = await self.process_error(current_code, error_message, traceback_message,
+                            data, data_info, max_attempts, attempt, analysis_record, attempts_history, query,
+                            data_key=session.get("data_key"), data_path=data_path, emit=emit,
+                            datasets=datasets)
+                        span["outcome"] = result['status']
                     if result['status'] == 'fixed_code':
                         current_code = result['code']
                         attempt = result['attempt']
+                        if 'executed_result' in result:
+                            executed_result = {"value": result['executed_result']}
                     else: # result['status'] == 'max_retry':
                         break
 
             # 如果达到最大尝试次数仍未成功
             # 生成用户友好的错误分析和建议
-            user_notice = await llm_service.notify_user_too_many_attempts(
-                original_code=analysis_code,
-                attempts_history=attempts_history,
-                query=query
-            )
+            with stage_timer("notify_user", attempt):
+                user_notice = await llm_service.notify_user_too_many_attempts(
+                    original_code=analysis_code,
+                    attempts_history=attempts_history,
+                    query=query,
+                    on_token=self._token_emitter(emit, "user_notice")
+                )
             
             # 更新分析记录
             analysis_record["status"] = "failed_max_attempts"
             analysis_record["user_notice"] = user_notice
-            analysis_record["process_steps"].append({
+            self._append_step(analysis_record, {
                 "type": "user_notice",
                 "content": user_notice
-            })
+            }, emit)
+            self.sessions.add_history(session_id, analysis_record)
             
             return {
                 "status": "error",
@@ -459,19 +1053,21 @@ class AnalysisService:
             error_message = f"{type(e).__name__}: {str(e)}"
             traceback_msg = traceback.format_exc()
             
-            print(f"\n=============== 分析过程异常 ===============")
-            print(error_message)
-            print(traceback_msg)
-            print("==========================================\n")
+            logger.error("分析过程异常", extra={"fields": {
+                "session_id": session_id,
+                "error": truncate(error_message),
+                "traceback": truncate(traceback_msg)
+            }})
             
             # 如果已创建分析记录，更新状态
             if 'analysis_record' in locals():
                 analysis_record["status"] = "error"
                 analysis_record["error_message"] = error_message
-                analysis_record["process_steps"].append({
+                self._append_step(analysis_record, {
                     "type": "process_error",
                     "content": error_message
-                })
+                }, emit)
+                self.sessions.add_history(session_id, analysis_record)
             
             return {
                 "status": "error",
@@ -479,88 +1075,261 @@ class AnalysisService:
                 "process_steps": analysis_record["process_steps"] if 'analysis_record' in locals() else []
             }
     
+    async def _run_cached_code(self, session_id, session, query, fingerprint, cached_entry, data, data_path,
+                               emit=None, datasets=None):
+        """执行缓存的代码，成功时返回分析结果，失败时返回None以回到大模型流程"""
+        try:
+            response = await self._run_stored_code(
+                session_id, session, query, cached_entry["code"], cached_entry.get("language", "python"),
+                cached_entry.get("plan"), data, data_path, "cached_code", emit, datasets
+            )
+        except CodeExecutionError as e:
+            self.code_cache.failures += 1
+            logger.info("缓存代码执行失败，改为调用大模型生成", extra={"fields": {"error": truncate(e.error_message)}})
+            return None
+        if response:
+            self.code_cache.record_hit(fingerprint, query)
+        return response
+    
+    async def _run_stored_code(self, session_id, session, query, code, language, analysis_plan, data, data_path,
+                               step_type, emit=None, datasets=None):
+        """
+        不经过大模型直接执行已有的代码，成功时返回分析结果并记入分析历史
+
+        执行失败时抛出 CodeExecutionError；SQL代码在没有可用引擎时返回None。
+        """
+        if language == "sql" and not sql_engine.engine_name(data):
+            return None
+        code_executor = await get_code_executor()
+        result = await code_executor.run(
+            code,
+            data=data,
+            data_key=session.get("data_key"),
+            data_path=data_path,
+            mode="sql" if language == "sql" else "analysis",
+            datasets=datasets
+        )
+        if language == "sql":
+            result = result["result"]
+        
+        formatted_result = await self._format_result(result)
+        process_steps = [
+            {
+                "type": "analysis_plan",
+                "content": analysis_plan
+            },
+            {
+                "type": step_type,
+                "content": code
+            },
+            {
+                "type": "success",
+                "content": "代码执行成功",
+                "attempt": 1
+            }
+        ]
+        for step in process_steps:
+            self._emit(emit, "step", step)
+        self.sessions.add_history(session_id, {
+            "timestamp": time.time(),
+            "query": query,
+            "plan": analysis_plan,
+            "code": code,
+            "result": formatted_result,
+            "status": "success",
+            "process_steps": process_steps
+        })
+        return {
+            "status": "success",
+            "analysis_plan": analysis_plan,
+            "analysis_code": code,
+            "code_language": language,
+            "result": formatted_result,
+            "process_steps": process_steps
+        }
+    
+    async def _analyze_sql(self, session_id, session, query, fingerprint, data_info, engine, data, data_path, datasets,
+                           emit=None):
+        """
+        SQL分析流程：生成SQL，在执行引擎的子进程中校验并执行
+
+        大模型判断需求不适合用SQL完成，或SQL经过 SQL_FIX_ATTEMPTS 次修复仍失败时返回None，由调用方回到pandas代码流程。
+        """
+        llm_service = await get_llm_service()
+        code_executor = await get_code_executor()
+        with stage_timer("generate_sql"):
+            sql = sql_engine.extract_sql(await llm_service.generate_sql(
+                data_info=data_info, query=query, engine=engine, schema_fingerprint=fingerprint,
+                on_token=self._token_emitter(emit, "sql")
+            ))
+        
+        process_steps = []
+        
+        def add_step(step):
+            process_steps.append(step)
+            self._emit(emit, "step", step)
+        
+        attempt = 0
+        while True:
+            attempt += 1
+            if sql.upper().startswith(sql_engine.NO_SQL):
+                if attempt > 1:
+                    # 修复时判断不适合用SQL，之后相同的需求不再尝试
+                    await llm_service.reject_sql(data_info, query, engine, fingerprint)
+                logger.debug("需求不适合用SQL完成，使用pandas代码流程", extra={"fields": {"query": truncate(query)}})
+                return None
+            add_step({"type": "sql", "content": sql, "attempt": attempt})
+            try:
+                # 先在主进程做只读检查，明显不合规的SQL不必发送给子进程
+                sql = sql_engine.check_read_only(sql)
+                with stage_timer("execute_sql", attempt):
+                    outcome = await code_executor.run(
+                        sql, data=data, data_key=session.get("data_key"), data_path=data_path,
+                        mode="sql", datasets=datasets
+                    )
+                break
+            except (sql_engine.SQLValidationError, CodeExecutionError) as e:
+                if isinstance(e, CodeExecutionError):
+                    error_message = e.error_message
+                else:
+                    error_message = f"SQLValidationError: {e}"
+                logger.info("SQL查询失败", extra={"fields": {
+                    "attempt": attempt,
+                    "error": truncate(error_message),
+                    "sql": truncate(sql)
+                }})
+                add_step({"type": "sql_error", "content": error_message, "attempt": attempt})
+                if attempt > settings.SQL_FIX_ATTEMPTS:
+                    # SQL修复后仍失败，之后相同的需求直接走代码流程
+                    await llm_service.reject_sql(data_info, query, engine, fingerprint)
+                    self._emit(emit, "step", {"type": "sql_fallback", "content": "SQL查询未能完成，改为生成Python代码分析"})
+                    return None
+                with stage_timer("fix_sql", attempt):
+                    sql = sql_engine.extract_sql(await llm_service.fix_sql(
+                        sql=sql, error=error_message, query=query, data_info=data_info, engine=engine,
+                        on_token=self._token_emitter(emit, "sql")
+                    ))
+        
+        formatted_result = await self._format_result(outcome["result"])
+        add_step({"type": "sql_plan", "content": outcome["plan"]})
+        add_step({
+            "type": "success",
+            "content": "SQL查询执行成功" + ("（结果已截断）" if outcome["truncated"] else ""),
+            "attempt": attempt,
+            "timings": outcome["timings"]
+        })
+        await self.code_cache.put(fingerprint, query, sql, SQL_ANALYSIS_PLAN, language="sql")
+        self.sessions.add_history(session_id, {
+            "timestamp": time.time(),
+            "query": query,
+            "plan": SQL_ANALYSIS_PLAN,
+            "code": sql,
+            "code_language": "sql",
+            "result": formatted_result,
+            "status": "success",
+            "process_steps": process_steps
+        })
+        logger.info("SQL查询完成", extra={"fields": {
+            "engine": outcome["engine"],
+            "attempt": attempt,
+            "timings": outcome["timings"]
+        }})
+        return {
+            "status": "success",
+            "analysis_plan": SQL_ANALYSIS_PLAN,
+            "analysis_code": sql,
+            "code_language": "sql",
+            "query_plan": outcome["plan"],
+            "timings": outcome["timings"],
+            "result": formatted_result,
+            "process_steps": process_steps
+        }
+    
     async def process_error(self, current_code, error_message, traceback_message, 
             data, data_info, max_attempts, attempt, analysis_record, 
-            attempts_history, query):
+            attempts_history, query, data_key=None, data_path=None, emit=None, datasets=None):
         llm_service = await get_llm_service()
+        code_executor = await get_code_executor()
+        if settings.SPECULATIVE_FIX_ENABLED:
+            with stage_timer("speculative_fix", attempt) as span:
+                result = await self._speculative_fix(current_code, error_message, traceback_message,
+                    data, data_info, attempt, analysis_record, attempts_history, query,
+                    data_key=data_key, data_path=data_path, emit=emit, datasets=datasets)
+                span["outcome"] = "fixed" if result else "all_failed"
+            if result:
+                return result
         try:
             # 进入处理错误流程。
-            error_analysis = await llm_service.analyze_error(
-                code=current_code, 
-                error=f"{error_message}\n{traceback_message}"
-            )
+            with stage_timer("analyze_error", attempt):
+                error_analysis = await llm_service.analyze_error(
+                    code=current_code, 
+                    error=f"{error_message}\n{traceback_message}",
+                    on_token=self._token_emitter(emit, "error_analysis")
+                )
             while attempt < max_attempts and error_analysis['plan'] == '获取信息':
                 # 记录大模型的判断
-                analysis_record["process_steps"].append({
+                self._append_step(analysis_record, {
                     "type": "error_analysis",
                     "content": error_analysis,
                     "attempt": attempt
-                })
+                }, emit)
                 
                 info_code = error_analysis["code"]
                 
-                analysis_record["process_steps"].append({
+                self._append_step(analysis_record, {
                     "type": "info_code",
                     "content": info_code,
                     "attempt": attempt
-                })
+                }, emit)
                 
                 # 执行获取信息的代码
                 try:
-                    info_globals = {
-                        '__builtins__': self.allowed_functions,
-                        **self.allowed_modules
-                    }
-                    info_locals = {"df": data}
-                    
-                    # 创建一个StringIO对象来捕获print输出
-                    info_output = StringIO()
+                    # 在执行引擎的子进程中运行，返回代码的打印输出
+                    with stage_timer("execute_info", attempt):
+                        info_result = await code_executor.run(
+                            info_code,
+                            data=data,
+                            data_key=data_key,
+                            data_path=data_path,
+                            mode="info",
+                            datasets=datasets
+                        )
                     
-                    # 修改代码，将结果打印出来
-                    info_code_with_print = info_code
-                    
-                    # 重定向标准输出到StringIO
-                    import sys
-                    original_stdout = sys.stdout
-                    sys.stdout = info_output
-                    
-                    # 执行代码
-                    exec(info_code_with_print, info_globals, info_locals)
-                    
-                    # 恢复标准输出
-                    sys.stdout = original_stdout
-                    
-                    # 获取输出内容
-                    info_result = info_output.getvalue()
-                    
-                    analysis_record["process_steps"].append({
+                    self._append_step(analysis_record, {
                         "type": "info_result",
                         "content": info_result,
                         "attempt": attempt
-                    })
+                    }, emit)
                     
                     # 使用获取的信息继续分析下一步结果。
-                    error_analysis = await llm_service.analyze_error(
-                        code=current_code,
-                        error=error_message,
-                        info_code=info_code,
-                        run_info_result=info_result
-                    )
+                    with stage_timer("analyze_error", attempt):
+                        error_analysis = await llm_service.analyze_error(
+                            code=current_code,
+                            error=error_message,
+                            info_code=info_code,
+                            run_info_result=info_result,
+                            on_token=self._token_emitter(emit, "error_analysis")
+                        )
                     attempt += 1
 
                 except Exception as info_error:
                     # 获取信息时出错，记录错误
-                    info_error_message = f"{type(info_error).__name__}: {str(info_error)}"
-                    traceback_message = traceback.format_exc()
-                    print(f"\n=============== 获取信息时出错 ===============")
-                    print(info_error_message)
-                    print(traceback_message)
-                    print("==========================================\n")
-                    analysis_record["process_steps"].append({
+                    if isinstance(info_error, CodeExecutionError):
+                        info_error_message = info_error.error_message
+                        traceback_message = info_error.traceback
+                    else:
+                        info_error_message = f"{type(info_error).__name__}: {str(info_error)}"
+                        traceback_message = traceback.format_exc()
+                    logger.warning("获取信息时出错", extra={"fields": {
+                        "attempt": attempt,
+                        "error": truncate(info_error_message),
+                        "traceback": truncate(traceback_message)
+                    }})
+                    self._append_step(analysis_record, {
                         "type": "info_error",
                         "content": info_error_message,
                         "attempt": attempt
-                    })
+                    }, emit)
 
                     attempt_record = {
                         "code": info_code,
@@ -574,18 +1343,19 @@ class AnalysisService:
                         code=current_code,
                         error_message=error_message,
                         info_code=info_code,
-                        run_info_result="{info_error_message}\n{traceback_message}"
+                        run_info_result="{info_error_message}\n{traceback_message}",
+                        on_token=self._token_emitter(emit, "error_analysis")
                     )
                     attempt += 1
 
             if error_analysis['plan'] == '修复代码':
                 fixed_code = error_analysis['code']
-                analysis_record["process_steps"].append({
+                self._append_step(analysis_record, {
                     "type": "fixed_code",
                     "content": fixed_code,
                     "attempt": attempt,
                     "reason": error_analysis.get("reason", "")
-                })
+                }, emit)
                 result = {
                     'status': 'fixed_code',
                     'code': fixed_code,
@@ -600,30 +1370,33 @@ class AnalysisService:
             # 修复代码时出错，直接使用fix_code方法
             fix_error_message = f"{type(fix_error).__name__}: {str(fix_error)}"
             traceback_message = traceback.format_exc()
-            print(f"\n=============== 修复代码时出错 ===============")
-            print(fix_error_message)
-            print(traceback_message)
-            print("==========================================\n")
-            analysis_record["process_steps"].append({
+            logger.warning("修复代码时出错", extra={"fields": {
+                "attempt": attempt,
+                "error": truncate(fix_error_message),
+                "traceback": truncate(traceback_message)
+            }})
+            self._append_step(analysis_record, {
                 "type": "fix_error",
                 "content": fix_error_message,
                 "traceback": traceback_message,
                 "attempt": attempt
-            })
+            }, emit)
             
             # 降级为使用简单的修复方法
-            fixed_code = await llm_service.fix_code(
-                code=current_code,
-                error=error_message,
-                query=query,
-                data_info=data_info
-            )
+            with stage_timer("fix_code", attempt):
+                fixed_code = await llm_service.fix_code(
+                    code=current_code,
+                    error=error_message,
+                    query=query,
+                    data_info=data_info,
+                    on_token=self._token_emitter(emit, "fixed_code_fallback")
+                )
             
-            analysis_record["process_steps"].append({
+            self._append_step(analysis_record, {
                 "type": "fixed_code_fallback",
                 "content": fixed_code,
                 "attempt": attempt
-            })
+            }, emit)
 
             result = {
                 'status': 'fixed_code',
@@ -633,7 +1406,7 @@ class AnalysisService:
 
         return result
 
-    def _format_result(self, result):
+    async def _format_result(self, result):
         """格式化分析结果"""
         if result is None:
             return None
@@ -641,8 +1414,7 @@ class AnalysisService:
             # 限制预览数据为30行
             preview_data = result.head(30).fillna('').to_dict(orient='records')
             # 生成完整数据的下载链接
-            download_id = str(uuid.uuid4())
-            self.download_cache[download_id] = result
+            download_id = await self.result_store.put(result)
             return {
                 "type": "dataframe",
                 "preview_data": preview_data,
@@ -666,9 +1438,9 @@ class AnalysisService:
                 "data": str(result)
             }
     
-    def get_analysis_history(self, session_id: str):
-        """获取分析历史"""
-        session = self.sessions.get(session_id)
+    async def get_analysis_history(self, session_id: str):
+        """获取分析历史，包括其他工作进程中完成的分析"""
+        session = await self.sessions.load(session_id)
         if not session:
             return []
         return session.get("analysis_history", [])
@@ -683,7 +1455,7 @@ class AnalysisService:
             else:
                 self.common_queries = {}
         except Exception as e:
-            print(f"加载常用查询失败: {str(e)}")
+            logger.warning("加载常用查询失败", extra={"fields": {"error": str(e)}})
             self.common_queries = {}
     
     def _save_common_queries(self):
@@ -693,11 +1465,35 @@ class AnalysisService:
             with open(common_queries_file, 'w', encoding='utf-8') as f:
                 json.dump(self.common_queries, f, ensure_ascii=False, indent=2)
         except Exception as e:
-            print(f"保存常用查询失败: {str(e)}")
+            logger.warning("保存常用查询失败", extra={"fields": {"error": str(e)}})
     
-    def save_common_query(self, session_id: str, query: str, name: str = None):
+    @staticmethod
+    def _common_query_doc_id(session_id: str, query: str) -> str:
+        return f"query:{session_id}:{hashlib.sha1(query.encode('utf-8')).hexdigest()[:16]}"
+
+    def _index_common_query(self, session_id: str, query_data: dict):
+        self.search.put(
+            self._common_query_doc_id(session_id, query_data["query"]), "query",
+            fields={"name": query_data.get("name"), "query": query_data["query"]},
+            title=query_data.get("name"),
+            meta={"sessionId": session_id, "query": query_data["query"], "timestamp": query_data.get("timestamp")},
+            version=query_data.get("timestamp")
+        )
+
+    def _index_common_queries(self):
+        """使检索索引中的常用查询与文件中的一致"""
+        present = set()
+        for session_id, queries in self.common_queries.items():
+            for query_data in queries:
+                present.add(self._common_query_doc_id(session_id, query_data["query"]))
+                self._index_common_query(session_id, query_data)
+        for doc_id in self.search.versions("query"):
+            if doc_id not in present:
+                self.search.remove(doc_id)
+
+    async def save_common_query(self, session_id: str, query: str, name: str = None):
         """保存常用查询"""
-        session = self.sessions.get(session_id)
+        session = await self.sessions.load(session_id)
         if not session:
             return {"status": "error", "message": "会话不存在"}
         
@@ -720,24 +1516,25 @@ class AnalysisService:
         
         # 保存到文件
         self._save_common_queries()
+        self._index_common_query(session_id, query_data)
         
         # 更新会话中的引用
         session["common_queries"] = self.common_queries[session_id]
         
         return {"status": "success", "message": "查询保存成功"}
     
-    def get_common_queries(self, session_id: str):
+    async def get_common_queries(self, session_id: str):
         """获取常用查询列表"""
-        session = self.sessions.get(session_id)
+        session = await self.sessions.load(session_id)
         if not session:
             return []
         
         # 直接从全局存储获取
         return self.common_queries.get(session_id, [])
     
-    def delete_common_query(self, session_id: str, query: str):
+    async def delete_common_query(self, session_id: str, query: str):
         """删除常用查询"""
-        session = self.sessions.get(session_id)
+        session = await self.sessions.load(session_id)
         if not session:
             return {"status": "error", "message": "会话不存在"}
         
@@ -747,44 +1544,53 @@ class AnalysisService:
         # 从全局存储中删除
         self.common_queries[session_id] = [q for q in self.common_queries[session_id] if q["query"] != query]
         self._save_common_queries()
+        self.search.remove(self._common_query_doc_id(session_id, query))
         
         # 更新会话中的引用
         session["common_queries"] = self.common_queries[session_id]
         
         return {"status": "success", "message": "查询删除成功"}
     
-    def list_sessions(self):
+    async def list_sessions(self):
         """列出所有会话"""
-        return list(self.sessions.keys())
+        return await self.sessions.ids()
     
-    def close_session(self, session_id: str):
+    async def close_session(self, session_id: str):
         """关闭会话"""
-        if session_id in self.sessions:
-            del self.sessions[session_id]
+        if await self.sessions.remove(session_id):
             return {"status": "success", "message": f"会话 {session_id} 已关闭"}
         return {"status": "error", "message": f"会话 {session_id} 不存在"}
     
 
-def get_data_info(df):
-    """获取数据的基本信息"""
-    info_output = StringIO()
-    
-    # 记录基本信息
-    df_info = StringIO()
-    df.info(buf=df_info)
-    print(df_info.getvalue(), file=info_output)
-    
-    # 查看数据集行数和列数
-    rows, columns = df.shape
-    print(f"\n数据规模: {rows}行 × {columns}列", file=info_output)
-    
-    if rows < 100 and columns < 20:
-        # 短表数据查看全量数据信息
-        print('\n数据全部内容信息：', file=info_output)
-        print(df.to_csv(sep='\t', index=False, na_rep='nan'), file=info_output)
-    else:
-        # 长表数据查看数据前几行信息
-        print('\n数据前几行内容信息：', file=info_output)
-        print(df.head(10).to_csv(sep='\t', index=False, na_rep='nan'), file=info_output)
-    
-    return info_output.getvalue()
\ No newline at end of file
+def dataset_variable_name(name: str) -> str:
+    """将数据集名称规范为合法的Python变量名"""
+    name = re.sub(r"\W", "_", os.path.splitext(name.strip())[0]) or "dataset"
+    if name[0].isdigit() or keyword.iskeyword(name):
+        name = f"df_{name}"
+    return name
+
+
+def _ends_with_newline(file_path: str, size: int) -> bool:
+    """文件前 size 字节是否以换行结尾（即原文件的最后一行是完整的）"""
+    with open(file_path, "rb") as f:
+        f.seek(size - 1)
+        return f.read(1) == b"\n"
+
+
+def _read_csv_tail(file_path: str, offset: int, columns: list) -> pd.DataFrame:
+    """只解析CSV文件 offset 之后的内容"""
+    with open(file_path, "rb") as f:
+        f.seek(offset)
+        return pd.read_csv(f, header=None, names=columns)
+
+
+def _upsert_frame(base: pd.DataFrame, delta: pd.DataFrame, key: str) -> pd.DataFrame:
+    """按主键合并：delta中的行替换base中主键相同的行，其余追加在末尾"""
+    delta = delta.drop_duplicates(subset=[key], keep="last")
+    kept = base[~base[key].isin(delta[key])]
+    return pd.concat([kept, delta], ignore_index=True)
+
+
+def get_data_info(df, data_key: str = None):
+    """获取数据的基本信息（按token预算生成的数据概要，提供数据内容哈希时复用已生成的概要）"""
+    return summarize_dataset(df, data_key)
@@ -0,0 +1,198 @@
+"""
+内容寻址的文件存储
+
+上传的文件和示例保存的原始文件按内容的SHA-256存放一份（blobs/哈希前两位/哈希），
+上传目录和示例目录中的文件都是指向它的硬链接：相同内容的文件只占用一份磁盘空间，保存时也不需要复制数据。
+文件系统不支持硬链接（如跨设备）时尝试reflink共享数据块，仍不支持时才复制。
+
+硬链接数即引用计数：存储中的文件只剩自身一个链接时表示已没有上传文件或示例引用它，由 collect 清理。
+存储中的文件设为只读，写入新内容总是先写临时文件再替换路径，不会通过链接改动共享的数据。
+"""
+import errno
+import os
+import shutil
+import stat
+import threading
+import time
+import uuid
+
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.services.dataset_cache import file_hash
+
+try:
+    import fcntl
+except ImportError:  # 非Linux平台不支持reflink
+    fcntl = None
+
+logger = get_logger(__name__)
+
+# Linux 的 FICLONE ioctl，在支持的文件系统（btrfs、xfs等）上共享数据块
+FICLONE = 0x40049409
+
+
+def _reflink(src: str, dest: str) -> bool:
+    if fcntl is None:
+        return False
+    try:
+        with open(src, "rb") as source, open(dest, "wb") as target:
+            fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+        return True
+    except OSError:
+        if os.path.exists(dest):
+            os.remove(dest)
+        return False
+
+
+class BlobStore:
+    """按SHA-256存放文件内容，其他目录中的文件以硬链接引用"""
+
+    def __init__(self, root: str = None):
+        self.root = root or settings.BLOB_STORE_DIR
+        os.makedirs(self.root, exist_ok=True)
+        self._lock = threading.Lock()
+        # 各种共享方式的次数
+        self.linked = 0
+        self.reflinked = 0
+        self.copied = 0
+
+    def blob_path(self, content_hash: str) -> str:
+        return os.path.join(self.root, content_hash[:2], content_hash)
+
+    def ingest(self, src_path: str, content_hash: str) -> str:
+        """
+        将已写完的文件（通常是临时文件）放入存储，返回存储中的路径
+
+        内容已存在时删除 src_path，直接使用已有的文件。
+        """
+        with self._lock:
+            return self._ingest(src_path, content_hash)
+
+    def ingest_and_link(self, src_path: str, content_hash: str, dest_path: str) -> str:
+        """
+        将文件放入存储并在 dest_path 创建指向它的文件，返回存储中的路径
+
+        两步在同一把锁内完成：放入存储后、链接建立前，存储中的文件只有一个链接，不能让 collect 在此期间清理它。
+        """
+        with self._lock:
+            path = self._ingest(src_path, content_hash)
+            self._share(path, dest_path)
+        return path
+
+    def adopt(self, file_path: str, content_hash: str = None) -> str:
+        """
+        将已有的普通文件纳入存储，返回内容哈希
+
+        内容已存在时 file_path 改为指向已有文件的链接，否则存储直接链接到该文件，不复制数据。
+        """
+        content_hash = content_hash or file_hash(file_path)
+        path = self.blob_path(content_hash)
+        with self._lock:
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                try:
+                    os.link(file_path, path)
+                except OSError:
+                    # 不支持硬链接时存储中保留一份副本，file_path 保持不变
+                    shutil.copyfile(file_path, path)
+                os.chmod(path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+                return content_hash
+            if not os.path.samefile(path, file_path):
+                self._share(path, file_path)
+        return content_hash
+
+    def link(self, content_hash: str, dest_path: str):
+        """在 dest_path 创建指向存储中内容的文件，已存在的 dest_path 被原子替换"""
+        with self._lock:
+            self._share(self.blob_path(content_hash), dest_path)
+
+    def share(self, src_path: str, dest_path: str):
+        """
+        让 dest_path 与 src_path 共享同一份内容
+
+        src_path 不在存储中（没有其他链接）时先纳入存储，之后相同内容的上传也能复用。
+        """
+        if os.stat(src_path).st_nlink == 1:
+            content_hash = self.adopt(src_path)
+            src_path = self.blob_path(content_hash)
+        self._share(src_path, dest_path)
+
+    def collect(self, grace_seconds: float = None) -> dict:
+        """
+        清理已没有引用的内容
+
+        只剩存储自身一个链接、且链接数超过 grace_seconds 未变化的文件被删除，避免与正在进行的链接操作冲突。
+        """
+        grace_seconds = settings.BLOB_GC_GRACE_SECONDS if grace_seconds is None else grace_seconds
+        cutoff = time.time() - grace_seconds
+        removed = 0
+        freed = 0
+        kept = 0
+        with self._lock:
+            for directory, _, files in os.walk(self.root):
+                for name in files:
+                    path = os.path.join(directory, name)
+                    try:
+                        info = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    # 链接数变化会更新ctime
+                    if info.st_nlink == 1 and info.st_ctime < cutoff:
+                        os.remove(path)
+                        removed += 1
+                        freed += info.st_size
+                    else:
+                        kept += 1
+        if removed:
+            logger.info("已清理未引用的文件", extra={"fields": {"removed": removed, "freed_bytes": freed}})
+        return {"removed": removed, "freed_bytes": freed, "kept": kept}
+
+    def stats(self) -> dict:
+        blobs = 0
+        size = 0
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                blobs += 1
+                size += os.stat(os.path.join(directory, name)).st_size
+        return {
+            "blobs": blobs, "bytes": size,
+            "linked": self.linked, "reflinked": self.reflinked, "copied": self.copied
+        }
+
+    def _ingest(self, src_path: str, content_hash: str) -> str:
+        """ingest 的实现，调用方需持有锁"""
+        path = self.blob_path(content_hash)
+        if os.path.exists(path):
+            os.remove(src_path)
+            return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.replace(src_path, path)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            shutil.move(src_path, path)
+        os.chmod(path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        return path
+
+    def _share(self, src_path: str, dest_path: str):
+        """依次尝试硬链接、reflink、复制，先建立临时文件再替换 dest_path"""
+        directory = os.path.dirname(dest_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{dest_path}.{uuid.uuid4().hex[:8]}.part"
+        try:
+            try:
+                os.link(src_path, tmp_path)
+                self.linked += 1
+            except OSError:
+                if _reflink(src_path, tmp_path):
+                    self.reflinked += 1
+                else:
+                    shutil.copyfile(src_path, tmp_path)
+                    self.copied += 1
+            os.replace(tmp_path, dest_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
@@ -1,10 +1,13 @@
-from app.services.dependencies import get_llm_service
+from app.services.dependencies import get_llm_service, get_state_backend
 import uuid
 
 class ChatService:
-    def __init__(self):
-        # 存储不同会话的消息历史
-        self.sessions = {}
+    # 状态后端中对话历史的命名空间
+    NAMESPACE = "chat"
+    
+    def __init__(self, backend=None):
+        # 不同会话的消息历史保存在状态后端中，多个工作进程共享
+        self.store = backend or get_state_backend()
     
     async def chat(self, message: str, session_id: str = None):
         """
@@ -15,12 +18,8 @@ class ChatService:
             if not session_id:
                 session_id = str(uuid.uuid4())
             
-            # 确保会话存在
-            if session_id not in self.sessions:
-                self.sessions[session_id] = []
-            
-            # 获取当前会话的消息历史
-            messages = self.sessions[session_id]
+            # 获取当前会话的消息历史，会话不存在时创建
+            messages = self.store.get(self.NAMESPACE, session_id) or []
             
             # 添加用户消息到历史记录
             messages.append({"role": "user", "content": message})
@@ -33,6 +32,7 @@ class ChatService:
             
             # 添加AI响应到历史记录
             messages.append({"role": "assistant", "content": response})
+            self.store.put(self.NAMESPACE, session_id, messages)
             
             return {
                 "response": response,
@@ -51,11 +51,11 @@ class ChatService:
         """
         清空指定会话的对话历史
         """
-        if session_id and session_id in self.sessions:
-            self.sessions[session_id] = []
+        if session_id and self.store.version(self.NAMESPACE, session_id) is not None:
+            self.store.put(self.NAMESPACE, session_id, [])
             return {"status": "success", "message": "对话历史已清空"}
         elif not session_id:
-            self.sessions = {}
+            self.store.clear(self.NAMESPACE)
             return {"status": "success", "message": "所有会话历史已清空"}
         else:
             return {"status": "error", "message": "指定的会话不存在"}
@@ -64,10 +64,11 @@ class ChatService:
         """
         获取指定会话的历史记录
         """
-        if session_id in self.sessions:
+        history = self.store.get(self.NAMESPACE, session_id)
+        if history is not None:
             return {
                 "status": "success", 
-                "history": self.sessions[session_id]
+                "history": history
             }
         return {
             "status": "error", 
@@ -80,14 +81,14 @@ class ChatService:
         """
         return {
             "status": "success",
-            "sessions": list(self.sessions.keys())
+            "sessions": self.store.keys(self.NAMESPACE)
         }
     
     def close_session(self, session_id: str):
         """
         关闭并删除指定会话
         """
-        if session_id in self.sessions:
-            del self.sessions[session_id]
+        if self.store.version(self.NAMESPACE, session_id) is not None:
+            self.store.delete(self.NAMESPACE, session_id)
             return {"status": "success", "message": f"会话 {session_id} 已关闭"}
         return {"status": "error", "message": f"会话 {session_id} 不存在"} 
\ No newline at end of file
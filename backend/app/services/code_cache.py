@@ -0,0 +1,123 @@
+"""
+分析代码缓存
+
+记录 (数据结构指纹, 规范化查询) -> 最终执行成功的代码（包括经过错误修复的代码）。
+相同结构的数据上再次执行相同查询时直接运行缓存的代码，失败时才回到大模型流程。
+"""
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.services.llm_cache import normalize_text
+
+logger = get_logger(__name__)
+
+
+class CodeCache:
+    """持久化的成功代码缓存"""
+
+    def __init__(self, storage_file: str = None, max_entries: int = None):
+        self.storage_file = storage_file or settings.CODE_CACHE_FILE
+        self.max_entries = max_entries or settings.CODE_CACHE_MAX_ENTRIES
+        directory = os.path.dirname(self.storage_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+        # 并发的 put 在线程中保存，依次写入，较早的快照不会覆盖较新的
+        self._save_lock = threading.Lock()
+        self._generation = 0
+        self._saved_generation = 0
+        self._load()
+
+    @staticmethod
+    def key(schema_fingerprint: str, query: str) -> str:
+        raw = f"{schema_fingerprint}\n{normalize_text(query).lower()}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _load(self):
+        """加载代码缓存"""
+        try:
+            if os.path.exists(self.storage_file):
+                with open(self.storage_file, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+        except Exception as e:
+            logger.warning("加载代码缓存失败", extra={"fields": {"error": str(e)}})
+            self.entries = {}
+
+    def _save(self, entries: dict, generation: int):
+        """保存代码缓存到文件，先写入唯一命名的临时文件再替换"""
+        with self._save_lock:
+            if generation <= self._saved_generation:
+                # 更新的快照已经写入
+                return
+            tmp_file = None
+            try:
+                directory = os.path.dirname(self.storage_file) or "."
+                with tempfile.NamedTemporaryFile(
+                    "w", encoding="utf-8", dir=directory, prefix=os.path.basename(self.storage_file) + ".",
+                    suffix=".tmp", delete=False
+                ) as f:
+                    tmp_file = f.name
+                    json.dump(entries, f, ensure_ascii=False, indent=2)
+                os.replace(tmp_file, self.storage_file)
+                self._saved_generation = generation
+            except Exception as e:
+                if tmp_file and os.path.exists(tmp_file):
+                    os.remove(tmp_file)
+                logger.warning("保存代码缓存失败", extra={"fields": {"error": str(e)}})
+
+    def get(self, schema_fingerprint: str, query: str):
+        """查找缓存的代码，未命中返回None"""
+        entry = self.entries.get(self.key(schema_fingerprint, query))
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    async def put(self, schema_fingerprint: str, query: str, code: str, plan: str = None,
+                  language: str = "python"):
+        """记录执行成功的代码，language 为 python 或 sql"""
+        key = self.key(schema_fingerprint, query)
+        entry = self.entries.get(key, {"hits": 0})
+        entry.update({
+            "query": query,
+            "schema_fingerprint": schema_fingerprint,
+            "code": code,
+            "plan": plan,
+            "language": language,
+            "updated": time.time()
+        })
+        self.entries[key] = entry
+        # 超出上限时删除最久未更新的代码
+        if len(self.entries) > self.max_entries:
+            oldest = sorted(self.entries, key=lambda k: self.entries[k]["updated"])
+            for stale_key in oldest[:len(self.entries) - self.max_entries]:
+                del self.entries[stale_key]
+        # 各条目复制一份作为快照，写入期间事件循环中的修改不影响正在写入的内容
+        self._generation += 1
+        snapshot = {entry_key: dict(value) for entry_key, value in self.entries.items()}
+        await asyncio.to_thread(self._save, snapshot, self._generation)
+
+    def record_hit(self, schema_fingerprint: str, query: str):
+        """缓存代码执行成功，增加命中次数"""
+        entry = self.entries.get(self.key(schema_fingerprint, query))
+        if entry is not None:
+            entry["hits"] = entry.get("hits", 0) + 1
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "failures": self.failures
+        }
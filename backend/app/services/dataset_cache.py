@@ -0,0 +1,264 @@
+"""
+数据集列式缓存
+
+上传的CSV/Excel文件在首次解析后转换为 Arrow IPC (Feather v2) 格式的旁路文件，
+以文件内容的SHA-256为键存放。之后的加载直接内存映射读取旁路文件，只有缓存未命中时才重新解析原始文件。
+"""
+import hashlib
+import os
+import threading
+
+import pandas as pd
+
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.services.lazy_frame import LazyFrame
+
+try:
+    import pyarrow as pa
+    from pyarrow import feather
+except ImportError:  # 未安装pyarrow时退化为直接解析原始文件
+    pa = None
+    feather = None
+
+logger = get_logger(__name__)
+
+# 计算哈希时每次读取的块大小
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# 分块解析CSV时每块的行数
+CSV_CHUNK_ROWS = 100000
+
+
+def file_hash(file_path: str) -> str:
+    """分块计算文件内容的SHA-256"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def schema_fingerprint(df: pd.DataFrame) -> str:
+    """数据结构指纹：只由列名和列类型决定，与具体数据无关"""
+    schema = "|".join(f"{col}:{dtype}" for col, dtype in zip(df.columns, df.dtypes.astype(str)))
+    return hashlib.sha256(schema.encode("utf-8")).hexdigest()
+
+
+def _dtype_family(dtype) -> str:
+    """类型大类：整数和浮点数同属数值，字符串、类别等同属对象"""
+    try:
+        kind = pd.api.types.pandas_dtype(str(dtype)).kind
+    except TypeError:
+        return str(dtype)
+    return {"i": "number", "u": "number", "f": "number", "b": "bool", "M": "datetime", "m": "timedelta"}.get(kind, "object")
+
+
+def schema_mismatches(columns: list, dtypes: dict, df) -> list:
+    """
+    检查数据是否包含记录的列且类型大类一致，返回不兼容之处的说明（兼容时为空列表）
+
+    数据可以有额外的列；dtypes 缺失的列只检查是否存在。
+    """
+    actual = {str(col): dtype for col, dtype in zip(df.columns, df.dtypes)}
+    problems = []
+    for col in columns:
+        col = str(col)
+        if col not in actual:
+            problems.append(f"缺少列 {col!r}")
+        elif dtypes and col in dtypes and _dtype_family(dtypes[col]) != _dtype_family(actual[col]):
+            problems.append(f"列 {col!r} 类型由 {dtypes[col]} 变为 {actual[col]}")
+    return problems
+
+
+def parse_file(file_path: str) -> pd.DataFrame:
+    """使用原始解析器读取CSV/Excel文件"""
+    if file_path.endswith('.csv'):
+        return pd.read_csv(file_path)
+    elif file_path.endswith('.xlsx') or file_path.endswith('.xls'):
+        return pd.read_excel(file_path)
+    raise ValueError("不支持的文件格式，请上传CSV或Excel文件")
+
+
+class DatasetCache:
+    """以内容哈希为键的列式旁路缓存"""
+
+    def __init__(self, cache_dir: str = None):
+        self.cache_dir = cache_dir or settings.DATASET_CACHE_DIR
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # (路径, 大小, 修改时间) -> 内容哈希，避免未变化的文件重复计算哈希
+        self._hash_index = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return feather is not None
+
+    def sidecar_path(self, content_hash: str) -> str:
+        """内容哈希对应的旁路文件路径"""
+        return os.path.join(self.cache_dir, f"{content_hash}.arrow")
+
+    def existing_path(self, content_hash: str):
+        """旁路文件存在时返回其路径，否则返回None"""
+        if not content_hash:
+            return None
+        path = self.sidecar_path(content_hash)
+        return path if os.path.exists(path) else None
+
+    def content_hash(self, file_path: str) -> str:
+        """获取文件内容哈希，文件未变化时直接使用已记录的结果"""
+        stat = os.stat(file_path)
+        key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            cached = self._hash_index.get(key)
+        if cached:
+            return cached
+        digest = file_hash(file_path)
+        with self._lock:
+            self._hash_index[key] = digest
+        return digest
+
+    def remember_hash(self, file_path: str, content_hash: str):
+        """记录已在其他环节计算好的文件哈希（如上传时边写边算），避免再次读取整个文件"""
+        stat = os.stat(file_path)
+        key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            self._hash_index[key] = content_hash
+
+    def read(self, content_hash: str):
+        """内存映射读取旁路文件，不存在时返回None"""
+        path = self.sidecar_path(content_hash)
+        if not self.enabled or not os.path.exists(path):
+            return None
+        try:
+            table = feather.read_table(path, memory_map=True)
+            return table.to_pandas()
+        except Exception as e:
+            logger.warning("读取列式缓存失败，回退到原始文件", extra={"fields": {"error": str(e)}})
+            return None
+
+    def write(self, content_hash: str, df: pd.DataFrame) -> bool:
+        """写入旁路文件（不压缩，以便内存映射），无法转换的数据返回False"""
+        if not self.enabled:
+            return False
+        path = self.sidecar_path(content_hash)
+        tmp_path = self._tmp_path(path)
+        try:
+            feather.write_feather(df, tmp_path, compression="uncompressed")
+            os.replace(tmp_path, path)
+            return True
+        except Exception as e:
+            # 混合类型列、非字符串列名等无法转换为Arrow的数据不做缓存
+            logger.warning("写入列式缓存失败，将不使用缓存", extra={"fields": {"error": str(e)}})
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+
+    def _tmp_path(self, path: str) -> str:
+        return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    def convert_csv(self, file_path: str, content_hash: str) -> bool:
+        """
+        分块解析CSV并逐块写入旁路文件，解析过程中只保留一个数据块
+
+        以第一块推断的列类型为准，后续块类型不一致时返回False，由调用方整体解析。
+        """
+        if not self.enabled:
+            return False
+        path = self.sidecar_path(content_hash)
+        tmp_path = self._tmp_path(path)
+        writer = None
+        schema = None
+        try:
+            for chunk in pd.read_csv(file_path, chunksize=CSV_CHUNK_ROWS):
+                table = pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+                if writer is None:
+                    schema = table.schema
+                    writer = pa.ipc.new_file(tmp_path, schema)
+                writer.write_table(table)
+            if writer is None:
+                return False
+            writer.close()
+            writer = None
+            os.replace(tmp_path, path)
+            return True
+        except Exception as e:
+            logger.warning("分块转换CSV失败，改为整体解析", extra={"fields": {"error": str(e)}})
+            return False
+        finally:
+            if writer is not None:
+                writer.close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def append(self, base_hash: str, content_hash: str, delta: pd.DataFrame) -> bool:
+        """
+        在 base_hash 的旁路文件之后追加新数据，写为 content_hash 的旁路文件
+
+        已有数据以内存映射的记录批次原样写出，不做解析和类型转换，只有新增数据需要转换。
+        旁路文件不存在或新增数据无法转换为已有的列类型时返回False。
+        """
+        base_path = self.existing_path(base_hash)
+        if not self.enabled or base_path is None:
+            return False
+        path = self.sidecar_path(content_hash)
+        tmp_path = self._tmp_path(path)
+        try:
+            with pa.memory_map(base_path) as source:
+                reader = pa.ipc.open_file(source)
+                delta_table = pa.Table.from_pandas(delta, preserve_index=False)
+                delta_table = delta_table.select(reader.schema.names).cast(reader.schema)
+                with pa.ipc.new_file(tmp_path, reader.schema) as writer:
+                    for idx in range(reader.num_record_batches):
+                        writer.write_batch(reader.get_batch(idx))
+                    writer.write_table(delta_table)
+            os.replace(tmp_path, path)
+            return True
+        except Exception as e:
+            logger.info("无法追加到列式缓存，将重新写入", extra={"fields": {"error": str(e)}})
+            return False
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def out_of_core(self, file_path: str) -> bool:
+        """文件是否大到应以 LazyFrame 方式使用"""
+        threshold = settings.OUT_OF_CORE_THRESHOLD_MB
+        return self.enabled and threshold > 0 and os.path.getsize(file_path) >= threshold * 1024 * 1024
+
+    def load(self, file_path: str, lazy: bool = None):
+        """
+        加载数据文件，优先读取列式缓存
+
+        返回 (DataFrame, 内容哈希)。缓存未命中时解析原始文件并写入旁路文件。
+        lazy 为None时按文件大小决定，为真时返回基于旁路文件的 LazyFrame，已有数据不加载到内存。
+        """
+        if not (file_path.endswith('.csv') or file_path.endswith('.xlsx') or file_path.endswith('.xls')):
+            raise ValueError("不支持的文件格式，请上传CSV或Excel文件")
+        if lazy is None:
+            lazy = self.out_of_core(file_path)
+        content_hash = self.content_hash(file_path)
+        if lazy and self.existing_path(content_hash):
+            self.hits += 1
+            return LazyFrame(self.sidecar_path(content_hash)), content_hash
+        df = None if lazy else self.read(content_hash)
+        if df is not None:
+            self.hits += 1
+            return df, content_hash
+        self.misses += 1
+        # CSV先尝试分块转换，成功后直接内存映射读取，避免整体解析的内存峰值
+        if file_path.endswith('.csv') and self.convert_csv(file_path, content_hash):
+            if lazy:
+                return LazyFrame(self.sidecar_path(content_hash)), content_hash
+            df = self.read(content_hash)
+            if df is not None:
+                return df, content_hash
+        df = parse_file(file_path)
+        if self.write(content_hash, df) and lazy:
+            return LazyFrame(self.sidecar_path(content_hash)), content_hash
+        return df, content_hash
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, "hits": self.hits, "misses": self.misses}
@@ -9,6 +9,21 @@ chat_service = None
 # 示例服务实例
 example_service = None
 
+# 代码执行引擎实例
+code_executor = None
+
+# 数据集列式缓存实例
+dataset_cache = None
+
+# 状态后端实例
+state_backend = None
+
+# 检索索引实例
+search_index = None
+
+# 内容寻址文件存储实例
+blob_store = None
+
 async def get_llm_service():
     """获取LLM服务实例的依赖"""
     global llm_service
@@ -42,6 +57,67 @@ async def get_example_service():
         example_service = ExampleService(storage_path="data/examples")
     return example_service
 
+async def get_code_executor():
+    """获取代码执行引擎实例的依赖"""
+    global code_executor
+    if code_executor is None:
+        from app.services.executor import CodeExecutor
+        code_executor = CodeExecutor()
+    return code_executor
+
+async def get_dataset_cache():
+    """获取数据集列式缓存实例的依赖"""
+    global dataset_cache
+    if dataset_cache is None:
+        from app.services.dataset_cache import DatasetCache
+        dataset_cache = DatasetCache()
+    return dataset_cache
+
+def get_state_backend():
+    """获取状态后端实例（服务构造时同步调用）"""
+    global state_backend
+    if state_backend is None:
+        from app.services.state_store import create_state_backend
+        state_backend = create_state_backend()
+    return state_backend
+
+def get_search_index():
+    """获取示例和常用查询检索索引实例（服务构造时同步调用）"""
+    global search_index
+    if search_index is None:
+        from app.services.search_index import SearchIndex
+        search_index = SearchIndex()
+    return search_index
+
+def get_blob_store():
+    """获取内容寻址文件存储实例（上传和保存示例时同步调用）"""
+    global blob_store
+    if blob_store is None:
+        from app.services.blob_store import BlobStore
+        blob_store = BlobStore()
+    return blob_store
+
+async def close_code_executor():
+    """关闭代码执行引擎"""
+    global code_executor
+    if code_executor is not None:
+        await code_executor.close()
+        code_executor = None
+
+def close_state_backend():
+    """关闭状态后端"""
+    global state_backend
+    if state_backend is not None:
+        state_backend.close()
+        state_backend = None
+
+def close_search_index():
+    """关闭检索索引"""
+    global search_index
+    if search_index is not None:
+        search_index.close()
+        search_index = None
+
 async def close_llm_service():
     """关闭LLM服务"""
     global llm_service
@@ -0,0 +1,172 @@
+"""
+示例索引
+
+示例的名称、描述、标签、创建时间等元信息保存在SQLite索引中，完整的分析过程（代码、步骤、结果预览）仍保存在各自的JSON文件里。
+示例列表的分页、按标签筛选和排序都在索引上完成，只有获取单个示例时才读取JSON文件。
+"""
+import json
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+from app.core.config import settings
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
+
+# 可用于排序的字段：接口参数名 -> 索引列名
+SORT_FIELDS = {"createdAt": "created_at", "name": "name"}
+
+
+def example_summary(example: dict) -> dict:
+    """示例列表中展示的元信息"""
+    original_file = (example.get("analysisProcess") or {}).get("originalFile") or {}
+    tags = example.get("tags") or []
+    return {
+        "id": example["id"],
+        "name": example.get("name") or "",
+        "description": example.get("description") or "",
+        "tags": tags if isinstance(tags, list) else [tags],
+        "createdAt": example.get("createdAt") or "",
+        "fileName": original_file.get("file_name")
+    }
+
+
+class ExampleIndex:
+    """示例元信息索引"""
+
+    def __init__(self, path: str = None):
+        self.path = path or settings.EXAMPLE_INDEX_PATH
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS examples ("
+                "id TEXT PRIMARY KEY, name TEXT NOT NULL, description TEXT NOT NULL, tags TEXT NOT NULL, "
+                "created_at TEXT NOT NULL, file_name TEXT, mtime REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS examples_created_at ON examples (created_at)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS examples_name ON examples (name)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS example_tags ("
+                "tag TEXT NOT NULL, example_id TEXT NOT NULL, PRIMARY KEY (tag, example_id))"
+            )
+
+    def put(self, example: dict, mtime: float):
+        """写入或更新一个示例的元信息，mtime 为对应JSON文件的修改时间"""
+        summary = example_summary(example)
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO examples (id, name, description, tags, created_at, file_name, mtime) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (summary["id"], summary["name"], summary["description"],
+                     json.dumps(summary["tags"], ensure_ascii=False), summary["createdAt"],
+                     summary["fileName"], mtime)
+                )
+                self._conn.execute("DELETE FROM example_tags WHERE example_id = ?", (summary["id"],))
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO example_tags (tag, example_id) VALUES (?, ?)",
+                    [(str(tag), summary["id"]) for tag in summary["tags"]]
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def get(self, example_id: str):
+        """单个示例的元信息，不存在时返回None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, name, description, tags, created_at, file_name FROM examples WHERE id = ?",
+                (example_id,)
+            ).fetchone()
+        return self._row_summary(row) if row is not None else None
+
+    def mtimes(self) -> dict:
+        """已索引示例的 {示例ID: JSON文件修改时间}"""
+        with self._lock:
+            return dict(self._conn.execute("SELECT id, mtime FROM examples").fetchall())
+
+    def remove(self, example_id: str):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.execute("DELETE FROM examples WHERE id = ?", (example_id,))
+            self._conn.execute("DELETE FROM example_tags WHERE example_id = ?", (example_id,))
+            self._conn.execute("COMMIT")
+
+    def query(self, tags: list = None, sort: str = "createdAt", order: str = "desc",
+              limit: int = None, offset: int = 0):
+        """
+        按条件列出示例元信息，返回 (当前页, 符合条件的总数)
+
+        提供多个标签时只返回包含全部标签的示例。
+        """
+        if sort not in SORT_FIELDS:
+            raise ValueError(f"不支持的排序字段: {sort}")
+        direction = "ASC" if order.lower() == "asc" else "DESC"
+        where = ""
+        params = []
+        tags = [tag for tag in (tags or []) if tag]
+        if tags:
+            placeholders = ", ".join("?" * len(tags))
+            where = (f" WHERE id IN (SELECT example_id FROM example_tags WHERE tag IN ({placeholders}) "
+                     f"GROUP BY example_id HAVING COUNT(*) = ?)")
+            params = [*tags, len(set(tags))]
+        sql = (f"SELECT id, name, description, tags, created_at, file_name FROM examples{where} "
+               f"ORDER BY {SORT_FIELDS[sort]} {direction}, id {direction} LIMIT ? OFFSET ?")
+        with self._lock:
+            total = self._conn.execute(f"SELECT COUNT(*) FROM examples{where}", params).fetchone()[0]
+            rows = self._conn.execute(sql, [*params, limit if limit is not None else -1, offset]).fetchall()
+        return [self._row_summary(row) for row in rows], total
+
+    def sync(self, storage_path: Path):
+        """
+        使索引与示例目录一致
+
+        只读取索引中没有或修改时间有变化的JSON文件，删除文件已不存在的索引条目。
+        """
+        indexed = self.mtimes()
+        present = set()
+        added = 0
+        for file_path in storage_path.glob("*.json"):
+            example_id = file_path.stem
+            present.add(example_id)
+            mtime = file_path.stat().st_mtime
+            if indexed.get(example_id) == mtime:
+                continue
+            try:
+                with open(file_path, "r", encoding="utf-8") as f:
+                    example = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning("示例文件无法读取，跳过索引", extra={"fields": {"path": str(file_path), "error": str(e)}})
+                continue
+            example["id"] = example_id
+            self.put(example, mtime)
+            added += 1
+        removed = set(indexed) - present
+        for example_id in removed:
+            self.remove(example_id)
+        if added or removed:
+            logger.info("示例索引已更新", extra={"fields": {"indexed": added, "removed": len(removed)}})
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def _row_summary(row) -> dict:
+        return {
+            "id": row[0],
+            "name": row[1],
+            "description": row[2],
+            "tags": json.loads(row[3]),
+            "createdAt": row[4],
+            "fileName": row[5]
+        }
@@ -1,16 +1,26 @@
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from datetime import datetime
 import json
 import os
-import shutil
 from pathlib import Path
 
+from app.services.dependencies import get_blob_store, get_search_index
+from app.services.example_index import ExampleIndex
+
 class ExampleService:
-    def __init__(self, storage_path: str):
+    def __init__(self, storage_path: str, index_path: str = None, search_index=None):
         self.storage_path = Path(storage_path)
         self.storage_path.mkdir(parents=True, exist_ok=True)
         self.example_files_path = self.storage_path.parent / 'example_files'
         self.example_files_path.mkdir(parents=True, exist_ok=True)
+        # 元信息索引，启动时补齐索引中缺少或已修改的示例
+        self.index = ExampleIndex(index_path)
+        self.index.sync(self.storage_path)
+        # 全文检索索引
+        self.search = search_index or get_search_index()
+        self._sync_search()
+        # 示例文件与上传文件共享内容寻址存储中的同一份数据
+        self.blobs = get_blob_store()
 
     def _get_example_path(self, example_id: str) -> Path:
         return self.storage_path / f"{example_id}.json"
@@ -18,6 +28,42 @@ class ExampleService:
     def _get_example_file_path(self, example_id: str, filename: str) -> Path:
         return self.example_files_path / f"{example_id}_{filename}"
 
+    def _index_for_search(self, example_id: str, example: dict, mtime: float):
+        """将示例的名称、描述、标签、用户需求和代码写入检索索引"""
+        process = example.get('analysisProcess') or {}
+        tags = example.get('tags') or []
+        tags = tags if isinstance(tags, list) else [tags]
+        self.search.put(
+            f"example:{example_id}", "example",
+            fields={
+                'name': example.get('name'),
+                'description': example.get('description'),
+                'tags': " ".join(str(tag) for tag in tags),
+                'query': process.get('userQuery'),
+                'code': process.get('code')
+            },
+            title=example.get('name'),
+            tags=tags,
+            meta={'exampleId': example_id, 'createdAt': example.get('createdAt')},
+            version=mtime
+        )
+
+    def _sync_search(self):
+        """检索索引中缺少或已过期的示例重新读取JSON文件写入，已删除的示例从检索索引中移除"""
+        mtimes = self.index.mtimes()
+        indexed = self.search.versions("example")
+        for example_id, mtime in mtimes.items():
+            if indexed.get(f"example:{example_id}") == mtime:
+                continue
+            try:
+                with open(self._get_example_path(example_id), 'r', encoding='utf-8') as f:
+                    self._index_for_search(example_id, json.load(f), mtime)
+            except (OSError, ValueError):
+                continue
+        for doc_id in indexed:
+            if doc_id.split(":", 1)[1] not in mtimes:
+                self.search.remove(doc_id)
+
     async def save_example(self, example_data: dict, session_id: str) -> dict:
         """保存分析示例"""
         example_id = str(datetime.now().timestamp())
@@ -28,19 +74,22 @@ class ExampleService:
         if 'originalFile' in example_data.get('analysisProcess', {}):
             original_file = example_data['analysisProcess']['originalFile']
             if 'file_name' in original_file:
-                # 从上传目录复制文件
+                # 链接到上传文件的内容，不复制数据
                 upload_path = Path("uploads") / session_id / original_file['file_name']
                 if upload_path.exists():
                     new_file_path = self._get_example_file_path(
                         example_id, 
                         original_file['file_name']
                     )
-                    shutil.copy2(upload_path, new_file_path)
+                    self.blobs.share(upload_path, new_file_path)
                     original_file['saved_file_path'] = str(new_file_path)
 
         example_path = self._get_example_path(example_id)
         with open(example_path, 'w', encoding='utf-8') as f:
             json.dump(example_data, f, ensure_ascii=False, indent=2)
+        mtime = example_path.stat().st_mtime
+        self.index.put(example_data, mtime)
+        self._index_for_search(example_id, example_data, mtime)
 
         return example_data
 
@@ -60,17 +109,14 @@ class ExampleService:
             return None
         return file_path
 
-    async def list_examples(self) -> List[dict]:
-        """获取示例列表"""
-        examples = []
-        for file_path in self.storage_path.glob('*.json'):
-            with open(file_path, 'r', encoding='utf-8') as f:
-                example = json.load(f)
-                examples.append(example)
-        
-        # 按创建时间倒序排序
-        examples.sort(key=lambda x: x['createdAt'], reverse=True)
-        return examples
+    async def list_examples(self, tags: List[str] = None, sort: str = "createdAt", order: str = "desc",
+                            limit: Optional[int] = None, offset: int = 0) -> Tuple[List[dict], int]:
+        """
+        获取示例列表，返回 (当前页的示例元信息, 符合条件的总数)
+
+        列表只包含名称、描述、标签等元信息，完整的分析过程通过 get_example 获取。
+        """
+        return self.index.query(tags=tags, sort=sort, order=order, limit=limit, offset=offset)
 
     async def update_example(self, example_id: str, example_data: dict) -> Optional[dict]:
         """更新示例"""
@@ -80,6 +126,12 @@ class ExampleService:
 
         with open(example_path, 'w', encoding='utf-8') as f:
             json.dump(example_data, f, ensure_ascii=False, indent=2)
+        # 索引以文件名为示例ID，缺少创建时间时沿用原有的
+        indexed = self.index.get(example_id) or {}
+        example = {**example_data, 'id': example_id, 'createdAt': example_data.get('createdAt') or indexed.get('createdAt')}
+        mtime = example_path.stat().st_mtime
+        self.index.put(example, mtime)
+        self._index_for_search(example_id, example, mtime)
 
         return example_data
 
@@ -89,5 +141,13 @@ class ExampleService:
         if not example_path.exists():
             return False
 
+        # 示例保存的原始文件是内容存储的链接，删除后不再被引用的内容由垃圾回收清理
+        with open(example_path, 'r', encoding='utf-8') as f:
+            saved_file = ((json.load(f).get('analysisProcess') or {}).get('originalFile') or {}).get('saved_file_path')
+        if saved_file and Path(saved_file).resolve().parent == self.example_files_path.resolve() and \
+                Path(saved_file).exists():
+            Path(saved_file).unlink()
         example_path.unlink()
+        self.index.remove(example_id)
+        self.search.remove(f"example:{example_id}")
         return True 
\ No newline at end of file
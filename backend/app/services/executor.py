@@ -0,0 +1,438 @@
+"""
+代码执行引擎
+
+在预热好的子进程池中执行大模型生成的分析代码，事件循环只负责等待结果。
+每次执行都有超时控制，子进程有内存上限，超时或取消时直接终止对应的子进程并补充新进程。
+终止和启动子进程都在后台线程中完成，不阻塞事件循环。
+"""
+import ast
+import asyncio
+import multiprocessing
+import sys
+import time
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+import io
+import base64
+
+import numpy as np
+import pandas as pd
+
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.services import sql_engine
+from app.services.lazy_frame import RESULT_ROW_LIMIT, LazyFrame
+
+
+logger = get_logger(__name__)
+
+
+class CodeExecutionError(Exception):
+    """生成代码执行失败，携带子进程中的错误信息和堆栈"""
+
+    def __init__(self, error_message: str, traceback_message: str = ""):
+        super().__init__(error_message)
+        self.error_message = error_message
+        self.traceback = traceback_message
+
+
+# ---------------------------------------------------------------------------
+# 子进程部分
+# ---------------------------------------------------------------------------
+
+# 允许导入的模块
+_ALLOWED_IMPORTS = {
+    'pandas': pd,
+    'numpy': np
+}
+
+
+def _safe_import(name, *args, **kwargs):
+    """安全的导入函数，只允许导入预定义的模块"""
+    if name in _ALLOWED_IMPORTS:
+        return _ALLOWED_IMPORTS[name]
+    raise ImportError(f"导入 '{name}' 被禁止，只允许导入: {', '.join(_ALLOWED_IMPORTS.keys())}")
+
+
+# 获取信息代码允许使用的函数
+_ALLOWED_FUNCTIONS = {
+    'len': len,
+    'list': list,
+    'dict': dict,
+    'str': str,
+    'int': int,
+    'float': float,
+    'sum': sum,
+    'min': min,
+    'max': max,
+    'sorted': sorted,
+    'isinstance': isinstance,
+    'print': print,
+    '__import__': _safe_import
+}
+
+
+def _limit_memory(memory_limit_mb: int):
+    """限制子进程可用的虚拟内存（仅在支持 resource 模块的平台生效）"""
+    if not memory_limit_mb:
+        return
+    try:
+        import resource
+        limit = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+# 子进程内已编译代码对象的缓存，重复执行相同代码时跳过编译
+_COMPILED_CACHE_SIZE = 128
+_compiled_cache = OrderedDict()
+
+# 子进程中缓存的其他数据集个数
+_DATASET_CACHE_SIZE = 4
+
+
+def _compile(code: str):
+    code_obj = _compiled_cache.get(code)
+    if code_obj is None:
+        code_obj = compile(code, '<string>', 'exec')
+        _compiled_cache[code] = code_obj
+        if len(_compiled_cache) > _COMPILED_CACHE_SIZE:
+            _compiled_cache.popitem(last=False)
+    else:
+        _compiled_cache.move_to_end(code)
+    return code_obj
+
+
+def _load_frame(data_path: str, lazy: bool = False) -> pd.DataFrame:
+    """直接内存映射读取列式缓存，避免通过管道传输整份数据；lazy 为真时不加载，按需读取"""
+    if lazy:
+        return LazyFrame(data_path)
+    from pyarrow import feather
+    return feather.read_table(data_path, memory_map=True).to_pandas()
+
+
+def _run_job(job: dict, frame: pd.DataFrame, extras: dict = None):
+    """在子进程中执行一次任务，返回需要回传给主进程的结果"""
+    if job["mode"] == "sql":
+        # SQL只读查询，不需要数据副本；相同数据上的查询复用引擎连接
+        frames = {**(extras or {}), "df": frame}
+        cache_key = None
+        if job.get("data_key"):
+            cache_key = (job["data_key"],) + tuple(sorted(
+                (name, ref["data_key"]) for name, ref in (job.get("datasets") or {}).items()
+            ))
+        return sql_engine.run_query(job["code"], frames, sql_engine.engine_name(frame), cache_key)
+
+    # 每次执行使用数据副本，避免生成代码的原地修改影响后续执行
+    df = frame.copy() if frame is not None else None
+    # 会话中的其他数据集按名称提供
+    named_frames = {name: extra.copy() for name, extra in (extras or {}).items()}
+    code_obj = _compile(job["code"])
+
+    if job["mode"] == "info":
+        # 获取信息代码：受限的内置函数，捕获print输出
+        info_globals = {
+            '__builtins__': _ALLOWED_FUNCTIONS,
+            **_ALLOWED_IMPORTS
+        }
+        info_locals = {**named_frames, "df": df}
+        info_output = StringIO()
+        original_stdout = sys.stdout
+        sys.stdout = info_output
+        try:
+            exec(code_obj, info_globals, info_locals)
+        finally:
+            sys.stdout = original_stdout
+        return info_output.getvalue()
+
+    # 分析代码：结果存放在变量 result 中
+    code_globals = {
+        "pd": pd,
+        "np": np,
+        "StringIO": StringIO,
+        "io": io,
+        "base64": base64,
+    }
+    local_vars = {**named_frames, "df": df}
+    exec(code_obj, code_globals, local_vars)
+    return local_vars.get("result", None)
+
+
+def _job_datasets(job: dict, datasets: OrderedDict) -> dict:
+    """加载任务引用的其他数据集，已缓存的直接使用"""
+    extras = {}
+    for name, ref in (job.get("datasets") or {}).items():
+        extra = datasets.get(ref["data_key"])
+        if extra is None:
+            extra = ref["data"] if ref.get("data") is not None else _load_frame(ref["data_path"], ref.get("lazy", False))
+            datasets[ref["data_key"]] = extra
+            if len(datasets) > _DATASET_CACHE_SIZE:
+                datasets.popitem(last=False)
+        else:
+            datasets.move_to_end(ref["data_key"])
+        extras[name] = extra
+    return extras
+
+
+def _worker_main(conn, memory_limit_mb: int):
+    """子进程主循环：接收任务、执行代码、回传结果"""
+    _limit_memory(memory_limit_mb)
+    # 每个子进程只缓存最近一份数据，主进程按 data_key 做亲和调度
+    data_key = None
+    frame = None
+    # 会话中其他数据集的缓存：data_key -> DataFrame
+    datasets = OrderedDict()
+    conn.send({"status": "ready"})
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if job is None:
+            break
+        try:
+            if job.get("data") is not None or job.get("data_path") or job.get("data_key") != data_key:
+                new_frame = job.get("data")
+                if new_frame is None and job.get("data_path"):
+                    new_frame = _load_frame(job["data_path"], job.get("lazy", False))
+                data_key, frame = job.get("data_key"), new_frame
+            value = _run_job(job, frame, _job_datasets(job, datasets))
+            if isinstance(value, LazyFrame):
+                # 直接返回了整个大数据集，只回传前面的部分
+                value = value.head(RESULT_ROW_LIMIT)
+            response = {"status": "success", "result": value}
+        except BaseException as e:
+            response = {
+                "status": "error",
+                "error": f"{type(e).__name__}: {str(e)}",
+                "traceback": traceback.format_exc()
+            }
+        # 告知主进程当前缓存的数据，用于亲和调度
+        response["data_key"] = data_key
+        try:
+            conn.send(response)
+        except Exception as e:
+            # 结果无法序列化时返回错误信息
+            conn.send({
+                "status": "error",
+                "error": f"{type(e).__name__}: 分析结果无法返回 ({str(e)})",
+                "traceback": traceback.format_exc(),
+                "data_key": data_key
+            })
+
+
+# ---------------------------------------------------------------------------
+# 主进程部分
+# ---------------------------------------------------------------------------
+
+def referenced_datasets(code: str, datasets: dict) -> dict:
+    """从数据集中挑出代码里以变量名引用到的部分，代码无法解析时返回空字典"""
+    if not datasets:
+        return {}
+    try:
+        names = {node.id for node in ast.walk(ast.parse(code)) if isinstance(node, ast.Name)}
+    except SyntaxError:
+        return {}
+    return {name: ref for name, ref in datasets.items() if name in names}
+
+
+class _Worker:
+    """主进程中对单个子进程的封装"""
+
+    def __init__(self, ctx, memory_limit_mb: int):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_worker_main,
+            args=(child_conn, memory_limit_mb),
+            daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.data_key = None
+        self.ready = False
+
+    def kill(self):
+        """强制终止子进程"""
+        try:
+            if self.process.is_alive():
+                self.process.kill()
+            self.process.join(timeout=1)
+        except Exception:
+            pass
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+
+
+class CodeExecutor:
+    """基于预热子进程池的代码执行引擎"""
+
+    def __init__(self, max_workers: int = None, timeout: float = None, memory_limit_mb: int = None):
+        self.max_workers = max_workers or settings.EXECUTOR_MAX_WORKERS
+        self.timeout = timeout or settings.EXECUTOR_TIMEOUT
+        self.memory_limit_mb = (settings.EXECUTOR_MEMORY_LIMIT_MB
+                                if memory_limit_mb is None else memory_limit_mb)
+        self._ctx = multiprocessing.get_context("spawn")
+        # 等待子进程返回结果的线程，与子进程一一对应
+        self._io_threads = ThreadPoolExecutor(max_workers=self.max_workers,
+                                              thread_name_prefix="code-executor")
+        self._idle = []
+        self._waiters = 0
+        self._condition = None
+        self._closed = False
+        # 正在后台替换异常子进程的任务
+        self._replacing = set()
+        self.metrics = {
+            "submitted": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "timeouts": 0,
+            "cancelled": 0,
+            "crashed": 0,
+            "total_exec_seconds": 0.0
+        }
+        # 启动时即预热全部子进程，避免首次请求承担进程启动和pandas导入的开销
+        self._idle = [_Worker(self._ctx, self.memory_limit_mb) for _ in range(self.max_workers)]
+
+    def stats(self) -> dict:
+        """执行引擎的运行指标，包括排队深度"""
+        return {
+            "max_workers": self.max_workers,
+            "idle_workers": len(self._idle),
+            "busy_workers": self.max_workers - len(self._idle),
+            "queue_depth": self._waiters,
+            **self.metrics
+        }
+
+    async def _acquire(self, data_key) -> _Worker:
+        """获取空闲子进程，优先选择已缓存相同数据的子进程"""
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        async with self._condition:
+            self._waiters += 1
+            try:
+                await self._condition.wait_for(lambda: self._idle)
+            finally:
+                self._waiters -= 1
+            for idx, worker in enumerate(self._idle):
+                if data_key is not None and worker.data_key == data_key:
+                    return self._idle.pop(idx)
+            return self._idle.pop()
+
+    async def _release(self, worker: _Worker, healthy: bool):
+        """归还子进程，异常的子进程交给后台任务替换为新的子进程"""
+        if not healthy:
+            task = asyncio.create_task(self._replace(worker))
+            self._replacing.add(task)
+            task.add_done_callback(self._replacing.discard)
+            return
+        await self._return_idle(worker)
+
+    async def _replace(self, worker: _Worker):
+        """终止异常的子进程并启动新的子进程，等待进程退出和启动进程都在线程中完成"""
+        await asyncio.to_thread(worker.kill)
+        if self._closed:
+            return
+        try:
+            worker = await asyncio.to_thread(_Worker, self._ctx, self.memory_limit_mb)
+        except Exception as e:
+            logger.error("执行进程启动失败", extra={"fields": {"error": str(e)}})
+            return
+        await self._return_idle(worker)
+
+    async def _return_idle(self, worker: _Worker):
+        if self._closed:
+            await asyncio.to_thread(worker.kill)
+            return
+        async with self._condition:
+            self._idle.append(worker)
+            self._condition.notify()
+
+    def _receive(self, worker: _Worker):
+        """在线程中阻塞等待子进程返回，跳过启动时的就绪消息"""
+        while True:
+            message = worker.conn.recv()
+            if message.get("status") == "ready":
+                worker.ready = True
+                continue
+            return message
+
+    async def run(self, code: str, data: pd.DataFrame = None, data_key: str = None,
+                  mode: str = "analysis", timeout: float = None, data_path: str = None,
+                  datasets: dict = None):
+        """
+        在子进程中执行代码
+
+        mode 为 "analysis" 时返回代码中的 result 变量，为 "info" 时返回代码的打印输出，
+        为 "sql" 时 code 为SQL查询，返回 sql_engine.run_query 的结果（查询结果、查询计划和各阶段耗时）。
+        提供 data_path（列式缓存文件）时子进程直接从文件加载数据，不再传输 data。
+        datasets 为会话中的其他数据集 {变量名: {"data_key", "data_path"}}（没有列式缓存时提供 "data"），
+        只有代码中引用到的数据集才会在子进程中加载。
+        执行失败、超时或子进程崩溃时抛出 CodeExecutionError。
+        """
+        if self._closed:
+            raise RuntimeError("代码执行引擎已关闭")
+        timeout = timeout or self.timeout
+        self.metrics["submitted"] += 1
+        worker = await self._acquire(data_key)
+        healthy = False
+        start = time.monotonic()
+        try:
+            # 子进程已缓存同一份数据时不再重复传输
+            job = {"code": code, "mode": mode, "data_key": data_key, "data": None, "data_path": None,
+                   "lazy": isinstance(data, LazyFrame)}
+            if mode == "sql":
+                job["datasets"] = sql_engine.referenced_tables(code, datasets)
+            else:
+                job["datasets"] = referenced_datasets(code, datasets)
+            if data_key is None or worker.data_key != data_key:
+                if data_path:
+                    job["data_path"] = data_path
+                else:
+                    job["data"] = data
+            worker.conn.send(job)
+            loop = asyncio.get_running_loop()
+            message = await asyncio.wait_for(
+                loop.run_in_executor(self._io_threads, self._receive, worker),
+                timeout=timeout
+            )
+            worker.data_key = message.get("data_key")
+            healthy = True
+        except asyncio.TimeoutError:
+            self.metrics["timeouts"] += 1
+            raise CodeExecutionError(f"TimeoutError: 代码执行超过 {timeout} 秒，已终止")
+        except asyncio.CancelledError:
+            self.metrics["cancelled"] += 1
+            raise
+        except (EOFError, OSError, BrokenPipeError) as e:
+            self.metrics["crashed"] += 1
+            raise CodeExecutionError(
+                f"WorkerCrashed: 执行进程异常退出，可能超出内存限制 ({type(e).__name__})"
+            )
+        finally:
+            self.metrics["total_exec_seconds"] += time.monotonic() - start
+            await self._release(worker, healthy)
+
+        if message["status"] == "success":
+            self.metrics["succeeded"] += 1
+            return message["result"]
+        self.metrics["failed"] += 1
+        raise CodeExecutionError(message["error"], message.get("traceback", ""))
+
+    async def close(self):
+        """关闭全部子进程"""
+        self._closed = True
+        # 后台替换中的子进程启动后会直接被终止
+        await asyncio.gather(*self._replacing, return_exceptions=True)
+        for worker in self._idle:
+            try:
+                worker.conn.send(None)
+            except Exception:
+                pass
+            worker.kill()
+        self._idle = []
+        self._io_threads.shutdown(wait=False)
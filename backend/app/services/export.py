@@ -0,0 +1,154 @@
+"""
+分析结果导出
+
+将结果批次逐批编码为CSV / Parquet / Excel，边编码边输出，内存占用只与批次大小有关。
+Parquet的列类型在开始输出之前由整份结果确定，各批次按该类型转换，不会因后续批次的类型不同而中途失败。
+"""
+import os
+import tempfile
+import zlib
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# Excel单个工作表的最大行数（含表头）
+XLSX_MAX_ROWS = 1048576
+
+# 读取临时Excel文件时每次输出的字节数
+FILE_CHUNK_SIZE = 1024 * 1024
+
+EXPORT_FORMATS = {
+    "csv": {"media_type": "text/csv", "extension": "csv"},
+    "parquet": {"media_type": "application/vnd.apache.parquet", "extension": "parquet"},
+    "xlsx": {
+        "media_type": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        "extension": "xlsx"
+    }
+}
+
+
+def stream_csv(batches):
+    """逐批输出CSV文本，只有第一批带表头"""
+    for idx, batch in enumerate(batches):
+        yield batch.to_csv(index=False, header=(idx == 0))
+
+
+def gzip_stream(chunks):
+    """对输出流做增量gzip压缩"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class _ChunkSink:
+    """收集ParquetWriter写出的字节，每写完一个行组就取走"""
+
+    def __init__(self):
+        self.chunks = []
+        self.closed = False
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def parquet_schema(schema):
+    """
+    导出Parquet使用的列类型
+
+    schema 应由整份结果得到（如 ResultStore.arrow_schema）。全为空值的列没有具体类型，改为字符串；
+    窄整数类型放宽为int64，按批次转换时带空值的整数列在pandas中是浮点数，也能转换回来。
+    """
+    fields = []
+    for field in schema.remove_metadata():
+        if pa.types.is_null(field.type):
+            field = field.with_type(pa.string())
+        elif pa.types.is_signed_integer(field.type):
+            field = field.with_type(pa.int64())
+        elif pa.types.is_unsigned_integer(field.type):
+            field = field.with_type(pa.uint64())
+        fields.append(field.with_name(str(field.name)))
+    return pa.schema(fields)
+
+
+def stream_parquet(batches, schema):
+    """逐批写出Parquet，每个批次一个行组，各批次按 parquet_schema(schema) 的列类型转换"""
+    if pq is None:
+        raise RuntimeError("未安装pyarrow，无法导出Parquet")
+    schema = parquet_schema(schema)
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema)
+    try:
+        for batch in batches:
+            frame = batch.reset_index(drop=True)
+            frame.columns = [str(col) for col in frame.columns]
+            table = pa.Table.from_pandas(frame, schema=schema, preserve_index=False)
+            writer.write_table(table)
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def stream_xlsx(batches):
+    """
+    以只写模式逐批写入Excel
+
+    xlsx是zip格式，只能在全部行写完后生成，因此先写入临时文件再分块输出，内存占用仍与批次大小有关。
+    """
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("analysis_result")
+    fd, tmp_path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    try:
+        for idx, batch in enumerate(batches):
+            if idx == 0:
+                sheet.append([str(col) for col in batch.columns])
+            # 空值写为空单元格
+            values = batch.astype(object).where(batch.notna(), None)
+            for row in values.itertuples(index=False, name=None):
+                sheet.append(list(row))
+        workbook.save(tmp_path)
+        with open(tmp_path, "rb") as f:
+            for chunk in iter(lambda: f.read(FILE_CHUNK_SIZE), b""):
+                yield chunk
+    finally:
+        os.remove(tmp_path)
+
+
+def export_stream(batches, export_format: str, schema=None):
+    """按格式返回导出流，Parquet需要提供整份结果的 Arrow schema"""
+    if export_format == "parquet":
+        return stream_parquet(batches, schema)
+    if export_format == "xlsx":
+        return stream_xlsx(batches)
+    return stream_csv(batches)
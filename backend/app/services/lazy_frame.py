@@ -0,0 +1,384 @@
+"""
+大数据集的惰性数据框
+
+超过 OUT_OF_CORE_THRESHOLD_MB 的数据集不整体加载为 pandas DataFrame，分析代码中的 df 是基于列式缓存文件（内存映射）的 LazyFrame：
+列选择只读取用到的列，分组聚合和整列统计由 pyarrow 在列式数据上计算，过滤按记录批次逐块进行，
+内存占用取决于结果大小而不是数据集大小。安装了 duckdb 时还可以直接用 SQL 查询。
+"""
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    from pyarrow import feather
+except ImportError:  # 未安装pyarrow时不使用惰性数据框
+    pa = None
+    pc = None
+    feather = None
+
+try:
+    import duckdb
+except ImportError:  # duckdb为可选依赖，未安装时不提供SQL查询
+    duckdb = None
+
+# 分析代码直接返回 LazyFrame 时最多回传的行数
+RESULT_ROW_LIMIT = 100000
+
+# pandas 聚合函数名 -> pyarrow 分组聚合函数名
+_AGGREGATIONS = {
+    "sum": "sum",
+    "mean": "mean",
+    "min": "min",
+    "max": "max",
+    "count": "count",
+    "nunique": "count_distinct",
+    "std": "stddev",
+    "var": "variance",
+}
+
+# 只对数值列计算的聚合
+_NUMERIC_AGGREGATIONS = {"sum", "mean", "std", "var"}
+
+
+def available() -> bool:
+    return feather is not None
+
+
+def _agg_options(func: str):
+    # 与pandas一致，标准差和方差使用样本统计量
+    if func in ("std", "var"):
+        return pc.VarianceOptions(ddof=1)
+    return None
+
+
+def _is_numeric(field) -> bool:
+    return pa.types.is_integer(field.type) or pa.types.is_floating(field.type) or pa.types.is_decimal(field.type)
+
+
+class LazyFrame:
+    """基于内存映射列式文件的只读数据框，提供pandas常用操作中可以下推到列式数据的部分"""
+
+    def __init__(self, path: str, columns: list = None):
+        self.path = path
+        self._columns = list(columns) if columns is not None else None
+        self._table = None
+
+    # 传给执行引擎子进程时只传递文件路径
+    def __getstate__(self):
+        return {"path": self.path, "_columns": self._columns}
+
+    def __setstate__(self, state):
+        self.path = state["path"]
+        self._columns = state["_columns"]
+        self._table = None
+
+    def _source(self):
+        """内存映射打开的Arrow表，未压缩的列式文件读取时不复制数据"""
+        if self._table is None:
+            table = feather.read_table(self.path, memory_map=True)
+            if self._columns is not None:
+                table = table.select(self._columns)
+            self._table = table
+        return self._table
+
+    # ------------------------------------------------------------------
+    # 基本信息
+    # ------------------------------------------------------------------
+
+    @property
+    def columns(self) -> pd.Index:
+        return pd.Index(self._source().schema.names)
+
+    @property
+    def dtypes(self) -> pd.Series:
+        return self._source().schema.empty_table().to_pandas().dtypes
+
+    @property
+    def shape(self) -> tuple:
+        table = self._source()
+        return table.num_rows, table.num_columns
+
+    def __len__(self):
+        return self._source().num_rows
+
+    def __repr__(self):
+        rows, columns = self.shape
+        return f"LazyFrame({rows}行 × {columns}列, 列: {list(self.columns)})"
+
+    def copy(self):
+        # 只读数据，无需复制
+        return self
+
+    def info(self):
+        rows, columns = self.shape
+        lines = [f"LazyFrame: {rows}行 × {columns}列"]
+        lines.extend(f"{name}: {dtype}" for name, dtype in self.dtypes.items())
+        print("\n".join(lines))
+
+    def head(self, n: int = 5) -> pd.DataFrame:
+        return self._source().slice(0, n).to_pandas()
+
+    def tail(self, n: int = 5) -> pd.DataFrame:
+        table = self._source()
+        return table.slice(max(0, table.num_rows - n)).to_pandas().reset_index(drop=True)
+
+    def to_pandas(self) -> pd.DataFrame:
+        """将全部数据加载为pandas DataFrame"""
+        return self._source().to_pandas()
+
+    def iter_chunks(self, columns: list = None):
+        """按记录批次逐块返回pandas DataFrame"""
+        table = self._source()
+        if columns is not None:
+            table = table.select(list(columns))
+        for batch in table.to_batches():
+            yield batch.to_pandas()
+
+    # ------------------------------------------------------------------
+    # 选择和过滤
+    # ------------------------------------------------------------------
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self._source().column(key).to_pandas().rename(key)
+        if isinstance(key, pd.Series) and pd.api.types.is_bool_dtype(key):
+            if len(key) != len(self):
+                raise ValueError("布尔索引的长度与数据行数不一致")
+            return self._source().filter(pa.array(key.to_numpy())).to_pandas()
+        if isinstance(key, (list, tuple, pd.Index)):
+            columns = list(key)
+            missing = [col for col in columns if col not in self.columns]
+            if missing:
+                raise KeyError(f"列不存在: {missing}")
+            return LazyFrame(self.path, columns)
+        raise TypeError(f"LazyFrame 不支持此类索引: {type(key).__name__}")
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if name in self.columns:
+            return self[name]
+        raise AttributeError(
+            f"LazyFrame 不支持 {name}，请先用 df[列名]、df.query()、df.groupby() 等缩小数据，"
+            f"或对结果使用pandas方法"
+        )
+
+    def query(self, expr: str, columns: list = None) -> pd.DataFrame:
+        """按块执行 DataFrame.query 过滤，返回满足条件的行"""
+        parts = [chunk.query(expr) for chunk in self.iter_chunks(columns)]
+        if not parts:
+            return self.head(0)
+        return pd.concat(parts, ignore_index=True)
+
+    def nlargest(self, n: int, columns) -> pd.DataFrame:
+        return self._select_k(n, columns, "descending")
+
+    def nsmallest(self, n: int, columns) -> pd.DataFrame:
+        return self._select_k(n, columns, "ascending")
+
+    def _select_k(self, n: int, columns, order: str) -> pd.DataFrame:
+        columns = [columns] if isinstance(columns, str) else list(columns)
+        table = self._source()
+        indices = pc.select_k_unstable(table.select(columns), k=n, sort_keys=[(col, order) for col in columns])
+        result = table.take(indices).to_pandas()
+        return result.sort_values(columns, ascending=order == "ascending", kind="stable").reset_index(drop=True)
+
+    # ------------------------------------------------------------------
+    # 聚合
+    # ------------------------------------------------------------------
+
+    def groupby(self, by, as_index: bool = True, dropna: bool = True):
+        return LazyGroupBy(self, by, as_index=as_index, dropna=dropna)
+
+    def _reduce(self, func: str) -> pd.Series:
+        table = self._source()
+        values = {}
+        for field in table.schema:
+            if func in _NUMERIC_AGGREGATIONS and not _is_numeric(field):
+                continue
+            column = table.column(field.name)
+            if func == "count":
+                value = pc.count(column)
+            elif func == "nunique":
+                value = pc.count_distinct(column)
+            elif func in ("std", "var"):
+                value = getattr(pc, _AGGREGATIONS[func])(column, ddof=1)
+            else:
+                value = getattr(pc, func)(column)
+            values[field.name] = value.as_py()
+        return pd.Series(values, dtype=None if values else "float64")
+
+    def sum(self):
+        return self._reduce("sum")
+
+    def mean(self):
+        return self._reduce("mean")
+
+    def min(self):
+        return self._reduce("min")
+
+    def max(self):
+        return self._reduce("max")
+
+    def count(self):
+        return self._reduce("count")
+
+    def nunique(self):
+        return self._reduce("nunique")
+
+    def std(self):
+        return self._reduce("std")
+
+    def var(self):
+        return self._reduce("var")
+
+    def describe(self) -> pd.DataFrame:
+        """数值列的描述统计，每次只加载一列"""
+        numeric = [field.name for field in self._source().schema if _is_numeric(field)]
+        if not numeric:
+            raise ValueError("没有数值列")
+        return pd.concat([self[col].describe() for col in numeric], axis=1)
+
+    def sql(self, query: str) -> pd.DataFrame:
+        """用SQL查询数据（表名为 df），需要安装duckdb"""
+        if duckdb is None:
+            raise ImportError("未安装duckdb，无法使用SQL查询")
+        con = duckdb.connect()
+        try:
+            con.register("df", self._source())
+            return con.execute(query).df()
+        finally:
+            con.close()
+
+
+class LazyGroupBy:
+    """LazyFrame 的分组聚合，由pyarrow在列式数据上计算"""
+
+    def __init__(self, frame: LazyFrame, by, selection=None, as_index: bool = True, dropna: bool = True):
+        self.frame = frame
+        self.keys = [by] if isinstance(by, str) else list(by)
+        self.selection = selection
+        self.as_index = as_index
+        self.dropna = dropna
+
+    def __getitem__(self, key):
+        return LazyGroupBy(self.frame, self.keys, key, self.as_index, self.dropna)
+
+    def _value_columns(self, func: str = None) -> list:
+        if self.selection is not None:
+            return [self.selection] if isinstance(self.selection, str) else list(self.selection)
+        schema = self.frame._source().schema
+        return [
+            field.name for field in schema
+            if field.name not in self.keys and (func not in _NUMERIC_AGGREGATIONS or _is_numeric(field))
+        ]
+
+    def _aggregate(self, pairs: list) -> pd.DataFrame:
+        """按 [(列, 聚合函数)] 计算，结果按分组键排序，列为 (列, 聚合函数)"""
+        specs = []
+        for col, func in pairs:
+            if func not in _AGGREGATIONS:
+                raise ValueError(f"不支持的聚合函数: {func}，可用: {', '.join(_AGGREGATIONS)}, size")
+            specs.append((col, _AGGREGATIONS[func], _agg_options(func)))
+        columns = list(dict.fromkeys(self.keys + [col for col, _ in pairs]))
+        table = self.frame._source().select(columns)
+        grouped = table.group_by(self.keys).aggregate(specs).to_pandas()
+        result = grouped[self.keys].copy()
+        for (col, func), spec in zip(pairs, specs):
+            result[(col, func)] = grouped[f"{col}_{spec[1]}"]
+        return self._finish(result)
+
+    def _finish(self, result: pd.DataFrame) -> pd.DataFrame:
+        if self.dropna:
+            result = result.dropna(subset=self.keys)
+        result = result.sort_values(self.keys, kind="stable")
+        return result.set_index(self.keys) if len(self.keys) > 1 else result.set_index(self.keys[0])
+
+    def _output(self, result: pd.DataFrame, labels: list):
+        result.columns = labels
+        if not self.as_index:
+            result = result.reset_index()
+        return result
+
+    def agg(self, spec):
+        if isinstance(spec, str):
+            return self._apply(spec)
+        if isinstance(spec, dict):
+            pairs = []
+            for col, funcs in spec.items():
+                pairs.extend((col, func) for func in ([funcs] if isinstance(funcs, str) else funcs))
+            result = self._aggregate(pairs)
+            if all(isinstance(funcs, str) for funcs in spec.values()):
+                return self._output(result, [col for col, _ in pairs])
+            return self._output(result, pd.MultiIndex.from_tuples(pairs))
+        funcs = list(spec)
+        columns = self._value_columns()
+        pairs = [(col, func) for col in columns for func in funcs]
+        result = self._aggregate(pairs)
+        if isinstance(self.selection, str):
+            return self._output(result, funcs)
+        return self._output(result, pd.MultiIndex.from_tuples(pairs))
+
+    aggregate = agg
+
+    def _apply(self, func: str):
+        columns = self._value_columns(func)
+        result = self._aggregate([(col, func) for col in columns])
+        result = self._output(result, columns)
+        if isinstance(self.selection, str) and self.as_index:
+            return result[self.selection]
+        return result
+
+    def sum(self):
+        return self._apply("sum")
+
+    def mean(self):
+        return self._apply("mean")
+
+    def min(self):
+        return self._apply("min")
+
+    def max(self):
+        return self._apply("max")
+
+    def count(self):
+        return self._apply("count")
+
+    def nunique(self):
+        return self._apply("nunique")
+
+    def std(self):
+        return self._apply("std")
+
+    def var(self):
+        return self._apply("var")
+
+    def size(self):
+        table = self.frame._source().select(self.keys)
+        grouped = table.group_by(self.keys).aggregate(
+            [(self.keys[0], "count", pc.CountOptions(mode="all"))]
+        ).to_pandas()
+        result = grouped[self.keys].copy()
+        result["size"] = grouped[f"{self.keys[0]}_count"]
+        result = self._finish(result)
+        if not self.as_index:
+            return result.reset_index()
+        return result["size"].rename(None)
+
+
+def prompt_guide() -> str:
+    """提示词中对 LazyFrame 用法的说明"""
+    lines = [
+        "注意：该数据集较大，代码中的 df 不是 pandas DataFrame，而是按需读取磁盘数据的 LazyFrame。"
+        "请先用下列操作聚合或过滤以缩小数据，再用pandas处理结果：",
+        "- df.columns、df.dtypes、df.shape、len(df)、df.head(n)、df.tail(n)、df.info()、df.describe()",
+        "- df['列名'] 返回该列的pandas Series；df[['列1', '列2']] 返回只含这些列的 LazyFrame；df[布尔Series] 返回过滤后的pandas DataFrame",
+        "- df.query('表达式', columns=[...]) 按块过滤，返回pandas DataFrame",
+        "- df.groupby(键).sum()/mean()/min()/max()/count()/nunique()/std()/var()/size()/agg(...)，"
+        "以及 df.groupby(键)['列'].sum() 等，返回pandas结果",
+        "- df.sum()、df.mean()、df.min()、df.max()、df.count()、df.nunique()、df.nlargest(n, 列名)、df.nsmallest(n, 列名)",
+    ]
+    if duckdb is not None:
+        lines.append("- df.sql('SELECT ... FROM df ...') 用SQL查询，返回pandas DataFrame")
+    lines.append("- df.to_pandas() 将全部数据加载到内存，数据很大时不要使用")
+    return "\n".join(lines)
@@ -1,30 +1,38 @@
-from openai import AsyncOpenAI
 from app.core.config import settings
+from app.services.llm_cache import LLMResponseCache
+from app.services.llm_client import LLMClient
+from app.services.sql_engine import NO_SQL
+from app.services.prompt_builder import fit_sections, format_attempts, trim_traceback, truncate_to_tokens
+from app.core.logger import get_logger, sample_payload
+from app.core.metrics import LLM_REQUESTS, LLM_REQUEST_SECONDS, LLM_TOKENS
+from app.services.tokenizer import estimate_tokens
 import os
 import json
-import httpx
 import asyncio
 import re
+import time
+
+logger = get_logger(__name__)
+
+# chat_completion 的默认采样参数，也是缓存精确匹配键的一部分
+DEFAULT_TEMPERATURE = 0.8
+DEFAULT_MAX_TOKENS = 1000
+# 生成和修复SQL时的温度
+SQL_TEMPERATURE = 0.2
 
 class LLMService:
     def __init__(self):
-        # 创建不带代理的httpx异步客户端
-        self.http_client = httpx.AsyncClient(
-            timeout=60.0,
-            follow_redirects=True
-        )
-        
-        # 使用自定义的http客户端初始化OpenAI客户端
-        self.client = AsyncOpenAI(
-            api_key=settings.OPENAI_API_KEY,
-            base_url=settings.OPENAI_API_BASE_URL,
-            http_client=self.http_client
-        )
+        # 带连接池、限流、重试和对冲的客户端
+        self.client = LLMClient()
         self.model = settings.OPENAI_MODEL
+        # 大模型响应缓存
+        self.cache = LLMResponseCache() if settings.LLM_CACHE_ENABLED else None
     
     async def close(self):
         """关闭异步客户端"""
-        await self.http_client.aclose()
+        await self.client.close()
+        if self.cache is not None:
+            self.cache.close()
     
     def __del__(self):
         """在对象销毁时关闭客户端"""
@@ -38,54 +46,147 @@ class LLMService:
             # 如果无法获取事件循环（例如在应用程序退出时），则忽略错误
             pass
     
-    async def chat_completion(self, messages, temperature=0.8, max_tokens=1000):
-        """通用的大模型对话接口"""
+    async def chat_completion(self, messages, temperature=DEFAULT_TEMPERATURE, max_tokens=DEFAULT_MAX_TOKENS,
+                              cache=False, semantic_key=None, on_token=None, purpose="chat"):
+        """
+        通用的大模型对话接口
+        
+        cache为True时先查询响应缓存（精确匹配，其次按semantic_key语义匹配），未命中才调用大模型。
+        提供on_token回调时以流式方式调用大模型，每收到一段内容即回调一次。
+        purpose为调用用途，用作耗时和token用量指标的标签。
+        """
+        exact_key = None
+        if cache and self.cache is not None:
+            exact_key = self.cache.exact_key(self.model, messages, temperature, max_tokens)
+            content = await self.cache.get(exact_key)
+            if content is None and semantic_key:
+                content = await self.cache.get(semantic_key)
+                if content is not None:
+                    self.cache.semantic_hits += 1
+                    await self.cache.set(exact_key, content)
+            elif content is not None:
+                self.cache.hits += 1
+            if content is not None:
+                LLM_REQUESTS.inc(purpose=purpose, outcome="cache_hit")
+                if on_token is not None:
+                    on_token(content)
+                return content
+            self.cache.misses += 1
+        
+        started = time.perf_counter()
         try:
-            # 打印输入信息用于调试
-            print("\n=============== 大模型调用输入 ===============")
-            print(f"模型: {self.model}")
-            print(f"温度: {temperature}")
-            print(f"最大token数: {max_tokens}")
-            print("消息内容:")
-            for idx, msg in enumerate(messages):
-                print(f"[{idx}] {msg['role']}:")
-                print(f"{msg['content']}")
-            print("==========================================\n")
+            # 提示词只按比例抽样记录
+            logger.debug("大模型调用开始", extra={"fields": {
+                "model": self.model,
+                "temperature": temperature,
+                "max_tokens": max_tokens,
+                "message_count": len(messages),
+                "prompt_chars": sum(len(msg["content"]) for msg in messages),
+                "prompt": sample_payload(messages[-1]["content"]) if messages else None
+            }})
             
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=temperature,
-                max_tokens=max_tokens
-            )
+            usage = None
+            if on_token is not None:
+                content = await self._stream_completion(messages, temperature, max_tokens, on_token)
+            else:
+                response = await self.client.create(
+                    model=self.model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens
+                )
+                
+                content = response.choices[0].message.content
+                usage = response.usage
+            
+            elapsed = time.perf_counter() - started
+            LLM_REQUEST_SECONDS.observe(elapsed, purpose=purpose, outcome="success")
+            LLM_REQUESTS.inc(purpose=purpose, outcome="success")
+            self._record_usage(purpose, messages, content, usage)
             
-            content = response.choices[0].message.content
+            logger.info("大模型调用完成", extra={"fields": {
+                "model": self.model,
+                "purpose": purpose,
+                "elapsed_ms": round(elapsed * 1000),
+                "stream": on_token is not None,
+                "output_chars": len(content or ""),
+                "output": sample_payload(content)
+            }})
             
-            # 打印输出结果用于调试
-            print("\n=============== 大模型调用输出 ===============")
-            print("输出内容:")
-            print(f"{content}")
-            print("==========================================\n")
+            if exact_key is not None:
+                await self.cache.set(exact_key, content)
+                if semantic_key:
+                    await self.cache.set(semantic_key, content)
             
             return content
         except Exception as e:
-            print("\n=============== 大模型调用错误 ===============")
-            print(f"错误信息: {str(e)}")
-            print("==========================================\n")
+            LLM_REQUEST_SECONDS.observe(time.perf_counter() - started, purpose=purpose, outcome="error")
+            LLM_REQUESTS.inc(purpose=purpose, outcome="error")
+            logger.error("大模型调用失败", extra={"fields": {"model": self.model, "purpose": purpose, "error": str(e)}})
             raise Exception(f"大模型调用失败: {str(e)}")
     
-    async def generate_analysis_plan(self, data_info: str, query: str):
-        """生成分析计划"""
-        messages = [
+    async def _stream_completion(self, messages, temperature, max_tokens, on_token):
+        """流式调用大模型，逐段回调并返回完整内容"""
+        parts = []
+        async for chunk in self.client.stream(
+            model=self.model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens
+        ):
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                on_token(delta)
+        return "".join(parts)
+    
+    @staticmethod
+    def _record_usage(purpose: str, messages: list, content: str, usage):
+        """记录token用量，接口未返回用量（流式调用）时按本地估算记录"""
+        if usage is not None:
+            LLM_TOKENS.inc(usage.prompt_tokens or 0, purpose=purpose, type="prompt", source="usage")
+            LLM_TOKENS.inc(usage.completion_tokens or 0, purpose=purpose, type="completion", source="usage")
+        else:
+            prompt_tokens = sum(estimate_tokens(msg["content"]) for msg in messages)
+            LLM_TOKENS.inc(prompt_tokens, purpose=purpose, type="prompt", source="estimate")
+            LLM_TOKENS.inc(estimate_tokens(content), purpose=purpose, type="completion", source="estimate")
+    
+    def _semantic_key(self, kind: str, schema_fingerprint: str, query: str):
+        """数据结构指纹加查询的语义缓存键，未提供指纹时不做语义匹配"""
+        if not schema_fingerprint or self.cache is None:
+            return None
+        return self.cache.semantic_key(kind, self.model, schema_fingerprint, query)
+    
+    async def forget_analysis(self, data_info: str, query: str, analysis_plan: str, schema_fingerprint: str = None):
+        """
+        删除缓存的分析计划和分析代码（精确匹配和语义匹配的条目）
+
+        生成的代码执行失败时调用，之后相同的查询重新调用大模型，而不是再次得到同样的计划和代码。
+        """
+        if self.cache is None:
+            return
+        await self.cache.delete(
+            self.cache.exact_key(self.model, self._plan_messages(data_info, query),
+                                 DEFAULT_TEMPERATURE, DEFAULT_MAX_TOKENS),
+            self._semantic_key("plan", schema_fingerprint, query),
+            self.cache.exact_key(self.model, self._code_messages(analysis_plan, data_info, query),
+                                 DEFAULT_TEMPERATURE, DEFAULT_MAX_TOKENS),
+            self._semantic_key("code", schema_fingerprint, query)
+        )
+    
+    @staticmethod
+    def _plan_messages(data_info: str, query: str) -> list:
+        return [
             {"role": "system", "content": """你是一个数据分析专家，请根据用户的需求和数据信息，生成一句话的分析计划。
             请用浅显易懂的语言描述，避免使用技术术语。"""},
             {"role": "user", "content": f"数据信息:\n{data_info}\n\n用户需求：{query}"}
         ]
-        return await self.chat_completion(messages)
     
-    async def generate_analysis_code(self, analysis_plan: str, data_info: str, query: str):
-        """生成分析代码"""
-        messages = [
+    @staticmethod
+    def _code_messages(analysis_plan: str, data_info: str, query: str) -> list:
+        return [
             {"role": "system", "content": """你是一个Python数据分析专家，请根据用户需求和分析计划生成Python代码。
             代码要求：
             1. 使用pandas处理数据
@@ -98,9 +199,27 @@ class LLMService:
             7. 不要添加任何解释和代码块标记。"""},
             {"role": "user", "content": f"用户需求：\n{query}\n\n分析计划：\n{analysis_plan}\n\n数据信息：\n{data_info}\n\n请直接生成Python代码。"}
         ]
-        return await self.chat_completion(messages)
     
-    async def fix_code(self, code: str, error: str, query: str, data_info: str):
+    async def generate_analysis_plan(self, data_info: str, query: str, schema_fingerprint: str = None,
+                                     on_token=None):
+        """生成分析计划"""
+        return await self.chat_completion(
+            self._plan_messages(data_info, query), cache=True,
+            semantic_key=self._semantic_key("plan", schema_fingerprint, query),
+            on_token=on_token, purpose="plan"
+        )
+    
+    async def generate_analysis_code(self, analysis_plan: str, data_info: str, query: str,
+                                     schema_fingerprint: str = None, on_token=None):
+        """生成分析代码"""
+        return await self.chat_completion(
+            self._code_messages(analysis_plan, data_info, query), cache=True,
+            semantic_key=self._semantic_key("code", schema_fingerprint, query),
+            on_token=on_token, purpose="code"
+        )
+    
+    async def fix_code(self, code: str, error: str, query: str, data_info: str, on_token=None,
+                       temperature=0.8):
         """修复执行失败的代码"""
         messages = [
             {"role": "system", "content": """你是一个Python代码修复专家，请修复代码中的错误。
@@ -114,7 +233,63 @@ class LLMService:
             """},
             {"role": "user", "content": f"用户需求: {query}\n\n数据信息: {data_info}\n\n原始代码：\n{code}\n\n错误信息：\n{error}\n\n请修复代码。"}
         ]
-        return await self.chat_completion(messages)
+        return await self.chat_completion(messages, temperature=temperature, on_token=on_token,
+                                          purpose="fix_code")
+    
+    async def generate_sql(self, data_info: str, query: str, engine: str, schema_fingerprint: str = None,
+                           on_token=None):
+        """生成查询SQL，需求不适合用一条SQL完成时返回 NO_SQL"""
+        return await self.chat_completion(
+            self._sql_messages(data_info, query, engine), temperature=SQL_TEMPERATURE, cache=True,
+            semantic_key=self._semantic_key(f"sql:{engine}", schema_fingerprint, query),
+            on_token=on_token, purpose="sql"
+        )
+    
+    async def reject_sql(self, data_info: str, query: str, engine: str, schema_fingerprint: str = None):
+        """
+        将需求在缓存中记为 NO_SQL
+
+        SQL经过修复仍失败时调用，之后相同的需求直接走代码流程，不再生成和修复SQL。
+        """
+        if self.cache is None:
+            return
+        exact_key = self.cache.exact_key(self.model, self._sql_messages(data_info, query, engine),
+                                         SQL_TEMPERATURE, DEFAULT_MAX_TOKENS)
+        await self.cache.set(exact_key, NO_SQL)
+        semantic_key = self._semantic_key(f"sql:{engine}", schema_fingerprint, query)
+        if semantic_key:
+            await self.cache.set(semantic_key, NO_SQL)
+    
+    @staticmethod
+    def _sql_messages(data_info: str, query: str, engine: str) -> list:
+        dialect = "DuckDB" if engine == "duckdb" else "SQLite"
+        return [
+            {"role": "system", "content": f"""你是一个数据分析专家，请判断用户需求能否用一条{dialect} SQL查询完成，能完成时生成该SQL。
+            要求：
+            1. 主数据集的表名为 df，数据信息中列出的其他数据集以其变量名作为表名
+            2. 只能使用一条 SELECT 查询（可以使用 WITH），不要修改数据
+            3. 列名包含空格、中文或特殊字符时使用双引号包裹
+            4. 需求需要绘图、建模、复杂的多步处理或无法用SQL表达时，只回复 NO_SQL
+            5. 直接返回SQL，不要添加任何解释和代码块标记。"""},
+            {"role": "user", "content": f"用户需求：\n{query}\n\n数据信息：\n{data_info}"}
+        ]
+    
+    async def fix_sql(self, sql: str, error: str, query: str, data_info: str, engine: str, on_token=None):
+        """修复校验或执行失败的SQL"""
+        dialect = "DuckDB" if engine == "duckdb" else "SQLite"
+        prompt = fit_sections([
+            ("用户需求", query, 0),
+            ("数据信息", data_info, 2),
+            ("原始SQL", sql, 0),
+            ("错误信息", error, 1)
+        ])
+        messages = [
+            {"role": "system", "content": f"""你是一个{dialect} SQL专家，请修复SQL中的错误。
+            只能使用一条 SELECT 查询，主数据集的表名为 df。无法用SQL完成时只回复 NO_SQL。
+            请直接返回修复后的SQL，不要包含任何解释或代码块标记。"""},
+            {"role": "user", "content": prompt}
+        ]
+        return await self.chat_completion(messages, temperature=SQL_TEMPERATURE, on_token=on_token, purpose="fix_sql")
     
     async def explain_result(self, result: dict, query: str):
         """解释分析结果"""
@@ -127,7 +302,7 @@ class LLMService:
             4. 使用非技术性语言"""},
             {"role": "user", "content": f"分析结果：\n{json.dumps(result, ensure_ascii=False, indent=2)}\n\n原始查询：{query}"}
         ]
-        return await self.chat_completion(messages)
+        return await self.chat_completion(messages, purpose="explain_result")
     
     async def suggest_visualization(self, result: dict, query: str):
         """建议可视化方案"""
@@ -140,17 +315,20 @@ class LLMService:
             4. 考虑数据的特性和展示效果"""},
             {"role": "user", "content": f"分析结果：\n{json.dumps(result, ensure_ascii=False, indent=2)}\n\n原始查询：{query}"}
         ]
-        return await self.chat_completion(messages)
+        return await self.chat_completion(messages, purpose="suggest_visualization")
     
     async def analyze_error(self, code: str, error: str, query: str = None, data_info: str = None, 
-              info_code: str = None, run_info_result: str = None):
+              info_code: str = None, run_info_result: str = None, on_token=None, temperature=0.8):
         """分析错误并提出下一步计划"""
-        info_prompt = ""
-        info = {"用户需求": query, "数据信息": data_info, "错误信息": error, "原始代码": code, 
-                "获取信息代码": info_code, "运行结果": run_info_result}
-        for key in ["用户需求", "数据信息", "原始代码", "错误信息", "获取信息代码", "运行结果"]:
-            if info[key]:
-                info_prompt += f"{key}：\n{info[key]}\n\n"
+        # 堆栈只保留生成代码中的帧，超出token预算时优先截断数据信息和获取信息的运行结果
+        info_prompt = fit_sections([
+            ("用户需求", query, 0),
+            ("数据信息", data_info, 3),
+            ("原始代码", code, 0),
+            ("错误信息", trim_traceback(error), 1),
+            ("获取信息代码", info_code, 1),
+            ("运行结果", trim_traceback(run_info_result), 2)
+        ])
 
         messages = [
             {"role": "system", "content": """你是一个数据分析专家，擅长调试和修复Python数据分析代码。 请根据当前的信息, 提供下一步计划和相应的代码。
@@ -173,14 +351,16 @@ class LLMService:
             """},
             {"role": "user", "content": info_prompt}
         ]
-        result = await self.chat_completion(messages)
+        result = await self.chat_completion(messages, temperature=temperature, on_token=on_token,
+                                            purpose="analyze_error")
         parsed_result = self.parse_llm_response(result)
         if parsed_result["plan"] not in ["获取信息", "修复代码"]:
-            print(f"大模型返回的计划不是获取信息或修复代码，使用兜底方案返回结果")
+            logger.warning("大模型返回的计划不是获取信息或修复代码，使用兜底方案返回结果",
+                           extra={"fields": {"plan": parsed_result["plan"]}})
             return {
                 "plan": "修复代码",
                 "reason": "大模型返回的计划不是获取信息或修复代码，使用兜底方案返回结果，默认选择修复代码",
-                "code": await self.fix_code(code, error, query, data_info)
+                "code": await self.fix_code(code, error, query, data_info, temperature=temperature)
             }
         else:
             return parsed_result
@@ -188,7 +368,7 @@ class LLMService:
             return {
                 "plan": "修复代码",
                 "reason": "无法解析大模型返回的JSON，默认选择修复代码",
-                "code": await self.fix_code(code, error, query, data_info)
+                "code": await self.fix_code(code, error, query, data_info, temperature=temperature)
             }
     
     async def analyze_with_additional_info(self, original_code: str, error_message: str, 
@@ -217,14 +397,19 @@ class LLMService:
 
 请修复原始代码，使其能够正确执行。"""}
         ]
-        return await self.chat_completion(messages)
+        return await self.chat_completion(messages, purpose="analyze_with_additional_info")
     
-    async def notify_user_too_many_attempts(self, original_code: str, attempts_history: list, query: str):
+    async def notify_user_too_many_attempts(self, original_code: str, attempts_history: list, query: str,
+                                            on_token=None):
         """通知用户尝试次数过多，提供错误分析和建议"""
-        attempts_str = "\n\n".join([
-            f"尝试 {i+1}:\n代码: {attempt.get('code', '无')}\n错误: {attempt.get('error', '无')}"
-            for i, attempt in enumerate(attempts_history)
-        ])
+        # 重复的代码只发送差异，整体不超过token预算；用户查询和原始代码各最多占预算的四分之一，
+        # 尝试历史是这条提示词要总结的内容，至少保留一半预算
+        budget = settings.PROMPT_TOKEN_BUDGET
+        prompt = fit_sections([
+            ("用户查询", truncate_to_tokens(query, budget // 4), 0),
+            ("原始代码", truncate_to_tokens(original_code, budget // 4), 2),
+            ("尝试历史", format_attempts(original_code, attempts_history), 1)
+        ], budget)
         
         messages = [
             {"role": "system", "content": """你是一个Python数据分析专家，请分析多次尝试失败的原因并提供建议。
@@ -232,17 +417,9 @@ class LLMService:
             1. 失败的主要原因分析
             2. 给用户的具体建议，包括可能需要提供的额外信息
             3. 用简洁明了的语言表达"""},
-            {"role": "user", "content": f"""用户查询：{query}
-            
-原始代码：
-{original_code}
-
-尝试历史：
-{attempts_str}
-
-请分析失败原因并给出建议。"""}
+            {"role": "user", "content": f"{prompt}请分析失败原因并给出建议。"}
         ]
-        return await self.chat_completion(messages)
+        return await self.chat_completion(messages, on_token=on_token, purpose="notify")
     
     def parse_llm_response(self, result):
         """
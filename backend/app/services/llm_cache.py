@@ -0,0 +1,156 @@
+"""
+大模型响应缓存
+
+以规范化后的 (模型, 消息, 温度, 最大token数) 为精确匹配键，另支持以 (用途, 模型, 数据结构指纹, 查询) 为键的语义匹配，
+使同一数据结构上的重复查询无需再次调用大模型。内存中按TTL和LRU淘汰，可选SQLite磁盘后端以便重启后继续使用。
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from app.core.config import settings
+
+
+def normalize_text(text: str) -> str:
+    """规范化文本：去掉首尾空白并合并连续空白"""
+    return re.sub(r"\s+", " ", (text or "").strip())
+
+
+def _digest(payload) -> str:
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class _DiskBackend:
+    """基于SQLite的缓存持久化"""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT, created REAL)"
+            )
+            self._conn.commit()
+
+    def get(self, key: str, ttl: float):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or row[1] < time.time() - ttl:
+            return None
+        return row[0]
+
+    def set(self, key: str, value: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, created) VALUES (?, ?, ?)",
+                (key, value, time.time())
+            )
+            self._conn.commit()
+
+    def delete(self, keys: list):
+        with self._lock:
+            self._conn.executemany("DELETE FROM llm_cache WHERE key = ?", [(key,) for key in keys])
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class LLMResponseCache:
+    """大模型响应的内存缓存，可选磁盘后端"""
+
+    def __init__(self, max_entries: int = None, ttl: float = None, disk_path: str = None):
+        self.max_entries = max_entries or settings.LLM_CACHE_MAX_ENTRIES
+        self.ttl = ttl or settings.LLM_CACHE_TTL
+        disk_path = disk_path if disk_path is not None else settings.LLM_CACHE_DISK_PATH
+        self._disk = _DiskBackend(disk_path) if disk_path else None
+        # key -> (响应内容, 写入时间)
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def exact_key(model: str, messages: list, temperature: float, max_tokens: int) -> str:
+        """精确匹配键"""
+        normalized = [
+            {"role": msg["role"], "content": normalize_text(msg["content"])}
+            for msg in messages
+        ]
+        return "exact:" + _digest({
+            "model": model,
+            "messages": normalized,
+            "temperature": temperature,
+            "max_tokens": max_tokens
+        })
+
+    @staticmethod
+    def semantic_key(kind: str, model: str, schema_fingerprint: str, query: str) -> str:
+        """语义匹配键：相同数据结构上的相同查询"""
+        return "semantic:" + _digest({
+            "kind": kind,
+            "model": model,
+            "schema": schema_fingerprint,
+            "query": normalize_text(query).lower()
+        })
+
+    async def get(self, key: str):
+        """读取缓存，先查内存再查磁盘，未命中返回None"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, created = entry
+            if created >= time.time() - self.ttl:
+                self._entries.move_to_end(key)
+                return value
+            del self._entries[key]
+        if self._disk is not None:
+            value = await asyncio.to_thread(self._disk.get, key, self.ttl)
+            if value is not None:
+                self._remember(key, value)
+                return value
+        return None
+
+    async def set(self, key: str, value: str):
+        self._remember(key, value)
+        if self._disk is not None:
+            await asyncio.to_thread(self._disk.set, key, value)
+
+    async def delete(self, *keys: str):
+        """删除缓存条目，缓存的响应已知不可用时（如生成的代码执行失败）调用"""
+        keys = [key for key in keys if key]
+        for key in keys:
+            self._entries.pop(key, None)
+        if keys and self._disk is not None:
+            await asyncio.to_thread(self._disk.delete, keys)
+
+    def _remember(self, key: str, value: str):
+        self._entries[key] = (value, time.time())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "disk_enabled": self._disk is not None
+        }
+
+    def close(self):
+        if self._disk is not None:
+            self._disk.close()
@@ -0,0 +1,234 @@
+"""
+大模型接口客户端
+
+在OpenAI客户端之外增加连接池配置、并发上限、按请求数和token数的限流、可重试错误的指数退避重试，
+以及慢请求的对冲（超过近期p95耗时仍未返回时再发一个相同请求，取先返回的结果）。
+"""
+import asyncio
+import random
+import time
+from collections import deque
+
+import httpx
+from openai import (
+    APIConnectionError,
+    APIStatusError,
+    APITimeoutError,
+    AsyncOpenAI,
+    InternalServerError,
+    RateLimitError,
+)
+
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.core.metrics import LLM_HEDGED_REQUESTS, LLM_RATE_LIMIT_WAIT_SECONDS, LLM_RETRIES
+from app.services.tokenizer import estimate_tokens
+
+logger = get_logger(__name__)
+
+# 对冲延迟统计使用的最近请求数
+LATENCY_WINDOW = 200
+
+# 服务端要求的重试等待时间上限（秒）
+MAX_RETRY_AFTER = 60
+
+
+class TokenBucket:
+    """每分钟配额的令牌桶，capacity为0时不限流"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1) -> float:
+        """取出令牌，不足时等待补充，返回等待的秒数"""
+        if self.capacity <= 0:
+            return 0.0
+        # 单次需求超过桶容量时按容量计算，避免永远等待
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return waited
+                delay = (amount - self.tokens) / self.rate
+                await asyncio.sleep(delay)
+                waited += delay
+
+
+class LatencyTracker:
+    """记录最近请求的耗时，用于计算对冲延迟"""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.samples = deque(maxlen=window)
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+
+    def quantile(self, q: float, min_samples: int):
+        if len(self.samples) < min_samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def is_retryable(error: Exception) -> bool:
+    """限流、超时、连接错误和服务端5xx错误可以重试"""
+    if isinstance(error, (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError)):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return isinstance(error, httpx.TransportError)
+
+
+def _retry_after(error: Exception):
+    """读取服务端返回的Retry-After（秒）"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return min(float(response.headers.get("retry-after")), MAX_RETRY_AFTER)
+    except (TypeError, ValueError):
+        return None
+
+
+class LLMClient:
+    """带连接池、限流、重试和对冲的大模型客户端"""
+
+    def __init__(self, base_url: str = None, api_key: str = None, transport: httpx.AsyncBaseTransport = None):
+        self.http_client = httpx.AsyncClient(
+            timeout=settings.LLM_TIMEOUT,
+            follow_redirects=True,
+            limits=httpx.Limits(
+                max_connections=settings.LLM_POOL_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.LLM_POOL_MAX_KEEPALIVE,
+                keepalive_expiry=settings.LLM_KEEPALIVE_EXPIRY
+            ),
+            transport=transport
+        )
+        # 重试由本客户端负责，关闭OpenAI客户端自带的重试
+        self.client = AsyncOpenAI(
+            api_key=api_key or settings.OPENAI_API_KEY,
+            base_url=base_url or settings.OPENAI_API_BASE_URL,
+            http_client=self.http_client,
+            max_retries=0
+        )
+        self.semaphore = asyncio.Semaphore(settings.LLM_MAX_CONCURRENCY)
+        self.request_bucket = TokenBucket(settings.LLM_REQUESTS_PER_MINUTE)
+        self.token_bucket = TokenBucket(settings.LLM_TOKENS_PER_MINUTE)
+        self.latency = LatencyTracker()
+
+    async def close(self):
+        await self.http_client.aclose()
+
+    async def _throttle(self, kwargs: dict):
+        """按请求数和预估token数限流"""
+        tokens = sum(estimate_tokens(msg["content"]) for msg in kwargs.get("messages", []))
+        tokens += kwargs.get("max_tokens") or 0
+        waited = await self.request_bucket.acquire(1)
+        waited += await self.token_bucket.acquire(tokens)
+        if waited:
+            LLM_RATE_LIMIT_WAIT_SECONDS.observe(waited)
+
+    async def _backoff(self, error: Exception, attempt: int):
+        delay = _retry_after(error)
+        if delay is None:
+            # 带随机抖动的指数退避
+            delay = min(settings.LLM_RETRY_MAX_DELAY, settings.LLM_RETRY_BASE_DELAY * (2 ** attempt))
+            delay = random.uniform(0, delay)
+        LLM_RETRIES.inc(error=type(error).__name__)
+        logger.warning("大模型调用失败，准备重试", extra={"fields": {
+            "attempt": attempt + 1,
+            "delay": round(delay, 3),
+            "error": str(error)
+        }})
+        await asyncio.sleep(delay)
+
+    async def _request(self, kwargs: dict):
+        """发送一次请求"""
+        await self._throttle(kwargs)
+        async with self.semaphore:
+            started = time.monotonic()
+            response = await self.client.chat.completions.create(**kwargs)
+            self.latency.record(time.monotonic() - started)
+            return response
+
+    async def _hedged_request(self, kwargs: dict):
+        """
+        超过对冲延迟仍未返回时再发一个相同请求，取先成功的结果
+
+        返回、出错或调用方被取消时，未完成的请求都被取消，不会继续占用并发名额和限流额度。
+        """
+        delay = None
+        if settings.LLM_HEDGE_ENABLED:
+            delay = self.latency.quantile(settings.LLM_HEDGE_QUANTILE, settings.LLM_HEDGE_MIN_SAMPLES)
+        primary = asyncio.create_task(self._request(kwargs))
+        tasks = [primary]
+        try:
+            if delay is None:
+                return await primary
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done:
+                return primary.result()
+
+            hedge = asyncio.create_task(self._request(kwargs))
+            tasks.append(hedge)
+            pending = {primary, hedge}
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        LLM_HEDGED_REQUESTS.inc(winner="hedge" if task is hedge else "primary")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def create(self, **kwargs):
+        """非流式调用，可重试错误按退避策略重试"""
+        attempt = 0
+        while True:
+            try:
+                return await self._hedged_request(kwargs)
+            except Exception as e:
+                if attempt >= settings.LLM_MAX_RETRIES or not is_retryable(e):
+                    raise
+                await self._backoff(e, attempt)
+                attempt += 1
+
+    async def stream(self, **kwargs):
+        """
+        流式调用，逐个返回响应块
+
+        收到第一个响应块之前出错时重试，之后出错直接抛出（已输出的内容无法撤回）。整个流式读取过程占用一个并发名额。
+        """
+        attempt = 0
+        while True:
+            received = False
+            try:
+                await self._throttle(kwargs)
+                async with self.semaphore:
+                    response = await self.client.chat.completions.create(stream=True, **kwargs)
+                    async for chunk in response:
+                        received = True
+                        yield chunk
+                return
+            except Exception as e:
+                if received or attempt >= settings.LLM_MAX_RETRIES or not is_retryable(e):
+                    raise
+                await self._backoff(e, attempt)
+                attempt += 1
@@ -0,0 +1,287 @@
+"""
+数据概要生成
+
+为提示词生成紧凑的数据概要：数据规模、每列的类型、空值数、不同值数量估计、取值范围或常见值，以及样例行。
+统计量均为整列向量化计算，概要按token预算逐级压缩，列数增加时提示词长度基本保持不变。
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.services.lazy_frame import LazyFrame
+from app.services.tokenizer import estimate_tokens
+
+logger = get_logger(__name__)
+
+# 不同值数量估计使用的最小哈希个数（KMV估计）
+KMV_SIZE = 1024
+
+# 常见值展示个数
+TOP_K = 5
+
+# 单元格内容展示的最大长度
+MAX_CELL_CHARS = 30
+
+# 小表（行列数均较少）时展示全部数据
+SMALL_TABLE_ROWS = 100
+SMALL_TABLE_COLUMNS = 20
+
+# 类别型列保存完整频数的最大不同值数，超过时只保存最常见的部分
+COUNTS_LIMIT = 10000
+
+# 按数据内容哈希缓存的概要和列统计量
+_SUMMARY_CACHE_SIZE = 256
+_summary_cache = OrderedDict()
+_stats_cache = OrderedDict()
+# 概要在多个线程中生成（asyncio.to_thread），缓存的读写需要加锁；统计量的计算在锁外进行
+_cache_lock = threading.Lock()
+
+
+def _short(value) -> str:
+    text = str(value)
+    return text if len(text) <= MAX_CELL_CHARS else text[:MAX_CELL_CHARS] + "…"
+
+
+def _kmv_sketch(values) -> np.ndarray:
+    """值中最小的 KMV_SIZE 个不同哈希值，可与其他数据块的结果合并"""
+    values = pd.Series(values).dropna()
+    if values.empty:
+        return np.empty(0, dtype=np.uint64)
+    # 不做分类编码直接哈希，对高基数字符串列更快
+    hashes = pd.util.hash_array(values.to_numpy(), categorize=False)
+    # 先用partition取出最小的一批哈希值，避免对整列排序
+    candidates = min(len(hashes), KMV_SIZE * 4)
+    smallest = np.unique(np.partition(hashes, candidates - 1)[:candidates])
+    if len(smallest) < KMV_SIZE and candidates < len(hashes):
+        # 重复值较多，最小的一批中不同值不足，退回全量去重
+        smallest = np.unique(hashes)
+    return smallest[:KMV_SIZE]
+
+
+def _sketch_cardinality(sketch: np.ndarray) -> int:
+    if len(sketch) < KMV_SIZE:
+        return len(sketch)
+    kth = sketch[KMV_SIZE - 1]
+    return int((KMV_SIZE - 1) / (float(kth) / float(np.iinfo(np.uint64).max)))
+
+
+def estimate_cardinality(col: pd.Series) -> int:
+    """
+    估计列中不同值的数量
+
+    对整列做一次向量化哈希，取最小的 KMV_SIZE 个不同哈希值估计基数；不同值较少时结果是精确的。
+    """
+    return _sketch_cardinality(_kmv_sketch(col))
+
+
+def _is_categorical(col: pd.Series) -> bool:
+    """非数值、非日期的列（字符串、布尔、混合类型等）"""
+    return pd.api.types.is_bool_dtype(col) or not (
+        pd.api.types.is_numeric_dtype(col) or pd.api.types.is_datetime64_any_dtype(col)
+    )
+
+
+def compute_column_stats(df: pd.DataFrame) -> list:
+    """
+    逐列计算可合并的统计量
+
+    类别型列保存频数（不同值过多时只保存最常见的部分），其他列保存最小、最大值；每列都保存KMV草图用于估计不同值数量。
+    LazyFrame 按记录批次逐块计算后合并，不整体加载数据。
+    """
+    if isinstance(df, LazyFrame):
+        stats = None
+        for chunk in df.iter_chunks():
+            chunk_stats = compute_column_stats(chunk)
+            stats = chunk_stats if stats is None else merge_column_stats(stats, chunk_stats)
+        return stats if stats is not None else compute_column_stats(df.head(0))
+    null_counts = df.isna().sum().to_numpy()
+    stats = []
+    for idx, name in enumerate(df.columns):
+        col = df.iloc[:, idx]
+        stat = {"name": str(name), "nulls": int(null_counts[idx]), "categorical": _is_categorical(col)}
+        if stat["categorical"]:
+            counts = col.value_counts(dropna=True)
+            # 草图只需对不同值哈希
+            stat["sketch"] = _kmv_sketch(counts.index)
+            stat["counts_complete"] = len(counts) <= COUNTS_LIMIT
+            stat["counts"] = counts.head(COUNTS_LIMIT)
+        else:
+            stat["sketch"] = _kmv_sketch(col)
+            non_null = col.dropna()
+            stat["min"] = non_null.min() if not non_null.empty else None
+            stat["max"] = non_null.max() if not non_null.empty else None
+        stats.append(stat)
+    return stats
+
+
+def merge_column_stats(base: list, delta: list) -> list:
+    """合并两批数据的统计量，列不一致或取值无法比较时抛出ValueError"""
+    if [stat["name"] for stat in base] != [stat["name"] for stat in delta]:
+        raise ValueError("列不一致，无法合并统计量")
+    merged = []
+    for left, right in zip(base, delta):
+        if left["categorical"] != right["categorical"]:
+            raise ValueError(f"列 {left['name']} 类型变化，无法合并统计量")
+        stat = {
+            "name": left["name"],
+            "nulls": left["nulls"] + right["nulls"],
+            "categorical": left["categorical"],
+            "sketch": np.unique(np.concatenate([left["sketch"], right["sketch"]]))[:KMV_SIZE]
+        }
+        if stat["categorical"]:
+            counts = left["counts"].add(right["counts"], fill_value=0).astype("int64")
+            counts = counts.sort_values(ascending=False, kind="stable")
+            stat["counts_complete"] = left["counts_complete"] and right["counts_complete"] and \
+                len(counts) <= COUNTS_LIMIT
+            stat["counts"] = counts.head(COUNTS_LIMIT)
+        else:
+            try:
+                values = [v for v in (left["min"], right["min"]) if v is not None and not pd.isna(v)]
+                stat["min"] = min(values) if values else None
+                values = [v for v in (left["max"], right["max"]) if v is not None and not pd.isna(v)]
+                stat["max"] = max(values) if values else None
+            except TypeError as e:
+                raise ValueError(f"列 {left['name']} 取值无法比较: {e}")
+        merged.append(stat)
+    return merged
+
+
+def _describe(stat: dict, dtype: str) -> dict:
+    """由统计量生成用于展示的列描述"""
+    described = {"name": stat["name"], "dtype": dtype, "nulls": stat["nulls"], "detail": ""}
+    if stat["categorical"] and stat["counts_complete"]:
+        # 频数完整时不同值数量是精确的
+        described["unique"] = len(stat["counts"])
+        described["unique_exact"] = True
+    else:
+        described["unique"] = _sketch_cardinality(stat["sketch"])
+        # 不同值不超过KMV_SIZE时估计值是精确的
+        described["unique_exact"] = described["unique"] < KMV_SIZE
+    if stat["categorical"]:
+        top = stat["counts"].head(TOP_K)
+        if not top.empty:
+            described["detail"] = "常见值: " + ", ".join(f"{_short(k)}({v})" for k, v in top.items())
+    elif stat["min"] is not None:
+        described["detail"] = f"最小 {_short(stat['min'])}, 最大 {_short(stat['max'])}"
+    return described
+
+
+def _column_line(stat: dict, level: int) -> str:
+    """按详细程度生成单列描述，level越大越简略"""
+    if level >= 2:
+        return f"- {stat['name']} | {stat['dtype']}"
+    unique = stat["unique"] if stat["unique_exact"] else f"≈{stat['unique']}"
+    line = f"- {stat['name']} | {stat['dtype']} | 空值 {stat['nulls']} | 不同值 {unique}"
+    if level == 0 and stat["detail"]:
+        line += f" | {stat['detail']}"
+    return line
+
+
+def _rows_text(frame: pd.DataFrame) -> str:
+    # 截断过长的文本单元格
+    frame = frame.apply(lambda col: col.map(_short, na_action='ignore') if _is_categorical(col) else col)
+    return frame.to_csv(sep='\t', index=False, na_rep='nan')
+
+
+def profile_dataframe(df: pd.DataFrame, token_budget: int = None, sample_rows: int = None,
+                      column_stats: list = None) -> str:
+    """
+    生成不超过token预算的数据概要（列清单本身超出预算时只保留列名和类型）
+
+    提供 column_stats 时直接使用已有的统计量，不再扫描数据。
+    """
+    token_budget = token_budget or settings.DATA_INFO_TOKEN_BUDGET
+    sample_rows = sample_rows or settings.DATA_INFO_SAMPLE_ROWS
+    rows, columns = df.shape
+
+    header = f"数据规模: {rows}行 × {columns}列\n"
+    if column_stats is None:
+        column_stats = compute_column_stats(df)
+    dtypes = df.dtypes.astype(str).tolist()
+    stats = [_describe(stat, dtype) for stat, dtype in zip(column_stats, dtypes)]
+
+    # 列信息按详细程度逐级压缩，直到满足预算
+    for level in range(3):
+        column_text = "\n".join(_column_line(stat, level) for stat in stats)
+        title = "列信息（列名 | 类型" + (" | 空值数 | 不同值数" if level < 2 else "") + \
+                (" | 取值范围/常见值" if level == 0 else "") + "）:\n"
+        summary = header + "\n" + title + column_text + "\n"
+        if estimate_tokens(summary) <= token_budget:
+            break
+
+    # 剩余预算用于样例数据
+    remaining = token_budget - estimate_tokens(summary)
+    if remaining <= 0:
+        return summary
+    if rows < SMALL_TABLE_ROWS and columns < SMALL_TABLE_COLUMNS:
+        full_text = "\n数据全部内容信息：\n" + _rows_text(df.head(rows))
+        if estimate_tokens(full_text) <= remaining:
+            return summary + full_text
+    for n in range(min(sample_rows, rows), 0, -1):
+        sample_text = f"\n数据前{n}行内容信息：\n" + _rows_text(df.head(n))
+        if estimate_tokens(sample_text) <= remaining:
+            return summary + sample_text
+    return summary
+
+
+def _lru_get(cache: OrderedDict, key):
+    with _cache_lock:
+        value = cache.get(key)
+        if value is not None:
+            cache.move_to_end(key)
+        return value
+
+
+def _lru_put(cache: OrderedDict, key, value):
+    with _cache_lock:
+        cache[key] = value
+        cache.move_to_end(key)
+        if len(cache) > _SUMMARY_CACHE_SIZE:
+            cache.popitem(last=False)
+
+
+def _dataset_stats(df: pd.DataFrame, data_key: str = None) -> list:
+    """获取数据的列统计量，提供数据内容哈希时复用已计算的结果"""
+    stats = _lru_get(_stats_cache, data_key) if data_key else None
+    if stats is None:
+        stats = compute_column_stats(df)
+        if data_key:
+            _lru_put(_stats_cache, data_key, stats)
+    return stats
+
+
+def summarize_dataset(df: pd.DataFrame, data_key: str = None, token_budget: int = None) -> str:
+    """生成数据概要，提供数据内容哈希时复用已生成的结果"""
+    token_budget = token_budget or settings.DATA_INFO_TOKEN_BUDGET
+    if data_key is None:
+        return profile_dataframe(df, token_budget)
+    cache_key = (data_key, token_budget)
+    summary = _lru_get(_summary_cache, cache_key)
+    if summary is None:
+        summary = profile_dataframe(df, token_budget, column_stats=_dataset_stats(df, data_key))
+        _lru_put(_summary_cache, cache_key, summary)
+    return summary
+
+
+def summarize_appended(df: pd.DataFrame, data_key: str, base_key: str, delta: pd.DataFrame,
+                       token_budget: int = None) -> str:
+    """
+    生成追加数据后的数据概要
+
+    df 为追加后的完整数据。base_key 对应的统计量已缓存时只扫描新增的 delta 并合并统计量，否则扫描完整数据。
+    """
+    base_stats = _lru_get(_stats_cache, base_key) if base_key else None
+    stats = None
+    if base_stats is not None:
+        try:
+            stats = merge_column_stats(base_stats, compute_column_stats(delta))
+        except ValueError as e:
+            logger.info("无法增量合并统计量，改为扫描完整数据", extra={"fields": {"error": str(e)}})
+    if stats is None:
+        stats = compute_column_stats(df)
+    _lru_put(_stats_cache, data_key, stats)
+    return summarize_dataset(df, data_key, token_budget)
@@ -0,0 +1,141 @@
+"""
+提示词压缩
+
+错误分析和多次失败通知的提示词会随重试次数增长。这里提供的工具将堆栈裁剪为生成代码（<string>）中的帧，
+多次尝试中重复的代码只发送与上一版本的差异，并按本地估算的token数把提示词限制在预算之内。
+"""
+import difflib
+import re
+
+from app.core.config import settings
+from app.services.tokenizer import estimate_tokens
+
+# 生成代码在执行引擎中编译时使用的文件名
+GENERATED_CODE_FILENAME = "<string>"
+
+_FRAME_PATTERN = re.compile(r'^\s*File "(?P<filename>[^"]+)", line \d+')
+
+# 截断时中间插入的说明
+_ELLIPSIS = "\n…（中间省略{omitted}字符）…\n"
+
+
+def trim_traceback(traceback_message: str) -> str:
+    """
+    只保留生成代码中的堆栈帧和最终的异常信息
+
+    没有生成代码中的帧时保留最后一帧，便于定位出错的库函数；链式异常只保留最后一段。
+    """
+    if not traceback_message or "Traceback" not in traceback_message:
+        return traceback_message or ""
+    lines = traceback_message.rstrip().splitlines()
+    # 堆栈之前的错误说明原样保留
+    prefix = []
+    header = []
+    frames = []
+    tail = []
+    current = None
+    for line in lines:
+        if line.startswith("Traceback"):
+            # 链式异常只保留最后一段堆栈
+            header = [line]
+            frames = []
+            tail = []
+            current = None
+            continue
+        match = _FRAME_PATTERN.match(line)
+        if match:
+            current = [line]
+            frames.append((match.group("filename"), current))
+        elif line.startswith("    ") and current is not None:
+            current.append(line)
+        elif not header:
+            prefix.append(line)
+        else:
+            # 异常类型和信息
+            current = None
+            tail.append(line)
+    kept = [frame for filename, frame in frames if filename == GENERATED_CODE_FILENAME]
+    if not kept and frames:
+        kept = [frames[-1][1]]
+    omitted = len(frames) - len(kept)
+    result = prefix + header
+    if omitted:
+        result.append(f"  …（省略{omitted}个库函数帧）")
+    for frame in kept:
+        result.extend(frame)
+    result.extend(tail)
+    return "\n".join(result)
+
+
+def code_diff(previous: str, current: str) -> str:
+    """current相对previous的unified diff，差异不比完整代码短时返回完整代码"""
+    if previous == current:
+        return ""
+    diff = "\n".join(difflib.unified_diff(
+        (previous or "").splitlines(), (current or "").splitlines(),
+        fromfile="上一版本", tofile="本次", lineterm="", n=2
+    ))
+    return diff if len(diff) < len(current or "") else current
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """按token数截断文本，保留开头和结尾"""
+    if not text or estimate_tokens(text) <= max_tokens:
+        return text
+    if max_tokens <= 0:
+        return ""
+    # 按平均每token字符数估算保留长度，再逐步收缩
+    keep = int(len(text) * max_tokens / estimate_tokens(text))
+    while keep > 0:
+        head = text[:keep // 2]
+        tail = text[len(text) - keep // 2:]
+        candidate = head + _ELLIPSIS.format(omitted=len(text) - len(head) - len(tail)) + tail
+        if estimate_tokens(candidate) <= max_tokens:
+            return candidate
+        keep = int(keep * 0.9)
+    return ""
+
+
+def fit_sections(sections: list, token_budget: int = None) -> str:
+    """
+    将 (标题, 内容, 优先级) 组合为提示词，超出预算时从优先级最低（数值最大）的部分开始截断
+
+    内容为空的部分不输出。
+    """
+    token_budget = token_budget or settings.PROMPT_TOKEN_BUDGET
+    parts = [[title, text, priority] for title, text, priority in sections if text]
+
+    def render():
+        return "".join(f"{title}：\n{text}\n\n" for title, text, _ in parts)
+
+    overflow = estimate_tokens(render()) - token_budget
+    for part in sorted(parts, key=lambda item: -item[2]):
+        if overflow <= 0:
+            break
+        current = estimate_tokens(part[1])
+        part[1] = truncate_to_tokens(part[1], max(0, current - overflow))
+        overflow -= current - estimate_tokens(part[1])
+    return render()
+
+
+def format_attempts(original_code: str, attempts_history: list) -> str:
+    """
+    汇总多次尝试的代码和错误
+
+    与之前某次尝试完全相同的代码只注明编号，其余只给出与上一版本代码的差异。
+    """
+    seen = {original_code: "原始代码"}
+    previous = original_code
+    blocks = []
+    for idx, attempt in enumerate(attempts_history, start=1):
+        code = attempt.get("code") or ""
+        if code in seen:
+            code_text = f"与{seen[code]}相同"
+        else:
+            diff = code_diff(previous, code)
+            code_text = f"相对上一版本的修改:\n{diff}" if diff != code else code
+            seen[code] = f"尝试 {idx} 的代码"
+        previous = code
+        error = trim_traceback(attempt.get("traceback") or "") or attempt.get("error") or "无"
+        blocks.append(f"尝试 {idx}:\n代码: {code_text}\n错误: {error}")
+    return "\n\n".join(blocks)
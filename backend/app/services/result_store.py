@@ -0,0 +1,277 @@
+"""
+分析结果存储
+
+保存可下载的完整分析结果（DataFrame）。内存中的结果有总量预算，超出时按LRU顺序写入磁盘；
+较大的结果直接以压缩的列式格式（Arrow IPC + zstd）落盘。所有结果在TTL后过期删除。
+使用可共享的状态后端时，结果全部落盘并在状态后端中登记，其他工作进程也能提供下载。
+"""
+import asyncio
+import glob
+import os
+import time
+import uuid
+from collections import OrderedDict
+
+import pandas as pd
+
+from app.core.config import settings
+from app.services.session_store import frame_memory_usage
+
+try:
+    import pyarrow as pa
+    from pyarrow import feather
+except ImportError:  # 未安装pyarrow时以pickle格式落盘
+    pa = None
+    feather = None
+
+# 分批读取结果时每批的行数
+BATCH_ROWS = 50000
+
+
+class ResultStore:
+    """带内存/磁盘预算、TTL和LRU淘汰的分析结果存储"""
+
+    # 状态后端中结果索引的命名空间
+    NAMESPACE = "results"
+
+    def __init__(self, storage_dir: str = None, backend=None):
+        self.storage_dir = storage_dir or settings.RESULT_STORE_DIR
+        os.makedirs(self.storage_dir, exist_ok=True)
+        self.memory_budget = settings.RESULT_MEMORY_BUDGET_MB * 1024 * 1024
+        self.disk_budget = settings.RESULT_DISK_BUDGET_MB * 1024 * 1024
+        self.spill_threshold = settings.RESULT_SPILL_THRESHOLD_MB * 1024 * 1024
+        self.ttl = settings.RESULT_TTL
+        # download_id -> 结果条目，按访问顺序排列
+        self._entries = OrderedDict()
+        self.memory_bytes = 0
+        self.disk_bytes = 0
+        # 多个工作进程共享结果索引
+        self.backend = backend if backend is not None and backend.persistent else None
+        self._cleanup_stale_files()
+        if self.backend is not None:
+            self.backend.purge(self.NAMESPACE, time.time() - self.ttl)
+
+    def _cleanup_stale_files(self):
+        """删除上次运行遗留的过期结果文件"""
+        deadline = time.time() - self.ttl
+        for path in glob.glob(os.path.join(self.storage_dir, "*")):
+            try:
+                if os.path.getmtime(path) < deadline:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def __contains__(self, download_id):
+        self._expire()
+        return download_id in self._entries
+
+    async def put(self, df: pd.DataFrame) -> str:
+        """保存结果并返回下载ID，较大的结果直接写入磁盘"""
+        self._expire()
+        download_id = str(uuid.uuid4())
+        size = frame_memory_usage(df)
+        entry = {
+            "df": df,
+            "path": None,
+            "size": size,
+            "disk_size": 0,
+            "rows": len(df),
+            "created": time.monotonic()
+        }
+        self._entries[download_id] = entry
+        self.memory_bytes += size
+        if size > self.spill_threshold or self.backend is not None:
+            await self._spill(download_id)
+        if self.backend is not None and entry["path"]:
+            self.backend.put(self.NAMESPACE, download_id, {
+                "path": entry["path"],
+                "rows": entry["rows"],
+                "disk_size": entry["disk_size"],
+                "created": time.time()
+            })
+        await self._enforce_budget(keep=download_id)
+        return download_id
+
+    def _write(self, download_id: str, df: pd.DataFrame) -> str:
+        """将结果写入磁盘，优先使用压缩的列式格式，无法转换时使用pickle"""
+        if feather is not None:
+            path = os.path.join(self.storage_dir, f"{download_id}.arrow")
+            try:
+                frame = df.reset_index(drop=True)
+                frame.columns = [str(col) for col in frame.columns]
+                feather.write_feather(frame, path, compression="zstd")
+                return path
+            except Exception:
+                # 混合类型列等无法转换为Arrow的结果
+                if os.path.exists(path):
+                    os.remove(path)
+        path = os.path.join(self.storage_dir, f"{download_id}.pkl")
+        df.to_pickle(path)
+        return path
+
+    async def _spill(self, download_id: str):
+        """将内存中的结果写入磁盘并释放内存"""
+        entry = self._entries.get(download_id)
+        if entry is None or entry["df"] is None:
+            return
+        path = await asyncio.to_thread(self._write, download_id, entry["df"])
+        # 写入期间条目可能已过期
+        if download_id not in self._entries:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        entry["path"] = path
+        entry["disk_size"] = os.path.getsize(path)
+        entry["df"] = None
+        self.memory_bytes -= entry["size"]
+        self.disk_bytes += entry["disk_size"]
+
+    async def _enforce_budget(self, keep=None):
+        """内存超出预算时按LRU顺序写入磁盘，磁盘超出预算时删除最久未访问的结果"""
+        for download_id in list(self._entries.keys()):
+            if self.memory_bytes <= self.memory_budget:
+                break
+            if download_id != keep and self._entries.get(download_id, {}).get("df") is not None:
+                await self._spill(download_id)
+        for download_id in list(self._entries.keys()):
+            if self.disk_bytes <= self.disk_budget:
+                break
+            if download_id != keep and self._entries[download_id]["path"]:
+                self._remove(download_id)
+
+    def _remove(self, download_id: str):
+        entry = self._entries.pop(download_id, None)
+        if self.backend is not None:
+            self.backend.delete(self.NAMESPACE, download_id)
+        if entry is None:
+            return
+        if entry["df"] is not None:
+            self.memory_bytes -= entry["size"]
+        if entry["path"]:
+            self.disk_bytes -= entry["disk_size"]
+            try:
+                os.remove(entry["path"])
+            except OSError:
+                pass
+
+    def _expire(self):
+        """删除超过TTL的结果"""
+        deadline = time.monotonic() - self.ttl
+        for download_id in [k for k, v in self._entries.items() if v["created"] < deadline]:
+            self._remove(download_id)
+
+    def _get_entry(self, download_id: str):
+        self._expire()
+        entry = self._entries.get(download_id)
+        if entry is None and self.backend is not None:
+            entry = self._adopt(download_id)
+        if entry is not None:
+            self._entries.move_to_end(download_id)
+        return entry
+
+    def _adopt(self, download_id: str):
+        """载入其他工作进程保存的结果"""
+        record = self.backend.get(self.NAMESPACE, download_id)
+        if record is None:
+            return None
+        age = time.time() - record["created"]
+        if age > self.ttl or not os.path.exists(record["path"]):
+            self.backend.delete(self.NAMESPACE, download_id)
+            return None
+        entry = {
+            "df": None,
+            "path": record["path"],
+            "size": 0,
+            "disk_size": record["disk_size"],
+            "rows": record["rows"],
+            "created": time.monotonic() - age
+        }
+        self._entries[download_id] = entry
+        self.disk_bytes += entry["disk_size"]
+        return entry
+
+    def get(self, download_id: str):
+        """获取完整结果，不存在或已过期时返回None"""
+        entry = self._get_entry(download_id)
+        if entry is None:
+            return None
+        if entry["df"] is not None:
+            return entry["df"]
+        return self._read(entry["path"])
+
+    def describe(self, download_id: str):
+        """结果的基本信息（行数、是否在内存中），不存在时返回None"""
+        entry = self._get_entry(download_id)
+        if entry is None:
+            return None
+        return {"rows": entry["rows"], "in_memory": entry["df"] is not None}
+
+    def arrow_schema(self, download_id: str):
+        """
+        整份结果的Arrow列类型，不存在或已过期时返回None
+
+        磁盘上的列式结果直接读取文件中的schema，内存中的结果按整列推断，而不是只看第一个批次。
+        包含无法转换为Arrow的混合类型列时抛出 ValueError。
+        """
+        if pa is None:
+            raise RuntimeError("未安装pyarrow")
+        entry = self._get_entry(download_id)
+        if entry is None:
+            return None
+        if entry["path"] is not None and entry["path"].endswith(".arrow"):
+            with pa.memory_map(entry["path"]) as source:
+                return pa.ipc.open_file(source).schema
+        df = entry["df"] if entry["df"] is not None else pd.read_pickle(entry["path"])
+        try:
+            return pa.Schema.from_pandas(df, preserve_index=False)
+        except (pa.ArrowException, TypeError) as e:
+            raise ValueError(str(e))
+
+    def _read(self, path: str) -> pd.DataFrame:
+        if path.endswith(".arrow"):
+            return feather.read_table(path, memory_map=True).to_pandas()
+        return pd.read_pickle(path)
+
+    def iter_batches(self, download_id: str, batch_rows: int = BATCH_ROWS):
+        """
+        按批次读取结果，磁盘上的列式结果逐批解码，不会一次性加载到内存
+
+        结果不存在或已过期时返回None。
+        """
+        entry = self._get_entry(download_id)
+        if entry is None:
+            return None
+        df = entry["df"]
+        path = entry["path"]
+
+        def slice_frame(frame):
+            # 空结果也返回一个只有列名的批次
+            for start in range(0, max(len(frame), 1), batch_rows):
+                yield frame.iloc[start:start + batch_rows]
+
+        def generate():
+            if df is not None:
+                yield from slice_frame(df)
+            elif path.endswith(".arrow"):
+                with pa.memory_map(path) as source:
+                    reader = pa.ipc.open_file(source)
+                    if reader.num_record_batches == 0:
+                        yield reader.schema.empty_table().to_pandas()
+                    for i in range(reader.num_record_batches):
+                        table = pa.Table.from_batches([reader.get_batch(i)])
+                        for sub in table.to_batches(max_chunksize=batch_rows):
+                            yield pa.Table.from_batches([sub]).to_pandas()
+            else:
+                yield from slice_frame(pd.read_pickle(path))
+
+        return generate()
+
+    def stats(self) -> dict:
+        return {
+            "results": len(self._entries),
+            "in_memory": sum(1 for v in self._entries.values() if v["df"] is not None),
+            "memory_bytes": self.memory_bytes,
+            "disk_bytes": self.disk_bytes,
+            "memory_budget": self.memory_budget,
+            "disk_budget": self.disk_budget
+        }
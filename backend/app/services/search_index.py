@@ -0,0 +1,339 @@
+"""
+示例和常用查询的全文检索
+
+倒排索引常驻内存，打分时按词取出倒排表对应的数组做向量化计算，覆盖示例的名称、描述、标签、用户需求和生成的代码，以及常用查询的名称和内容。
+中文（及日文、韩文）按单字和相邻二字切分，英文、数字按单词切分并支持前缀匹配，结果按BM25打分排序。
+
+文档内容保存在SQLite文件中，启动时从中重建倒排索引，不需要重新读取示例的JSON文件。
+每次写入都分配递增的序号，检索前只加载其他工作进程新写入的部分，多个进程的索引保持一致。
+"""
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
+
+# 各字段在打分中的权重
+FIELD_WEIGHTS = {"name": 3.0, "tags": 3.0, "query": 2.0, "description": 1.5, "code": 0.5}
+
+# BM25参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# 前缀匹配最多展开的词数，前缀匹配的得分打折
+PREFIX_EXPANSIONS = 50
+PREFIX_PENALTY = 0.7
+
+SNIPPET_CHARS = 80
+
+# 平假名、片假名、中日韩统一表意文字（含扩展A区）、韩文音节、兼容表意文字
+_CJK = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff"
+_TOKEN_PATTERN = re.compile(f"[a-z0-9]+|[{_CJK}]+")
+
+
+def _is_cjk(run: str) -> bool:
+    return not run[0].isascii()
+
+
+def tokenize(text: str) -> list:
+    """
+    切分文本用于建立索引
+
+    英文、数字按单词切分（下划线等符号作为分隔）；中日韩文字连续的一段同时产生单字和相邻二字。
+    """
+    tokens = []
+    for run in _TOKEN_PATTERN.findall((text or "").lower()):
+        if _is_cjk(run):
+            tokens.extend(run)
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+def query_terms(text: str) -> list:
+    """
+    切分检索词，返回 [(词, 是否允许前缀匹配)]
+
+    中文按相邻二字检索（单字时按单字），英文单词允许前缀匹配。
+    """
+    terms = []
+    for run in _TOKEN_PATTERN.findall((text or "").lower()):
+        if not _is_cjk(run):
+            terms.append((run, True))
+        elif len(run) == 1:
+            terms.append((run, False))
+        else:
+            terms.extend((run[i:i + 2], False) for i in range(len(run) - 1))
+    # 去重并保持顺序
+    return list(dict.fromkeys(terms))
+
+
+class SearchIndex:
+    """内存倒排索引，文档内容持久化在SQLite中"""
+
+    def __init__(self, path: str = None):
+        self.path = path or settings.SEARCH_INDEX_PATH
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._lock = threading.RLock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            # body 为NULL表示文档已删除，保留该行使其他进程能同步删除
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS documents (doc_id TEXT PRIMARY KEY, seq INTEGER NOT NULL, body TEXT)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS documents_seq ON documents (seq)")
+
+        # 文档ID -> 文档（类型、标题、标签、元信息、版本、槽位），按写入先后排列
+        self._docs = {}
+        # 每个文档占用一个整数槽位，倒排表和文档长度按槽位存放
+        self._slot_docs = []
+        self._free_slots = []
+        self._lengths = np.zeros(1024)
+        self._kinds = np.full(1024, -1, dtype=np.int16)
+        self._kind_codes = {}
+        self._total_length = 0.0
+        # 词 -> {槽位: 加权词频}，以及由其生成的 (槽位数组, 词频数组)，词的倒排表变化后重新生成
+        self._postings = defaultdict(dict)
+        self._arrays = {}
+        # 文档ID -> 文档包含的词，删除和更新时用于清理倒排表
+        self._doc_terms = {}
+        # 已排序的词表，用于前缀匹配，索引变化后重建
+        self._sorted_terms = []
+        self._terms_dirty = False
+        # 已加载的最大写入序号
+        self._seq = 0
+
+        started = time.perf_counter()
+        self._refresh()
+        logger.info("检索索引已加载", extra={"fields": {
+            "documents": len(self._docs), "terms": len(self._postings),
+            "elapsed": round(time.perf_counter() - started, 3)
+        }})
+
+    def put(self, doc_id: str, kind: str, fields: dict, title: str, tags: list = None, meta: dict = None,
+            version=None):
+        """
+        写入或更新文档
+
+        fields 为 {字段名: 文本}，字段名对应 FIELD_WEIGHTS；version 与已索引的版本相同时跳过。
+        """
+        with self._lock:
+            if version is not None and doc_id in self._docs and self._docs[doc_id]["version"] == version:
+                return
+            body = json.dumps({
+                "kind": kind, "fields": {name: text or "" for name, text in fields.items()},
+                "title": title or "", "tags": list(tags or []), "meta": meta or {}, "version": version
+            }, ensure_ascii=False, default=str)
+            self._write(doc_id, body)
+
+    def remove(self, doc_id: str):
+        with self._lock:
+            if doc_id in self._docs:
+                self._write(doc_id, None)
+
+    def versions(self, kind: str) -> dict:
+        """某类文档的 {文档ID: 版本}"""
+        with self._lock:
+            self._refresh()
+            return {doc_id: doc["version"] for doc_id, doc in self._docs.items() if doc["kind"] == kind}
+
+    def search(self, text: str, kind: str = None, tags: list = None, limit: int = 20) -> list:
+        """
+        检索文档，按得分从高到低返回
+
+        多个检索词时同时命中的词越多得分越高；提供 tags 时只返回包含全部标签的文档；
+        检索词为空时按标签筛选，返回最近写入的文档。
+        """
+        with self._lock:
+            self._refresh()
+            tags = set(tag for tag in (tags or []) if tag)
+            terms = query_terms(text)
+            if not terms:
+                doc_ids = (doc_id for doc_id in reversed(list(self._docs)) if self._accepted(doc_id, kind, tags))
+                return [self._result(doc_id, 0.0) for doc_id, _ in zip(doc_ids, range(limit))]
+            if not self._docs:
+                return []
+
+            size = len(self._slot_docs)
+            average_length = self._total_length / len(self._docs)
+            norms = BM25_K1 * (1 - BM25_B + BM25_B * self._lengths[:size] / average_length)
+            scores = np.zeros(size)
+            matched = np.zeros(size)
+            for term, prefix in terms:
+                expansions = [(term, 1.0)]
+                if prefix:
+                    expansions += [(candidate, PREFIX_PENALTY) for candidate in self._prefixed(term)]
+                # 同一检索词的多个前缀展开只取最高分
+                best = None
+                for candidate, factor in expansions:
+                    arrays = self._term_arrays(candidate)
+                    if arrays is None:
+                        continue
+                    slots, frequencies = arrays
+                    idf = math.log(1 + (len(self._docs) - len(slots) + 0.5) / (len(slots) + 0.5))
+                    term_scores = factor * idf * frequencies * (BM25_K1 + 1) / (frequencies + norms[slots])
+                    if best is None:
+                        best = np.zeros(size)
+                    best[slots] = np.maximum(best[slots], term_scores)
+                if best is not None:
+                    scores += best
+                    matched += best > 0
+
+            scores *= matched / len(terms)
+            candidates = scores > 0
+            if kind is not None:
+                candidates &= self._kinds[:size] == self._kind_codes.get(kind, -2)
+            candidates = np.flatnonzero(candidates)
+            if not tags and len(candidates) > limit:
+                # 只需要前 limit 个时先做部分排序
+                candidates = candidates[np.argpartition(-scores[candidates], limit - 1)[:limit]]
+            ranked = candidates[np.argsort(-scores[candidates], kind="stable")]
+            results = []
+            for slot in ranked:
+                doc_id = self._slot_docs[slot]
+                if self._accepted(doc_id, None, tags):
+                    results.append(self._result(doc_id, float(scores[slot])))
+                    if len(results) >= limit:
+                        break
+            return results
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _write(self, doc_id: str, body):
+        self._conn.execute(
+            "INSERT INTO documents (doc_id, seq, body) "
+            "VALUES (?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM documents), ?) "
+            "ON CONFLICT (doc_id) DO UPDATE SET seq = excluded.seq, body = excluded.body",
+            (doc_id, body)
+        )
+        self._refresh()
+
+    def _refresh(self):
+        """加载序号大于已加载序号的写入（包括其他进程的写入）"""
+        latest = self._conn.execute("SELECT MAX(seq) FROM documents").fetchone()[0] or 0
+        if latest <= self._seq:
+            return
+        rows = self._conn.execute(
+            "SELECT doc_id, seq, body FROM documents WHERE seq > ? ORDER BY seq", (self._seq,)
+        ).fetchall()
+        for doc_id, seq, body in rows:
+            self._unindex(doc_id)
+            if body is not None:
+                self._index(doc_id, json.loads(body))
+            self._seq = max(self._seq, seq)
+
+    def _allocate_slot(self) -> int:
+        if self._free_slots:
+            return self._free_slots.pop()
+        slot = len(self._slot_docs)
+        self._slot_docs.append(None)
+        if slot >= len(self._lengths):
+            self._lengths = np.concatenate([self._lengths, np.zeros(len(self._lengths))])
+            self._kinds = np.concatenate([self._kinds, np.full(len(self._kinds), -1, dtype=np.int16)])
+        return slot
+
+    def _index(self, doc_id: str, doc: dict):
+        frequencies = defaultdict(float)
+        for name, text in doc["fields"].items():
+            weight = FIELD_WEIGHTS.get(name, 1.0)
+            for token in tokenize(text):
+                frequencies[token] += weight
+        slot = self._allocate_slot()
+        for token, frequency in frequencies.items():
+            self._postings[token][slot] = frequency
+            self._arrays.pop(token, None)
+        length = sum(frequencies.values())
+        doc["slot"] = slot
+        doc["tag_set"] = set(doc["tags"])
+        self._docs[doc_id] = doc
+        self._doc_terms[doc_id] = list(frequencies)
+        self._slot_docs[slot] = doc_id
+        self._lengths[slot] = length
+        self._kinds[slot] = self._kind_codes.setdefault(doc["kind"], len(self._kind_codes))
+        self._total_length += length
+        self._terms_dirty = True
+
+    def _unindex(self, doc_id: str):
+        doc = self._docs.pop(doc_id, None)
+        if doc is None:
+            return
+        slot = doc["slot"]
+        for token in self._doc_terms.pop(doc_id, []):
+            postings = self._postings.get(token)
+            if postings is not None:
+                postings.pop(slot, None)
+                self._arrays.pop(token, None)
+                if not postings:
+                    del self._postings[token]
+        self._total_length -= self._lengths[slot]
+        self._lengths[slot] = 0.0
+        self._kinds[slot] = -1
+        self._slot_docs[slot] = None
+        self._free_slots.append(slot)
+        self._terms_dirty = True
+
+    def _term_arrays(self, term: str):
+        """词的倒排表对应的 (槽位数组, 词频数组)，词不存在时返回None"""
+        arrays = self._arrays.get(term)
+        if arrays is None:
+            postings = self._postings.get(term)
+            if not postings:
+                return None
+            arrays = (np.fromiter(postings.keys(), dtype=np.int64, count=len(postings)),
+                      np.fromiter(postings.values(), dtype=np.float64, count=len(postings)))
+            self._arrays[term] = arrays
+        return arrays
+
+    def _accepted(self, doc_id: str, kind: str, tags: set) -> bool:
+        doc = self._docs[doc_id]
+        return (kind is None or doc["kind"] == kind) and tags <= doc["tag_set"]
+
+    def _prefixed(self, prefix: str) -> list:
+        """以 prefix 开头的其他词，最多 PREFIX_EXPANSIONS 个"""
+        if len(prefix) < 2:
+            return []
+        if self._terms_dirty:
+            self._sorted_terms = sorted(self._postings)
+            self._terms_dirty = False
+        terms = []
+        position = bisect_left(self._sorted_terms, prefix)
+        while position < len(self._sorted_terms) and len(terms) < PREFIX_EXPANSIONS:
+            term = self._sorted_terms[position]
+            if not term.startswith(prefix):
+                break
+            if term != prefix:
+                terms.append(term)
+            position += 1
+        return terms
+
+    def _result(self, doc_id: str, score: float) -> dict:
+        doc = self._docs[doc_id]
+        fields = doc["fields"]
+        snippet = fields.get("description") or fields.get("query") or ""
+        if len(snippet) > SNIPPET_CHARS:
+            snippet = snippet[:SNIPPET_CHARS] + "…"
+        return {
+            "kind": doc["kind"],
+            "title": doc["title"],
+            "tags": doc["tags"],
+            "snippet": snippet,
+            "score": round(score, 4),
+            **doc["meta"]
+        }
@@ -0,0 +1,402 @@
+"""
+分析会话存储
+
+按 memory_usage(deep=True) 统计每个会话数据占用的内存，超过全局预算时按最近最少使用顺序换出数据。
+换出的数据以列式缓存文件（内容哈希命名的旁路文件）保存在磁盘上，下次分析时透明地重新加载。
+超过 SESSION_TIMEOUT 未访问的会话会被清理。
+
+会话中除数据以外的元信息（数据概要、内容哈希、文件路径、数据目录等）写入状态后端，只在有变化时整体写入；
+分析历史按条追加写入，不重写已有的历史，多个工作进程同时分析同一会话时各自的历史都会保留。
+使用可共享的后端时，请求开始时通过 load 载入其他工作进程的更新（按版本号检测），数据按内容哈希从列式缓存重新加载。
+访问状态后端的操作都在线程中进行，不阻塞事件循环；get 只读取本进程中的会话。
+"""
+import asyncio
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict
+
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.services.dependencies import get_dataset_cache, get_state_backend
+from app.services.lazy_frame import LazyFrame
+
+logger = get_logger(__name__)
+
+
+def frame_memory_usage(df) -> int:
+    """DataFrame 实际占用的内存字节数"""
+    if df is None or isinstance(df, LazyFrame):
+        # LazyFrame 的数据在磁盘上，不计入内存预算
+        return 0
+    return int(df.memory_usage(deep=True).sum())
+
+
+def _session_record(session: dict) -> dict:
+    """会话中整体写入状态后端的部分：不含数据本身和分析历史，只保留能重新加载数据的信息"""
+    record = {key: value for key, value in session.items() if key not in ("data", "analysis_history", "spilled")}
+    if session.get("data") is not None:
+        record["out_of_core"] = isinstance(session["data"], LazyFrame)
+    if session.get("datasets"):
+        record["datasets"] = {
+            name: {key: value for key, value in entry.items() if key != "data"}
+            for name, entry in session["datasets"].items()
+        }
+    return record
+
+
+def _record_payload(record: dict) -> str:
+    return json.dumps(record, ensure_ascii=False, default=str, sort_keys=True)
+
+
+class SessionStore:
+    """带内存预算、LRU换出和过期清理的会话存储"""
+
+    # 状态后端中会话元信息的命名空间
+    NAMESPACE = "sessions"
+    # 状态后端中分析历史的命名空间，每条历史一条记录
+    HISTORY_NAMESPACE = "session_history"
+
+    def __init__(self, memory_budget: int = None, timeout: float = None, backend=None):
+        self.memory_budget = memory_budget or settings.SESSION_MEMORY_BUDGET_MB * 1024 * 1024
+        self.timeout = timeout or settings.SESSION_TIMEOUT
+        self.backend = backend or get_state_backend()
+        # 本进程持有的各会话在状态后端中的版本号
+        self._versions = {}
+        # 各会话最近写入或读取的元信息，未变化时不重复写入
+        self._saved_records = {}
+        # 各会话已完成、尚未写入状态后端的分析历史
+        self._pending_history = {}
+        # 各会话已读取到的历史记录序号，以及本进程写入、读取时需要跳过的序号
+        self._history_cursor = {}
+        self._own_history = {}
+        # 同一会话的状态后端读写依次进行
+        self._locks = {}
+        self.restored = 0
+        # 按访问顺序排列，最久未访问的在最前
+        self._sessions = OrderedDict()
+        self._last_access = {}
+        self._sizes = {}
+        self.total_bytes = 0
+        self.evictions = 0
+        self.rehydrations = 0
+        self.expirations = 0
+        if self.backend.persistent:
+            purged = self.backend.purge(self.NAMESPACE, time.time() - settings.STATE_TTL)
+            if purged:
+                logger.info("已删除过期的持久化会话", extra={"fields": {"count": purged}})
+            live = set(self.backend.keys(self.NAMESPACE))
+            for session_id in self.backend.entry_keys(self.HISTORY_NAMESPACE):
+                if session_id not in live:
+                    self.backend.delete_entries(self.HISTORY_NAMESPACE, session_id)
+
+    async def _io(self, func, *args):
+        """调用状态后端，可共享的后端在线程中访问"""
+        if self.backend.persistent:
+            return await asyncio.to_thread(func, *args)
+        return func(*args)
+
+    def _lock(self, session_id) -> asyncio.Lock:
+        lock = self._locks.get(session_id)
+        if lock is None:
+            lock = self._locks[session_id] = asyncio.Lock()
+        return lock
+
+    # ------------------------------------------------------------------
+    # 会话读写
+    # ------------------------------------------------------------------
+
+    def get(self, session_id, default=None):
+        """本进程中的会话，不访问状态后端；请求开始时应先通过 load 载入其他进程的更新"""
+        self._expire_idle()
+        session = self._sessions.get(session_id)
+        if session is None:
+            return default
+        self._touch(session_id)
+        return session
+
+    async def load(self, session_id, default=None):
+        """从状态后端载入其他进程的更新后返回会话"""
+        if self.backend.persistent:
+            await self.refresh(session_id)
+        return self.get(session_id, default)
+
+    async def put(self, session_id, session: dict):
+        """
+        保存整个会话
+
+        会话的分析历史不是本进程已持有的同一个列表时（如重新上传数据后新建的会话），视为新的历史，
+        状态后端中已有的历史被替换。
+        """
+        local = self._sessions.get(session_id)
+        history = session.setdefault("analysis_history", [])
+        fresh = local is None or local.get("analysis_history") is not history
+        if local is not None:
+            self._forget_size(session_id)
+        self._sessions[session_id] = session
+        self._touch(session_id)
+        self._account(session_id)
+        if fresh:
+            # 其他进程据此发现历史已被替换
+            session["history_epoch"] = uuid.uuid4().hex
+            self._pending_history[session_id] = list(history)
+            self._own_history[session_id] = set()
+        self._expire_idle()
+        self._enforce_budget(keep=session_id)
+        await self.save(session_id, reset_history=fresh)
+
+    def add_history(self, session_id, entry: dict):
+        """
+        记录一条已完成的分析历史，下次 save 时追加到状态后端
+
+        entry 可以已在会话的历史列表中（分析开始时加入，便于在本进程中查看进度），不会重复加入。
+        """
+        session = self._sessions.get(session_id)
+        if session is None:
+            return
+        history = session.setdefault("analysis_history", [])
+        if not any(item is entry for item in history):
+            history.append(entry)
+        self._pending_history.setdefault(session_id, []).append(entry)
+
+    async def save(self, session_id, reset_history: bool = False):
+        """将会话的变化写入状态后端：元信息有变化时整体写入，新的分析历史按条追加"""
+        session = self._sessions.get(session_id)
+        if session is None:
+            return
+        record = _session_record(session)
+        payload = _record_payload(record)
+        changed = payload != self._saved_records.get(session_id)
+        history = self._pending_history.pop(session_id, [])
+        if not self.backend.persistent:
+            # 进程内后端中的会话按引用保存，不需要另存历史
+            history = []
+        if not changed and not history and not reset_history:
+            return
+        async with self._lock(session_id):
+            version, seqs = await self._io(
+                self._write_remote, session_id, record if changed else None, history, reset_history
+            )
+            if session_id not in self._sessions:
+                return
+            if changed:
+                self._saved_records[session_id] = payload
+            if version is not None:
+                self._versions[session_id] = version
+            self._own_history.setdefault(session_id, set()).update(seqs)
+
+    async def remove(self, session_id) -> bool:
+        """删除会话，会话不存在时返回False"""
+        exists = session_id in self._sessions
+        if not exists and self.backend.persistent:
+            exists = await self._io(self.backend.version, self.NAMESPACE, session_id) is not None
+        if not exists:
+            return False
+        self._drop_local(session_id)
+        await self._io(self._delete_remote, session_id)
+        return True
+
+    async def ids(self) -> list:
+        """全部会话ID，包括只在状态后端中的会话"""
+        keys = list(self._sessions.keys())
+        if self.backend.persistent:
+            remote = await self._io(self.backend.keys, self.NAMESPACE)
+            keys.extend(key for key in remote if key not in self._sessions)
+        return keys
+
+    # ------------------------------------------------------------------
+    # 状态后端
+    # ------------------------------------------------------------------
+
+    def _write_remote(self, session_id, record, history: list, reset_history: bool):
+        """在线程中写入元信息和新的分析历史，返回 (新版本号, 历史记录序号)"""
+        if reset_history:
+            self.backend.delete_entries(self.HISTORY_NAMESPACE, session_id)
+        version = self.backend.put(self.NAMESPACE, session_id, record) if record is not None else None
+        seqs = self.backend.append(self.HISTORY_NAMESPACE, session_id, history) if history else []
+        return version, seqs
+
+    def _delete_remote(self, session_id):
+        self.backend.delete(self.NAMESPACE, session_id)
+        self.backend.delete_entries(self.HISTORY_NAMESPACE, session_id)
+
+    def _read_remote(self, session_id, known_version, known_epoch, cursor: int):
+        """在线程中读取版本号、有更新时的元信息和新的分析历史"""
+        version = self.backend.version(self.NAMESPACE, session_id)
+        if version is None:
+            return None, None, []
+        record = self.backend.get(self.NAMESPACE, session_id) if version != known_version else None
+        if record is not None and record.get("history_epoch") != known_epoch:
+            # 历史已被替换，从头读取
+            cursor = 0
+        return version, record, self.backend.entries(self.HISTORY_NAMESPACE, session_id, cursor)
+
+    async def refresh(self, session_id):
+        """状态后端中的会话比本进程持有的更新（或已被删除）时，更新本进程的副本"""
+        async with self._lock(session_id):
+            local = self._sessions.get(session_id)
+            known = self._versions.get(session_id) if local is not None else None
+            epoch = local.get("history_epoch") if local is not None else None
+            cursor = self._history_cursor.get(session_id, 0) if local is not None else 0
+            version, record, entries = await asyncio.to_thread(self._read_remote, session_id, known, epoch, cursor)
+
+            local = self._sessions.get(session_id)
+            if version is None:
+                if local is not None and session_id in self._versions:
+                    # 已被其他进程关闭
+                    self._drop_local(session_id)
+                return
+            if record is not None:
+                local = self._restore(session_id, record, version, local)
+            if local is None:
+                return
+            own = self._own_history.setdefault(session_id, set())
+            for seq, entry in entries:
+                if seq in own:
+                    own.discard(seq)
+                else:
+                    local["analysis_history"].append(entry)
+            if entries:
+                self._history_cursor[session_id] = max(self._history_cursor.get(session_id, 0), entries[-1][0])
+
+    def _restore(self, session_id, record: dict, version: int, local) -> dict:
+        """用状态后端中的元信息更新本进程的会话"""
+        session = dict(record)
+        if local is not None and local.get("history_epoch") == record.get("history_epoch"):
+            session["analysis_history"] = local["analysis_history"]
+        else:
+            # 历史已被替换（或首次载入），之后从头读取
+            session["analysis_history"] = []
+            self._history_cursor[session_id] = 0
+            self._own_history[session_id] = set()
+        if local is not None and local.get("data") is not None and local.get("data_key") == record.get("data_key"):
+            # 数据未变化，沿用已加载的数据
+            session["data"] = local["data"]
+            session["spilled"] = False
+        else:
+            # 数据按内容哈希在需要时从列式缓存加载
+            session["data"] = None
+            session["spilled"] = bool(record.get("data_key") or record.get("file_path"))
+        if local is not None:
+            self._forget_size(session_id)
+        self._sessions[session_id] = session
+        self._versions[session_id] = version
+        self._saved_records[session_id] = _record_payload(_session_record(session))
+        self._touch(session_id)
+        self._account(session_id)
+        self.restored += 1
+        return session
+
+    def _drop_local(self, session_id):
+        """只从本进程中移除会话"""
+        self._forget_size(session_id)
+        self._sessions.pop(session_id, None)
+        self._last_access.pop(session_id, None)
+        self._versions.pop(session_id, None)
+        self._saved_records.pop(session_id, None)
+        self._pending_history.pop(session_id, None)
+        self._history_cursor.pop(session_id, None)
+        self._own_history.pop(session_id, None)
+        lock = self._locks.get(session_id)
+        if lock is not None and not lock.locked():
+            del self._locks[session_id]
+
+    # ------------------------------------------------------------------
+    # 内存管理
+    # ------------------------------------------------------------------
+
+    def _touch(self, session_id):
+        self._sessions.move_to_end(session_id)
+        self._last_access[session_id] = time.monotonic()
+
+    def _account(self, session_id):
+        size = frame_memory_usage(self._sessions[session_id].get("data"))
+        self._sizes[session_id] = size
+        self.total_bytes += size
+
+    def _forget_size(self, session_id):
+        self.total_bytes -= self._sizes.pop(session_id, 0)
+
+    def _expire_idle(self):
+        """清理超过 SESSION_TIMEOUT 未访问的会话"""
+        deadline = time.monotonic() - self.timeout
+        while self._sessions:
+            session_id = next(iter(self._sessions))
+            if self._last_access.get(session_id, 0) >= deadline:
+                break
+            # 可共享的后端中保留会话，之后再次访问时重新载入
+            self._drop_local(session_id)
+            if not self.backend.persistent:
+                self.backend.delete(self.NAMESPACE, session_id)
+            self.expirations += 1
+            logger.info("会话超时未访问，已清理", extra={"fields": {"session_id": session_id}})
+
+    def _evict(self, session_id):
+        """换出会话数据，只保留元信息，数据保存在列式缓存中"""
+        session = self._sessions[session_id]
+        session["out_of_core"] = isinstance(session["data"], LazyFrame)
+        session["data"] = None
+        session["spilled"] = True
+        self._forget_size(session_id)
+        self._sizes[session_id] = 0
+        self.evictions += 1
+
+    def _enforce_budget(self, keep=None):
+        """超过内存预算时，按LRU顺序换出其他会话的数据"""
+        for session_id in list(self._sessions.keys()):
+            if self.total_bytes <= self.memory_budget:
+                break
+            if session_id == keep or not self._sizes.get(session_id):
+                continue
+            session = self._sessions[session_id]
+            # 只换出能重新加载的数据：有内容哈希或原始文件
+            if not session.get("data_key") and not session.get("file_path"):
+                continue
+            self._evict(session_id)
+
+    async def ensure_data(self, session_id):
+        """获取会话数据，已换出的数据从列式缓存（或原始文件）重新加载"""
+        session = self.get(session_id)
+        if session is None:
+            return None
+        if session.get("data") is not None or not session.get("spilled"):
+            return session.get("data")
+
+        dataset_cache = await get_dataset_cache()
+        data = None
+        sidecar_path = dataset_cache.existing_path(session.get("data_key"))
+        if session.get("out_of_core") and sidecar_path:
+            data = LazyFrame(sidecar_path)
+        if data is None:
+            data = await asyncio.to_thread(dataset_cache.read, session.get("data_key"))
+        if data is None and session.get("file_path") and os.path.exists(session["file_path"]):
+            data, _ = await asyncio.to_thread(dataset_cache.load, session["file_path"])
+        # 并发请求可能已经完成加载
+        if session.get("data") is not None:
+            return session["data"]
+        if data is None:
+            return None
+
+        session["data"] = data
+        session["spilled"] = False
+        self.rehydrations += 1
+        if session_id in self._sessions:
+            self._forget_size(session_id)
+            self._account(session_id)
+            self._enforce_budget(keep=session_id)
+        return data
+
+    def stats(self) -> dict:
+        loaded = sum(1 for s in self._sessions.values() if s.get("data") is not None)
+        return {
+            "sessions": len(self._sessions),
+            "loaded_sessions": loaded,
+            "total_bytes": self.total_bytes,
+            "memory_budget": self.memory_budget,
+            "evictions": self.evictions,
+            "rehydrations": self.rehydrations,
+            "expirations": self.expirations,
+            "restored": self.restored,
+            "state_backend": type(self.backend).__name__
+        }
@@ -0,0 +1,204 @@
+"""
+嵌入式SQL引擎
+
+筛选、分组、聚合这类能直接用一条SQL表达的查询，由大模型生成SQL后在执行引擎的子进程中查询会话数据，
+不再经过生成pandas代码、exec执行和错误修复的流程。优先使用duckdb，直接扫描内存映射的列式缓存并向量化执行；
+未安装duckdb时使用标准库sqlite3，数据需要写入内存数据库，只用于能完整加载到内存的数据。
+SQL在执行前先做只读检查并用 EXPLAIN 校验，语法、表名和列名错误在扫描数据之前就会被发现。
+"""
+import re
+import sqlite3
+import time
+
+import pandas as pd
+
+from app.core.config import settings
+from app.services.lazy_frame import LazyFrame
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+try:
+    import duckdb
+except ImportError:  # 未安装duckdb时使用sqlite3
+    duckdb = None
+
+# 大模型判断需求不适合用SQL完成时的回复
+NO_SQL = "NO_SQL"
+
+# 子进程中缓存的连接：(数据键, 连接)，sqlite需要写入数据，相同数据上的查询复用连接
+_cached_connection = None
+
+_WRITE_KEYWORDS = re.compile(
+    r"\b(insert|update|delete|create|drop|alter|attach|detach|copy|pragma|install|load|export|import|"
+    r"call|set|vacuum|checkpoint|truncate)\b",
+    re.IGNORECASE
+)
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_COMMENT = re.compile(r"--[^\n]*|/\*.*?\*/", re.DOTALL)
+_CODE_FENCE = re.compile(r"```(?:sql)?\s*(.*?)```", re.DOTALL | re.IGNORECASE)
+# 需求中出现这些词时通常需要绘图、建模或预测，不适合用一条SQL完成
+_NON_SQL_HINTS = re.compile(
+    r"图|绘|画|可视化|预测|模型|建模|回归|聚类|训练|拟合|"
+    r"\b(plot|chart|graph|visuali[sz]|predict|forecast|model|regression|cluster|train|fit)",
+    re.IGNORECASE
+)
+
+
+class SQLValidationError(Exception):
+    """SQL未通过只读检查或 EXPLAIN 校验"""
+
+
+def engine_name(data=None):
+    """当前可用的引擎名称（duckdb / sqlite），不可用时返回None；sqlite不用于 LazyFrame 数据"""
+    engine = settings.SQL_ENGINE.lower()
+    if not settings.SQL_ANALYSIS_ENABLED or engine == "off":
+        return None
+    if engine in ("auto", "duckdb") and duckdb is not None:
+        return "duckdb"
+    if engine in ("auto", "sqlite") and not isinstance(data, LazyFrame):
+        return "sqlite"
+    return None
+
+
+def suits_sql(query: str) -> bool:
+    """
+    不调用大模型粗略判断需求是否可能用一条SQL完成
+
+    涉及绘图、建模、预测的需求直接走代码流程，省去一次大概率得到 NO_SQL 的大模型调用。
+    """
+    return not _NON_SQL_HINTS.search(query or "")
+
+
+def extract_sql(text: str) -> str:
+    """从大模型回复中取出SQL，去掉代码块标记和末尾分号"""
+    text = (text or "").strip()
+    match = _CODE_FENCE.search(text)
+    if match:
+        text = match.group(1).strip()
+    return text.rstrip().rstrip(";").strip()
+
+
+def check_read_only(sql: str) -> str:
+    """只允许单条 SELECT / WITH 查询，返回规范化后的SQL"""
+    sql = extract_sql(sql)
+    stripped = _COMMENT.sub(" ", _STRING_LITERAL.sub("''", sql)).strip()
+    if not stripped:
+        raise SQLValidationError("SQL为空")
+    if ";" in stripped:
+        raise SQLValidationError("只能包含一条SQL语句")
+    if not re.match(r"^(select|with)\b", stripped, re.IGNORECASE):
+        raise SQLValidationError("只能使用 SELECT 查询")
+    keyword = _WRITE_KEYWORDS.search(stripped)
+    if keyword:
+        raise SQLValidationError(f"不允许使用 {keyword.group(1).upper()}")
+    return sql
+
+
+def referenced_tables(sql: str, datasets: dict) -> dict:
+    """从数据集中挑出SQL里以表名引用到的部分"""
+    if not datasets:
+        return {}
+    words = set(re.findall(r"[A-Za-z_][A-Za-z0-9_]*", _STRING_LITERAL.sub("''", sql or "")))
+    return {name: ref for name, ref in datasets.items() if name in words}
+
+
+def _sqlite_authorizer(action, *args):
+    # 只允许读取，禁止写入、ATTACH、PRAGMA等操作
+    if action in (sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION, sqlite3.SQLITE_RECURSIVE):
+        return sqlite3.SQLITE_OK
+    return sqlite3.SQLITE_DENY
+
+
+def _connect(engine: str, frames: dict):
+    if engine == "duckdb":
+        # 禁止读取文件等外部访问，只能查询注册的数据
+        con = duckdb.connect(config={"enable_external_access": False})
+        for name, frame in frames.items():
+            con.register(name, frame._source() if isinstance(frame, LazyFrame) else frame)
+        return con
+    con = sqlite3.connect(":memory:", check_same_thread=False)
+    for name, frame in frames.items():
+        frame = frame.to_pandas() if isinstance(frame, LazyFrame) else frame
+        frame.to_sql(name, con, index=False, chunksize=10000)
+    con.set_authorizer(_sqlite_authorizer)
+    return con
+
+
+def _connection(engine: str, frames: dict, cache_key):
+    """获取连接，相同数据上的查询复用已建立的连接"""
+    global _cached_connection
+    if cache_key is not None and _cached_connection is not None and _cached_connection[0] == (engine, cache_key):
+        return _cached_connection[1]
+    if _cached_connection is not None:
+        _cached_connection[1].close()
+        _cached_connection = None
+    con = _connect(engine, frames)
+    if cache_key is not None:
+        _cached_connection = ((engine, cache_key), con)
+    return con
+
+
+def _explain(engine: str, con, sql: str) -> str:
+    try:
+        if engine == "duckdb":
+            rows = con.execute(f"EXPLAIN {sql}").fetchall()
+            return "\n".join(str(row[-1]) for row in rows)
+        rows = con.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+        return "\n".join(str(row[-1]) for row in rows)
+    except Exception as e:
+        raise SQLValidationError(f"{type(e).__name__}: {e}")
+
+
+def _fetch(engine: str, con, sql: str, max_rows: int):
+    """执行查询，最多取 max_rows 行，返回 (DataFrame, 是否截断)"""
+    cursor = con.execute(sql)
+    if engine == "duckdb" and pa is not None:
+        reader_of = getattr(cursor, "to_arrow_reader", None) or cursor.fetch_record_batch
+        batches = []
+        rows = 0
+        reader = reader_of(10000)
+        schema = reader.schema
+        for batch in reader:
+            batches.append(batch)
+            rows += batch.num_rows
+            if rows > max_rows:
+                break
+        table = pa.Table.from_batches(batches, schema=schema)
+        truncated = table.num_rows > max_rows
+        return table.slice(0, max_rows).to_pandas(), truncated
+    rows = cursor.fetchmany(max_rows + 1)
+    columns = [column[0] for column in cursor.description]
+    return pd.DataFrame(rows[:max_rows], columns=columns), len(rows) > max_rows
+
+
+def run_query(sql: str, frames: dict, engine: str, cache_key=None, max_rows: int = None) -> dict:
+    """
+    在子进程中校验并执行SQL，frames 为 {表名: DataFrame 或 LazyFrame}
+
+    返回 {"result": DataFrame, "plan": 查询计划, "timings": 各阶段耗时, "truncated": 是否截断}。
+    校验失败时抛出 SQLValidationError。
+    """
+    max_rows = max_rows or settings.SQL_MAX_RESULT_ROWS
+    timings = {}
+    started = time.perf_counter()
+    sql = check_read_only(sql)
+    con = _connection(engine, frames, cache_key)
+    timings["connect"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    plan = _explain(engine, con, sql)
+    timings["validate"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    result, truncated = _fetch(engine, con, sql, max_rows)
+    timings["execute"] = time.perf_counter() - started
+    return {
+        "result": result,
+        "plan": plan,
+        "timings": {stage: round(seconds, 6) for stage, seconds in timings.items()},
+        "truncated": truncated,
+        "engine": engine
+    }
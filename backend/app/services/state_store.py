@@ -0,0 +1,222 @@
+"""
+共享状态存储
+
+会话元信息、分析历史、对话历史和可下载结果的索引保存在状态后端中，按命名空间和键存取可JSON序列化的值。
+除整体读写的值之外，每个键还可以有一组只追加的记录（如分析历史），追加时不需要重写已有的记录。
+默认的 memory 后端只在当前进程内有效；sqlite 后端保存在单个数据库文件中（WAL模式），
+同一台机器上的多个工作进程共享，服务重启后状态不丢失。
+DataFrame 不写入状态后端，只记录其在列式缓存中的内容哈希，需要时从缓存重新加载。
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from app.core.config import settings
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class MemoryStateBackend:
+    """进程内状态后端，值按引用保存，不做序列化"""
+
+    persistent = False
+
+    def __init__(self):
+        # (命名空间, 键) -> (值, 版本号, 更新时间)
+        self._items = {}
+        # (命名空间, 键) -> [(序号, 值, 写入时间)]
+        self._entries = {}
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def get(self, namespace: str, key: str):
+        item = self._items.get((namespace, key))
+        return item[0] if item is not None else None
+
+    def version(self, namespace: str, key: str):
+        item = self._items.get((namespace, key))
+        return item[1] if item is not None else None
+
+    def put(self, namespace: str, key: str, value) -> int:
+        """保存值，返回新的版本号"""
+        with self._lock:
+            item = self._items.get((namespace, key))
+            version = item[1] + 1 if item is not None else 1
+            self._items[(namespace, key)] = (value, version, time.time())
+        return version
+
+    def delete(self, namespace: str, key: str):
+        self._items.pop((namespace, key), None)
+
+    def keys(self, namespace: str) -> list:
+        return [key for ns, key in list(self._items.keys()) if ns == namespace]
+
+    def clear(self, namespace: str):
+        for key in self.keys(namespace):
+            self.delete(namespace, key)
+
+    def purge(self, namespace: str, older_than: float) -> int:
+        """删除更新时间早于 older_than 的条目，返回删除数"""
+        stale = [key for (ns, key), item in list(self._items.items()) if ns == namespace and item[2] < older_than]
+        for key in stale:
+            self.delete(namespace, key)
+        return len(stale)
+
+    def append(self, namespace: str, key: str, values: list) -> list:
+        """在键的记录末尾追加值，返回各值的序号（全局递增）"""
+        with self._lock:
+            entries = self._entries.setdefault((namespace, key), [])
+            seqs = []
+            for value in values:
+                self._seq += 1
+                entries.append((self._seq, value, time.time()))
+                seqs.append(self._seq)
+        return seqs
+
+    def entries(self, namespace: str, key: str, after: int = 0) -> list:
+        """序号大于 after 的记录 [(序号, 值)]，按序号排列"""
+        return [(seq, value) for seq, value, _ in list(self._entries.get((namespace, key), [])) if seq > after]
+
+    def delete_entries(self, namespace: str, key: str):
+        self._entries.pop((namespace, key), None)
+
+    def entry_keys(self, namespace: str) -> list:
+        return [key for ns, key in list(self._entries.keys()) if ns == namespace]
+
+    def close(self):
+        pass
+
+
+class SQLiteStateBackend:
+    """基于SQLite文件的状态后端，可被同一台机器上的多个进程共享"""
+
+    persistent = True
+
+    def __init__(self, path: str = None):
+        self.path = path or settings.STATE_DB_PATH
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # 自动提交模式，写操作显式使用事务
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS state ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+                "version INTEGER NOT NULL, updated REAL NOT NULL, PRIMARY KEY (namespace, key))"
+            )
+            # 只追加的记录，序号不会复用
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS state_log ("
+                "seq INTEGER PRIMARY KEY AUTOINCREMENT, namespace TEXT NOT NULL, key TEXT NOT NULL, "
+                "value TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS state_log_key ON state_log (namespace, key, seq)")
+
+    def get(self, namespace: str, key: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM state WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def version(self, namespace: str, key: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT version FROM state WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def put(self, namespace: str, key: str, value) -> int:
+        """保存值，返回新的版本号"""
+        payload = json.dumps(value, ensure_ascii=False, default=str)
+        with self._lock:
+            row = self._conn.execute(
+                "INSERT INTO state (namespace, key, value, version, updated) VALUES (?, ?, ?, 1, ?) "
+                "ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value, "
+                "version = state.version + 1, updated = excluded.updated RETURNING version",
+                (namespace, key, payload, time.time())
+            ).fetchone()
+        return row[0]
+
+    def delete(self, namespace: str, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM state WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def keys(self, namespace: str) -> list:
+        with self._lock:
+            rows = self._conn.execute("SELECT key FROM state WHERE namespace = ?", (namespace,)).fetchall()
+        return [row[0] for row in rows]
+
+    def clear(self, namespace: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM state WHERE namespace = ?", (namespace,))
+
+    def purge(self, namespace: str, older_than: float) -> int:
+        """删除更新时间早于 older_than 的条目，返回删除数"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM state WHERE namespace = ? AND updated < ?", (namespace, older_than)
+            )
+        return cursor.rowcount
+
+    def append(self, namespace: str, key: str, values: list) -> list:
+        """在键的记录末尾追加值，返回各值的序号（全局递增）"""
+        now = time.time()
+        payloads = [json.dumps(value, ensure_ascii=False, default=str) for value in values]
+        seqs = []
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for payload in payloads:
+                    cursor = self._conn.execute(
+                        "INSERT INTO state_log (namespace, key, value, created) VALUES (?, ?, ?, ?)",
+                        (namespace, key, payload, now)
+                    )
+                    seqs.append(cursor.lastrowid)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return seqs
+
+    def entries(self, namespace: str, key: str, after: int = 0) -> list:
+        """序号大于 after 的记录 [(序号, 值)]，按序号排列"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, value FROM state_log WHERE namespace = ? AND key = ? AND seq > ? ORDER BY seq",
+                (namespace, key, after)
+            ).fetchall()
+        return [(seq, json.loads(value)) for seq, value in rows]
+
+    def delete_entries(self, namespace: str, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM state_log WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def entry_keys(self, namespace: str) -> list:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT key FROM state_log WHERE namespace = ?", (namespace,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def create_state_backend():
+    """按 STATE_BACKEND 配置创建状态后端"""
+    backend = settings.STATE_BACKEND.lower()
+    if backend == "sqlite":
+        logger.info("使用SQLite状态后端", extra={"fields": {"path": settings.STATE_DB_PATH}})
+        return SQLiteStateBackend()
+    if backend != "memory":
+        logger.warning("未知的状态后端，使用进程内存储", extra={"fields": {"backend": backend}})
+    return MemoryStateBackend()
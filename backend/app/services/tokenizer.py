@@ -0,0 +1,17 @@
+"""
+本地token估算
+
+不依赖远程服务，按字符类别估算提示词的token数：中日韩字符按每字一个token计算，其他字符按约4个字符一个token计算。
+"""
+import math
+import re
+
+_CJK_PATTERN = re.compile(r"[　-〿㐀-䶿一-鿿豈-﫿＀-￯]")
+
+
+def estimate_tokens(text: str) -> int:
+    """估算文本的token数"""
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
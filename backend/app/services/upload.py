@@ -0,0 +1,123 @@
+"""
+上传文件的流式落盘
+
+按固定大小分块读取上传内容并写入磁盘，写入过程中同步计算内容哈希，复制到目标位置时占用的内存只与块大小有关。
+multipart 请求体在交给接口之前已由 Starlette 整体接收（小文件在内存中，大文件写入临时文件），
+因此接收阶段的大小限制由 UploadSizeLimitMiddleware 在解析请求体之前完成，save_upload_file 中的检查只是兜底。
+写完的内容放入内容寻址存储，目标路径是指向存储的链接，重复上传相同的文件不额外占用磁盘。
+"""
+import asyncio
+import hashlib
+import os
+import uuid
+
+import aiofiles
+from fastapi import HTTPException, UploadFile
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+
+from app.core.config import settings
+from app.services.dependencies import get_blob_store
+
+# 每次读取的块大小
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# multipart 请求体中分隔符和其他表单字段允许额外占用的字节数
+MULTIPART_OVERHEAD = 1024 * 1024
+
+
+class UploadTooLargeError(ValueError):
+    """上传文件超过大小限制"""
+
+
+def _too_large_message(max_size: int) -> str:
+    return f"文件大小超过限制（最大 {max_size // (1024 * 1024)}MB）"
+
+
+class UploadSizeLimitMiddleware:
+    """
+    在接收请求体时限制上传大小
+
+    Content-Length 超过限制的 multipart 请求直接返回413，不读取请求体；
+    未提供 Content-Length（分块传输）时边接收边计数，超过限制立即中止，不再继续接收和缓存。
+    """
+
+    def __init__(self, app, max_size: int = None):
+        self.app = app
+        self.max_size = max_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        if not headers.get("content-type", "").startswith("multipart/form-data"):
+            await self.app(scope, receive, send)
+            return
+        max_size = self.max_size or settings.MAX_CONTENT_LENGTH
+        max_body = max_size + MULTIPART_OVERHEAD
+        content_length = headers.get("content-length", "")
+        if content_length.isdigit() and int(content_length) > max_body:
+            response = JSONResponse(status_code=413, content={"detail": _too_large_message(max_size)})
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_body:
+                    # 解析请求体时抛出的 HTTPException 由框架直接转为响应
+                    raise HTTPException(status_code=413, detail=_too_large_message(max_size))
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+async def save_upload_file(file: UploadFile, file_path: str, max_size: int = None, prefix_size: int = None):
+    """
+    将上传文件分块写入 file_path
+
+    UploadFile 的内容此时已由框架接收完毕，这里只是分块复制到目标位置，接收阶段的大小限制见 UploadSizeLimitMiddleware。
+
+    返回 (文件大小, SHA-256)。提供 prefix_size 时返回 (文件大小, SHA-256, 前 prefix_size 字节的SHA-256)，
+    文件不足 prefix_size 字节时第三项为None。超过大小限制时删除已写入的部分并抛出 UploadTooLargeError。
+    """
+    max_size = max_size or settings.MAX_CONTENT_LENGTH
+    prefix_digest = hashlib.sha256() if prefix_size is not None else None
+    # 先写入临时文件，完成后再替换，避免中途失败留下不完整的文件
+    tmp_path = f"{file_path}.{uuid.uuid4().hex[:8]}.part"
+    digest = hashlib.sha256()
+    size = 0
+
+    # 确保文件流指针在开始位置
+    await file.seek(0)
+    try:
+        async with aiofiles.open(tmp_path, "wb") as buffer:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_size:
+                    raise UploadTooLargeError(_too_large_message(max_size))
+                digest.update(chunk)
+                if prefix_digest is not None and size - len(chunk) < prefix_size:
+                    # 只计入前 prefix_size 字节
+                    prefix_digest.update(chunk[:prefix_size - (size - len(chunk))])
+                await buffer.write(chunk)
+        # 相同内容已存在时直接链接已有的文件；放入存储和建立链接在同一把锁内完成，不会被 collect 清理
+        await asyncio.to_thread(get_blob_store().ingest_and_link, tmp_path, digest.hexdigest(), file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    # 重置文件指针以便后续操作可以再次读取
+    await file.seek(0)
+    if prefix_digest is not None:
+        return size, digest.hexdigest(), prefix_digest.hexdigest() if size >= prefix_size else None
+    return size, digest.hexdigest()
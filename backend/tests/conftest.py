@@ -0,0 +1,12 @@
+"""
+测试公共配置
+
+配置在导入 app 时读取，这里先设置测试所需的环境变量；各测试使用的文件都放在 pytest 的临时目录中。
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+os.environ.setdefault("LOG_LEVEL", "ERROR")
@@ -0,0 +1,92 @@
+"""内容寻址存储：放入存储并链接、去重，以及与清理同时进行"""
+import hashlib
+import os
+import stat
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.services.blob_store import BlobStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return BlobStore(str(tmp_path / "blobs"))
+
+
+def _tmp_file(directory, name: str, content: bytes):
+    path = directory / name
+    path.write_bytes(content)
+    return str(path), hashlib.sha256(content).hexdigest()
+
+
+def test_ingest_and_link_shares_content(store, tmp_path):
+    src, content_hash = _tmp_file(tmp_path, "upload.part", b"a,b\n1,2\n")
+    dest = str(tmp_path / "uploads" / "s1" / "data.csv")
+
+    path = store.ingest_and_link(src, content_hash, dest)
+
+    assert path == store.blob_path(content_hash)
+    assert not os.path.exists(src)
+    assert os.path.samefile(path, dest)
+    assert os.stat(path).st_nlink == 2
+    # 存储中的文件只读，不会通过链接改动共享的数据
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o444
+
+
+def test_same_content_is_stored_once(store, tmp_path):
+    first, content_hash = _tmp_file(tmp_path, "first.part", b"same")
+    second, _ = _tmp_file(tmp_path, "second.part", b"same")
+
+    store.ingest_and_link(first, content_hash, str(tmp_path / "a.csv"))
+    store.ingest_and_link(second, content_hash, str(tmp_path / "b.csv"))
+
+    assert not os.path.exists(second)
+    assert os.path.samefile(tmp_path / "a.csv", tmp_path / "b.csv")
+    assert store.stats()["blobs"] == 1
+
+
+def test_collect_removes_only_unreferenced_blobs(store, tmp_path):
+    kept, kept_hash = _tmp_file(tmp_path, "kept.part", b"kept")
+    dropped, dropped_hash = _tmp_file(tmp_path, "dropped.part", b"dropped")
+    store.ingest_and_link(kept, kept_hash, str(tmp_path / "kept.csv"))
+    store.ingest_and_link(dropped, dropped_hash, str(tmp_path / "dropped.csv"))
+    os.remove(tmp_path / "dropped.csv")
+
+    result = store.collect(grace_seconds=0)
+
+    assert result["removed"] == 1
+    assert os.path.exists(store.blob_path(kept_hash))
+    assert not os.path.exists(store.blob_path(dropped_hash))
+
+
+def test_collect_running_concurrently_never_removes_linked_content(store, tmp_path):
+    # 没有宽限期的清理与上传同时进行：存储中的文件一旦放入就立即有链接，不会在链接建立前被清理
+    content = b"x,y\n" + b"1,2\n" * 100
+    content_hash = hashlib.sha256(content).hexdigest()
+    stop = threading.Event()
+
+    def collect():
+        while not stop.is_set():
+            store.collect(grace_seconds=0)
+
+    def upload(i):
+        src, _ = _tmp_file(tmp_path, f"{i}.part", content)
+        dest = str(tmp_path / "uploads" / f"{i}.csv")
+        store.ingest_and_link(src, content_hash, dest)
+        with open(dest, "rb") as f:
+            assert f.read() == content
+        # 上传的文件被删除后，存储中的内容可以被清理，之后的上传重新放入
+        os.remove(dest)
+
+    collector = threading.Thread(target=collect)
+    collector.start()
+    try:
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(upload, range(200)))
+    finally:
+        stop.set()
+        collector.join()
+
+    assert store.collect(grace_seconds=0)["kept"] == 0
@@ -0,0 +1,40 @@
+"""代码缓存：并发写入时文件保持完整"""
+import asyncio
+import json
+import os
+
+from app.services.code_cache import CodeCache
+
+
+def test_concurrent_puts_keep_file_complete(tmp_path):
+    path = str(tmp_path / "code_cache" / "code_cache.json")
+    cache = CodeCache(storage_file=path, max_entries=1000)
+
+    async def run():
+        await asyncio.gather(*(
+            cache.put("fp", f"查询 {i}", f"result = df.head({i})", language="python" if i % 2 else "sql")
+            for i in range(100)
+        ))
+
+    asyncio.run(run())
+
+    with open(path, encoding="utf-8") as f:
+        saved = json.load(f)
+    assert len(saved) == 100
+    assert saved == cache.entries
+    # 临时文件都已替换或清理
+    assert os.listdir(os.path.dirname(path)) == ["code_cache.json"]
+
+    reloaded = CodeCache(storage_file=path)
+    assert reloaded.get("fp", "查询 42")["code"] == "result = df.head(42)"
+
+
+def test_older_snapshot_does_not_overwrite_newer(tmp_path):
+    path = str(tmp_path / "code_cache.json")
+    cache = CodeCache(storage_file=path)
+
+    cache._save({"new": {"code": "b"}}, 2)
+    cache._save({"old": {"code": "a"}}, 1)
+
+    with open(path, encoding="utf-8") as f:
+        assert json.load(f) == {"new": {"code": "b"}}
@@ -0,0 +1,127 @@
+"""数据集列式缓存：分块转换CSV和追加新数据"""
+import os
+
+import pandas as pd
+import pytest
+
+from app.services import dataset_cache as dataset_cache_module
+from app.services.dataset_cache import DatasetCache, file_hash
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    # 每块两行，少量数据即可覆盖多块的情况
+    monkeypatch.setattr(dataset_cache_module, "CSV_CHUNK_ROWS", 2)
+    return DatasetCache(str(tmp_path / "cache"))
+
+
+def _write_csv(tmp_path, name: str, text: str) -> str:
+    path = tmp_path / name
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def _leftover_tmp_files(cache: DatasetCache) -> list:
+    return [name for name in os.listdir(cache.cache_dir) if name.endswith(".tmp")]
+
+
+def test_convert_csv_writes_all_chunks(cache, tmp_path):
+    path = _write_csv(tmp_path, "data.csv", "g,v,w\na,1,0.5\nb,2,1.5\na,3,2.5\nc,4,3.5\nd,5,4.5\n")
+    content_hash = file_hash(path)
+
+    assert cache.convert_csv(path, content_hash)
+    pd.testing.assert_frame_equal(cache.read(content_hash), pd.read_csv(path))
+    assert _leftover_tmp_files(cache) == []
+
+
+def test_convert_csv_header_only(cache, tmp_path):
+    path = _write_csv(tmp_path, "empty.csv", "g,v\n")
+    content_hash = file_hash(path)
+
+    assert cache.convert_csv(path, content_hash)
+    pd.testing.assert_frame_equal(cache.read(content_hash), pd.read_csv(path))
+
+
+@pytest.mark.parametrize("text", [
+    # 整数列在后续块中出现小数
+    "a,b\n1,x\n2,y\n3.5,z\n",
+    # 第一块全为空的列在后续块中出现字符串
+    "a,b\n1,\n2,\n3,z\n",
+    # 字符串列在后续块中只有数字
+    "a,b\n1,x\n2,y\n3,4\n",
+    # 数字列在后续块中出现字符串
+    "a,b\n1,1\n2,2\n3,q\n",
+])
+def test_convert_csv_type_drift_falls_back_to_full_parse(cache, tmp_path, text):
+    path = _write_csv(tmp_path, "drift.csv", text)
+    content_hash = file_hash(path)
+
+    assert not cache.convert_csv(path, content_hash)
+    assert cache.existing_path(content_hash) is None
+    assert _leftover_tmp_files(cache) == []
+
+    # load 改为整体解析，结果与直接解析一致，并写入旁路文件
+    df, loaded_hash = cache.load(path, lazy=False)
+    assert loaded_hash == content_hash
+    pd.testing.assert_frame_equal(df, pd.read_csv(path))
+    pd.testing.assert_frame_equal(cache.read(content_hash), pd.read_csv(path))
+
+
+def test_missing_values_in_later_chunk_keep_chunked_conversion(cache, tmp_path):
+    path = _write_csv(tmp_path, "missing.csv", "a,b\n1,x\n2,y\n,z\n4,w\n")
+    content_hash = file_hash(path)
+
+    assert cache.convert_csv(path, content_hash)
+    pd.testing.assert_frame_equal(cache.read(content_hash), pd.read_csv(path))
+
+
+def test_load_hits_cache_on_second_read(cache, tmp_path):
+    path = _write_csv(tmp_path, "data.csv", "g,v\na,1\nb,2\nc,3\n")
+
+    first, content_hash = cache.load(path, lazy=False)
+    second, second_hash = cache.load(path, lazy=False)
+
+    assert content_hash == second_hash
+    pd.testing.assert_frame_equal(first, second)
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_append_writes_base_batches_and_delta(cache):
+    base = pd.DataFrame({"g": ["a", "b"], "v": [1, 2]})
+    delta = pd.DataFrame({"v": [3, 4], "g": ["c", "d"]})
+    cache.write("base", base)
+
+    assert cache.append("base", "appended", delta)
+    expected = pd.concat([base, delta[["g", "v"]]], ignore_index=True)
+    pd.testing.assert_frame_equal(cache.read("appended"), expected)
+    # 已有的旁路文件不变
+    pd.testing.assert_frame_equal(cache.read("base"), base)
+
+
+def test_append_widens_delta_to_base_types(cache):
+    base = pd.DataFrame({"v": [1.5, 2.5]})
+    cache.write("base", base)
+
+    assert cache.append("base", "appended", pd.DataFrame({"v": [3, 4]}))
+    assert cache.read("appended")["v"].tolist() == [1.5, 2.5, 3.0, 4.0]
+
+
+@pytest.mark.parametrize("delta", [
+    # 整数列新增了小数
+    pd.DataFrame({"g": ["c"], "v": [3.5]}),
+    # 整数列新增了字符串
+    pd.DataFrame({"g": ["c"], "v": ["x"]}),
+    # 缺少已有的列
+    pd.DataFrame({"g": ["c"]}),
+])
+def test_append_type_mismatch_returns_false(cache, delta):
+    cache.write("base", pd.DataFrame({"g": ["a", "b"], "v": [1, 2]}))
+
+    assert not cache.append("base", "appended", delta)
+    assert cache.existing_path("appended") is None
+    assert _leftover_tmp_files(cache) == []
+
+
+def test_append_without_base_sidecar(cache):
+    assert not cache.append("missing", "appended", pd.DataFrame({"v": [1]}))
@@ -0,0 +1,132 @@
+"""示例索引：按标签筛选、排序、分页，以及与示例目录同步"""
+import json
+import os
+
+import pytest
+
+from app.services.example_index import ExampleIndex
+
+
+def _example(example_id: str, name: str, created_at: str, tags=None, file_name: str = None) -> dict:
+    example = {
+        "id": example_id,
+        "name": name,
+        "description": f"{name}的说明",
+        "tags": tags or [],
+        "createdAt": created_at
+    }
+    if file_name:
+        example["analysisProcess"] = {"originalFile": {"file_name": file_name}}
+    return example
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = ExampleIndex(str(tmp_path / "index" / "examples.sqlite3"))
+    index.put(_example("e1", "销售趋势", "2024-01-03", ["销售", "趋势"], "sales.csv"), 1.0)
+    index.put(_example("e2", "库存分析", "2024-01-01", ["库存"]), 1.0)
+    index.put(_example("e3", "月度销售", "2024-01-02", ["销售"]), 1.0)
+    yield index
+    index.close()
+
+
+def _ids(items) -> list:
+    return [item["id"] for item in items]
+
+
+def test_query_sorts_by_created_at_desc_by_default(index):
+    items, total = index.query()
+
+    assert total == 3
+    assert _ids(items) == ["e1", "e3", "e2"]
+    assert items[0] == {
+        "id": "e1",
+        "name": "销售趋势",
+        "description": "销售趋势的说明",
+        "tags": ["销售", "趋势"],
+        "createdAt": "2024-01-03",
+        "fileName": "sales.csv"
+    }
+
+
+def test_query_sort_field_and_order(index):
+    items, _ = index.query(sort="createdAt", order="asc")
+    assert _ids(items) == ["e2", "e3", "e1"]
+
+    # 名称按字符编码排序：库(U+5E93) < 月(U+6708) < 销(U+9500)
+    items, _ = index.query(sort="name", order="asc")
+    assert _ids(items) == ["e2", "e3", "e1"]
+
+    with pytest.raises(ValueError):
+        index.query(sort="description")
+
+
+def test_query_requires_all_tags(index):
+    items, total = index.query(tags=["销售"])
+    assert total == 2
+    assert _ids(items) == ["e1", "e3"]
+
+    items, total = index.query(tags=["销售", "趋势"])
+    assert (total, _ids(items)) == (1, ["e1"])
+
+    # 重复的标签按一个计算，空标签被忽略
+    items, total = index.query(tags=["销售", "销售", ""])
+    assert total == 2
+
+    assert index.query(tags=["不存在"]) == ([], 0)
+
+
+def test_query_pages_with_limit_and_offset(index):
+    first, total = index.query(limit=2)
+    second, _ = index.query(limit=2, offset=2)
+
+    assert total == 3
+    assert _ids(first) == ["e1", "e3"]
+    assert _ids(second) == ["e2"]
+
+
+def test_put_replaces_tags_and_remove_deletes(index):
+    index.put(_example("e1", "销售趋势", "2024-01-03", ["报表"]), 2.0)
+
+    assert index.query(tags=["趋势"]) == ([], 0)
+    assert _ids(index.query(tags=["报表"])[0]) == ["e1"]
+
+    index.remove("e1")
+    assert index.get("e1") is None
+    assert index.query(tags=["报表"]) == ([], 0)
+    assert index.query()[1] == 2
+
+
+def test_sync_reads_only_new_or_changed_files(tmp_path):
+    storage = tmp_path / "examples"
+    storage.mkdir()
+
+    def write(example_id, name, mtime):
+        path = storage / f"{example_id}.json"
+        path.write_text(json.dumps(_example(example_id, name, "2024-01-01"), ensure_ascii=False), encoding="utf-8")
+        os.utime(path, (mtime, mtime))
+        return path
+
+    write("a", "旧名称", 100)
+    write("b", "示例B", 100)
+    (storage / "broken.json").write_text("{", encoding="utf-8")
+    index = ExampleIndex(str(tmp_path / "examples.sqlite3"))
+    try:
+        index.sync(storage)
+        assert sorted(index.mtimes()) == ["a", "b"]
+
+        # 修改时间不变的文件不会重新读取
+        path = storage / "a.json"
+        path.write_text(json.dumps(_example("a", "未读取", "2024-01-01"), ensure_ascii=False), encoding="utf-8")
+        os.utime(path, (100, 100))
+        index.sync(storage)
+        assert index.get("a")["name"] == "旧名称"
+
+        write("a", "新名称", 200)
+        (storage / "b.json").unlink()
+        index.sync(storage)
+        assert index.get("a")["name"] == "新名称"
+        assert index.get("b") is None
+        assert index.mtimes() == {"a": 200}
+    finally:
+        index.close()
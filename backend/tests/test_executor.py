@@ -0,0 +1,109 @@
+"""代码执行引擎：超时、内存上限、取消和子进程崩溃后的替换"""
+import asyncio
+import time
+
+import pandas as pd
+import pytest
+
+from app.services.executor import CodeExecutionError, CodeExecutor
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def _with_executor(body, **kwargs):
+    executor = CodeExecutor(max_workers=kwargs.pop("max_workers", 1), **kwargs)
+    try:
+        return await body(executor)
+    finally:
+        await executor.close()
+
+
+def test_runs_code_on_data():
+    async def body(executor):
+        df = pd.DataFrame({"g": ["a", "b", "a"], "v": [1, 2, 3]})
+        result = await executor.run("result = df.groupby('g')['v'].sum().to_dict()", data=df, data_key="k")
+        info = await executor.run("print(len(df))", data=df, data_key="k", mode="info")
+        return result, info
+
+    result, info = run(_with_executor(body))
+    assert result == {"a": 4, "b": 2}
+    assert info.strip() == "3"
+
+
+def test_timeout_kills_worker_and_pool_recovers():
+    async def body(executor):
+        started = time.monotonic()
+        with pytest.raises(CodeExecutionError, match="TimeoutError"):
+            await executor.run("import time\ntime.sleep(30)", timeout=1)
+        assert time.monotonic() - started < 5
+        # 唯一的子进程被替换后仍可执行
+        assert await executor.run("result = 1 + 1", timeout=30) == 2
+        return executor.stats()
+
+    stats = run(_with_executor(body))
+    assert stats["timeouts"] == 1
+    assert stats["succeeded"] == 1
+
+
+def test_memory_limit_raises_memory_error():
+    async def body(executor):
+        with pytest.raises(CodeExecutionError, match="MemoryError"):
+            await executor.run("import numpy as np\nresult = np.ones(4 * 1024 ** 3 // 8).sum()")
+        # 内存错误在子进程内被捕获，子进程继续可用
+        return await executor.run("result = 'ok'")
+
+    assert run(_with_executor(body, memory_limit_mb=1024, timeout=30)) == "ok"
+
+
+def test_cancellation_kills_worker():
+    async def body(executor):
+        task = asyncio.create_task(executor.run("import time\ntime.sleep(30)", timeout=60))
+        await asyncio.sleep(1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        started = time.monotonic()
+        assert await executor.run("result = 3", timeout=30) == 3
+        assert time.monotonic() - started < 20
+        return executor.stats()
+
+    assert run(_with_executor(body, timeout=60))["cancelled"] == 1
+
+
+def test_crashed_worker_is_replaced():
+    async def body(executor):
+        with pytest.raises(CodeExecutionError, match="WorkerCrashed"):
+            await executor.run("import os\nos._exit(1)")
+        assert await executor.run("result = 'alive'") == "alive"
+        return executor.stats()
+
+    stats = run(_with_executor(body, timeout=30))
+    assert stats["crashed"] == 1
+    assert stats["idle_workers"] == 1
+
+
+def test_replacing_worker_does_not_block_event_loop():
+    async def body(executor):
+        gaps = []
+
+        async def ticker():
+            last = time.monotonic()
+            while True:
+                await asyncio.sleep(0.01)
+                now = time.monotonic()
+                gaps.append(now - last)
+                last = now
+
+        tick = asyncio.create_task(ticker())
+        try:
+            for _ in range(3):
+                with pytest.raises(CodeExecutionError):
+                    await executor.run("import os\nos._exit(1)")
+            assert await executor.run("result = 1") == 1
+        finally:
+            tick.cancel()
+        return max(gaps)
+
+    assert run(_with_executor(body, timeout=30)) < 0.5
@@ -0,0 +1,88 @@
+"""结果导出：Parquet的列类型由整份结果确定，批次类型不同时不会中途失败"""
+import asyncio
+import io
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from app.services.export import export_stream, stream_csv
+from app.services.result_store import ResultStore
+
+BATCH_ROWS = 3
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ResultStore(str(tmp_path / "results"))
+
+
+def _put(store: ResultStore, df: pd.DataFrame, spill: bool = False) -> str:
+    download_id = asyncio.run(store.put(df))
+    if spill:
+        asyncio.run(store._spill(download_id))
+    return download_id
+
+
+def _export_parquet(store: ResultStore, download_id: str) -> pd.DataFrame:
+    schema = store.arrow_schema(download_id)
+    batches = store.iter_batches(download_id, batch_rows=BATCH_ROWS)
+    data = b"".join(export_stream(batches, "parquet", schema))
+    return pq.read_table(io.BytesIO(data)).to_pandas()
+
+
+def test_column_null_in_first_batch_then_strings(store):
+    df = pd.DataFrame({"id": range(7), "name": [None] * 4 + ["a", "b", "c"]})
+
+    result = _export_parquet(store, _put(store, df))
+
+    assert result["name"][:4].isna().all()
+    assert result["name"][4:].tolist() == ["a", "b", "c"]
+
+
+def test_object_column_ints_then_floats(store):
+    df = pd.DataFrame({"v": pd.Series([1, 2, 3, 4, 5.5, 6.25], dtype=object)})
+
+    result = _export_parquet(store, _put(store, df))
+
+    assert result["v"].tolist() == [1.0, 2.0, 3.0, 4.0, 5.5, 6.25]
+
+
+def test_all_null_column_exported_as_string(store):
+    df = pd.DataFrame({"id": range(5), "empty": [None] * 5})
+    download_id = _put(store, df)
+
+    result = _export_parquet(store, download_id)
+
+    assert result["empty"].isna().all()
+    data = b"".join(export_stream(store.iter_batches(download_id), "parquet", store.arrow_schema(download_id)))
+    assert pq.read_schema(io.BytesIO(data)).field("empty").type == pa.string()
+
+
+def test_spilled_int_column_with_nulls_in_later_batch(store):
+    # 磁盘上的列式结果按批次转为pandas时，带空值的批次中整数列变为浮点数
+    df = pd.DataFrame({"v": pd.array([1, 2, 3, 4, None, 6, 7], dtype="Int64"), "s": list("abcdefg")})
+    download_id = _put(store, df, spill=True)
+    assert store.describe(download_id)["in_memory"] is False
+
+    result = _export_parquet(store, download_id)
+
+    assert result["v"].tolist()[:4] == [1, 2, 3, 4]
+    assert np.isnan(result["v"].tolist()[4])
+    assert result["s"].tolist() == list("abcdefg")
+
+
+def test_mixed_type_column_rejected_before_streaming(store):
+    df = pd.DataFrame({"v": pd.Series([1, "x", 2.5], dtype=object)})
+    download_id = _put(store, df)
+
+    with pytest.raises(ValueError):
+        store.arrow_schema(download_id)
+
+
+def test_csv_header_only_on_first_batch():
+    batches = [pd.DataFrame({"a": [1]}), pd.DataFrame({"a": [2]})]
+
+    assert "".join(stream_csv(batches)) == "a\n1\n2\n"
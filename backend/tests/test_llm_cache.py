@@ -0,0 +1,79 @@
+"""大模型响应缓存：精确匹配、语义匹配，以及生成的代码执行失败后删除缓存的计划和代码"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.core.config import settings
+from app.services.llm import LLMService
+from app.services.llm_cache import LLMResponseCache
+
+
+class FakeClient:
+    """按调用顺序编号返回内容的模拟客户端"""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        message = SimpleNamespace(content=f"response-{self.calls}")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+    async def close(self):
+        pass
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_CACHE_ENABLED", True)
+    monkeypatch.setattr(settings, "LLM_CACHE_DISK_PATH", "")
+    service = LLMService()
+    asyncio.run(service.client.close())
+    service.client = FakeClient()
+    return service
+
+
+def _generate(service, data_info="列: a, b", query="按a汇总b"):
+    async def run():
+        plan = await service.generate_analysis_plan(data_info, query, schema_fingerprint="fp")
+        code = await service.generate_analysis_code(plan, data_info, query, schema_fingerprint="fp")
+        return plan, code
+
+    return asyncio.run(run())
+
+
+def test_plan_and_code_are_cached(service):
+    first = _generate(service)
+    # 相同数据结构上的相同查询按语义匹配命中，数据信息不同也不再调用大模型
+    assert _generate(service) == first
+    assert _generate(service, data_info="列: a, b（另一份数据）") == first
+    assert service.client.calls == 2
+
+
+def test_forget_analysis_drops_exact_and_semantic_entries(service):
+    plan, code = _generate(service)
+
+    asyncio.run(service.forget_analysis("列: a, b", "按a汇总b", plan, schema_fingerprint="fp"))
+
+    assert _generate(service) == ("response-3", "response-4")
+    assert service.client.calls == 4
+    # 语义匹配的条目也已被新的响应替换
+    assert _generate(service, data_info="列: a, b（另一份数据）") == ("response-3", "response-4")
+
+
+def test_delete_removes_entries_from_disk(tmp_path):
+    path = str(tmp_path / "llm_cache.sqlite3")
+    cache = LLMResponseCache(disk_path=path)
+    asyncio.run(cache.set("exact:a", "A"))
+    asyncio.run(cache.set("exact:b", "B"))
+
+    asyncio.run(cache.delete("exact:a", None))
+    cache.close()
+
+    reopened = LLMResponseCache(disk_path=path)
+    try:
+        assert asyncio.run(reopened.get("exact:a")) is None
+        assert asyncio.run(reopened.get("exact:b")) == "B"
+    finally:
+        reopened.close()
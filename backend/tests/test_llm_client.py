@@ -0,0 +1,311 @@
+"""大模型客户端：在 httpx.MockTransport 上验证重试、限流、并发上限、对冲和流式重试"""
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+from openai import BadRequestError
+
+from app.core.config import settings
+from app.services import llm_client
+from app.services.llm_client import LLMClient, TokenBucket
+
+MESSAGES = [{"role": "user", "content": "hello"}]
+
+
+def _completion(content: str = "ok") -> dict:
+    return {
+        "id": "chatcmpl-test", "object": "chat.completion", "created": 0, "model": "test-model",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}]
+    }
+
+
+def _chunk(content: str) -> bytes:
+    chunk = {
+        "id": "chatcmpl-test", "object": "chat.completion.chunk", "created": 0, "model": "test-model",
+        "choices": [{"index": 0, "delta": {"content": content}, "finish_reason": None}]
+    }
+    return f"data: {json.dumps(chunk)}\n\n".encode()
+
+
+class StubServer:
+    """按顺序返回预设响应的模拟服务端，记录请求数和同时处理的请求数"""
+
+    def __init__(self, responses=None, default=None):
+        self.responses = list(responses or [])
+        self.default = default or (lambda: httpx.Response(200, json=_completion()))
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            respond = self.responses.pop(0) if self.responses else self.default
+            response = respond()
+            if asyncio.iscoroutine(response):
+                response = await response
+            return response
+        finally:
+            self.in_flight -= 1
+
+
+@pytest.fixture
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_MAX_RETRIES", 3)
+    monkeypatch.setattr(settings, "LLM_RETRY_BASE_DELAY", 0.01)
+    monkeypatch.setattr(settings, "LLM_RETRY_MAX_DELAY", 0.05)
+    monkeypatch.setattr(settings, "LLM_HEDGE_ENABLED", False)
+
+
+def _client(server: StubServer) -> LLMClient:
+    return LLMClient(base_url="http://llm.test/v1", api_key="test", transport=httpx.MockTransport(server.handle))
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def _create(server: StubServer, **kwargs):
+    client = _client(server)
+    try:
+        return await client.create(model="test-model", messages=MESSAGES, **kwargs)
+    finally:
+        await client.close()
+
+
+def test_429_waits_for_retry_after(fast_retries):
+    server = StubServer([lambda: httpx.Response(429, headers={"retry-after": "0.3"}, json={"error": {}})])
+
+    started = time.monotonic()
+    response = run(_create(server))
+
+    assert response.choices[0].message.content == "ok"
+    assert server.calls == 2
+    assert time.monotonic() - started >= 0.3
+
+
+def test_retry_after_is_capped(fast_retries, monkeypatch):
+    monkeypatch.setattr(llm_client, "MAX_RETRY_AFTER", 0.1)
+    server = StubServer([lambda: httpx.Response(429, headers={"retry-after": "30"}, json={"error": {}})])
+
+    started = time.monotonic()
+    run(_create(server))
+
+    assert time.monotonic() - started < 5
+
+
+def test_server_errors_retry_with_jittered_exponential_backoff(fast_retries, monkeypatch):
+    bounds = []
+
+    def uniform(low, high):
+        bounds.append((low, high))
+        return high / 2
+
+    monkeypatch.setattr(llm_client.random, "uniform", uniform)
+    server = StubServer([lambda: httpx.Response(500, json={"error": {}})] * 3)
+
+    response = run(_create(server))
+
+    assert response.choices[0].message.content == "ok"
+    assert server.calls == 4
+    # 上限按指数增长并受 LLM_RETRY_MAX_DELAY 限制，实际等待在 [0, 上限] 中随机选取
+    assert bounds == [(0, 0.01), (0, 0.02), (0, 0.04)]
+
+
+def test_gives_up_after_max_retries(fast_retries):
+    server = StubServer(default=lambda: httpx.Response(503, json={"error": {}}))
+
+    with pytest.raises(Exception):
+        run(_create(server))
+    assert server.calls == settings.LLM_MAX_RETRIES + 1
+
+
+def test_client_errors_are_not_retried(fast_retries):
+    server = StubServer(default=lambda: httpx.Response(400, json={"error": {"message": "bad"}}))
+
+    with pytest.raises(BadRequestError):
+        run(_create(server))
+    assert server.calls == 1
+
+
+def test_token_bucket_waits_for_refill():
+    async def body():
+        bucket = TokenBucket(60)  # 每秒补充1个
+        assert await bucket.acquire(60) == 0
+        started = time.monotonic()
+        waited = await bucket.acquire(0.3)
+        return waited, time.monotonic() - started
+
+    waited, elapsed = run(body())
+    assert waited == pytest.approx(0.3, abs=0.05)
+    assert elapsed >= 0.25
+
+
+def test_token_bucket_without_limit_never_waits():
+    assert run(TokenBucket(0).acquire(10 ** 9)) == 0
+
+
+def test_requests_per_minute_limit(fast_retries, monkeypatch):
+    monkeypatch.setattr(settings, "LLM_REQUESTS_PER_MINUTE", 120)  # 每0.5秒一个请求
+    server = StubServer()
+
+    async def body():
+        client = _client(server)
+        client.request_bucket.tokens = 1
+        try:
+            started = time.monotonic()
+            for _ in range(2):
+                await client.create(model="test-model", messages=MESSAGES)
+            return time.monotonic() - started
+        finally:
+            await client.close()
+
+    assert run(body()) >= 0.4
+    assert server.calls == 2
+
+
+def test_concurrency_is_bounded_by_semaphore(fast_retries, monkeypatch):
+    monkeypatch.setattr(settings, "LLM_MAX_CONCURRENCY", 2)
+
+    async def slow():
+        await asyncio.sleep(0.1)
+        return httpx.Response(200, json=_completion())
+
+    server = StubServer(default=slow)
+
+    async def body():
+        client = _client(server)
+        try:
+            return await asyncio.gather(*[client.create(model="test-model", messages=MESSAGES) for _ in range(6)])
+        finally:
+            await client.close()
+
+    assert len(run(body())) == 6
+    assert server.max_in_flight == 2
+
+
+def test_slow_request_is_hedged_after_p95(fast_retries, monkeypatch):
+    monkeypatch.setattr(settings, "LLM_HEDGE_ENABLED", True)
+    monkeypatch.setattr(settings, "LLM_HEDGE_MIN_SAMPLES", 5)
+
+    async def stalled():
+        await asyncio.sleep(5)
+        return httpx.Response(200, json=_completion("primary"))
+
+    server = StubServer([stalled], default=lambda: httpx.Response(200, json=_completion("hedge")))
+
+    async def body():
+        client = _client(server)
+        for _ in range(20):
+            client.latency.record(0.05)
+        try:
+            started = time.monotonic()
+            response = await client.create(model="test-model", messages=MESSAGES)
+            return response, time.monotonic() - started
+        finally:
+            await client.close()
+
+    response, elapsed = run(body())
+    assert response.choices[0].message.content == "hedge"
+    assert server.calls == 2
+    assert elapsed < 1
+
+
+@pytest.mark.parametrize("cancel_after", [0.02, 0.2])
+def test_cancelled_caller_cancels_primary_and_hedge(fast_retries, monkeypatch, cancel_after):
+    # 0.02 秒时还在等待对冲延迟，0.2 秒时主请求和对冲请求都在进行
+    monkeypatch.setattr(settings, "LLM_HEDGE_ENABLED", True)
+    monkeypatch.setattr(settings, "LLM_HEDGE_MIN_SAMPLES", 5)
+
+    async def stalled():
+        await asyncio.sleep(5)
+        return httpx.Response(200, json=_completion())
+
+    server = StubServer(default=stalled)
+
+    async def body():
+        client = _client(server)
+        for _ in range(20):
+            client.latency.record(0.05)
+        try:
+            caller = asyncio.create_task(client.create(model="test-model", messages=MESSAGES))
+            await asyncio.sleep(cancel_after)
+            caller.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await caller
+            await asyncio.sleep(0.05)
+            return client.semaphore._value
+        finally:
+            await client.close()
+
+    free_slots = run(body())
+    assert server.in_flight == 0
+    assert free_slots == settings.LLM_MAX_CONCURRENCY
+    assert server.calls == (1 if cancel_after < 0.05 else 2)
+
+
+def test_no_hedge_without_enough_samples(fast_retries, monkeypatch):
+    monkeypatch.setattr(settings, "LLM_HEDGE_ENABLED", True)
+    monkeypatch.setattr(settings, "LLM_HEDGE_MIN_SAMPLES", 5)
+
+    async def slowish():
+        await asyncio.sleep(0.2)
+        return httpx.Response(200, json=_completion("primary"))
+
+    server = StubServer([slowish])
+
+    assert run(_create(server)).choices[0].message.content == "primary"
+    assert server.calls == 1
+
+
+async def _collect_stream(server: StubServer):
+    client = _client(server)
+    chunks = []
+    try:
+        async for chunk in client.stream(model="test-model", messages=MESSAGES):
+            chunks.append(chunk.choices[0].delta.content)
+    finally:
+        await client.close()
+    return chunks
+
+
+def _sse_response(parts) -> httpx.Response:
+    async def body():
+        for part in parts:
+            if isinstance(part, Exception):
+                raise part
+            yield part
+
+    return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=body())
+
+
+def test_stream_retries_before_first_chunk(fast_retries):
+    server = StubServer(
+        [lambda: httpx.Response(503, json={"error": {}})],
+        default=lambda: _sse_response([_chunk("a"), _chunk("b"), b"data: [DONE]\n\n"])
+    )
+
+    assert run(_collect_stream(server)) == ["a", "b"]
+    assert server.calls == 2
+
+
+def test_stream_does_not_retry_after_first_chunk(fast_retries):
+    server = StubServer(default=lambda: _sse_response([_chunk("a"), httpx.ReadError("connection lost")]))
+    received = []
+
+    async def body():
+        client = _client(server)
+        try:
+            async for chunk in client.stream(model="test-model", messages=MESSAGES):
+                received.append(chunk.choices[0].delta.content)
+        finally:
+            await client.close()
+
+    with pytest.raises(Exception):
+        run(body())
+    assert received == ["a"]
+    assert server.calls == 1
@@ -0,0 +1,36 @@
+"""提示词预算：多次失败通知在代码和查询很长时仍保留尝试历史"""
+import asyncio
+
+from app.core.config import settings
+from app.services.llm import LLMService
+from app.services.tokenizer import estimate_tokens
+
+
+def test_failure_notice_keeps_attempt_history_within_budget(monkeypatch):
+    monkeypatch.setattr(settings, "PROMPT_TOKEN_BUDGET", 1000)
+    service = LLMService()
+    asyncio.run(service.client.close())
+    captured = []
+
+    async def chat_completion(messages, **kwargs):
+        captured.append(messages)
+        return "notice"
+
+    monkeypatch.setattr(service, "chat_completion", chat_completion)
+    original_code = "\n".join(f"value_{i} = df['column_{i}'].sum()" for i in range(2000))
+    query = "统计各列的合计并比较" * 500
+    attempts = [
+        {"code": original_code + f"\nfix_{i} = 1", "error": f"KeyError: 'column_{i}'", "traceback": ""}
+        for i in range(3)
+    ]
+
+    assert asyncio.run(service.notify_user_too_many_attempts(original_code, attempts, query)) == "notice"
+
+    prompt = captured[0][-1]["content"]
+    assert estimate_tokens(prompt) <= settings.PROMPT_TOKEN_BUDGET + 50
+    assert "尝试历史" in prompt
+    for i in range(3):
+        assert f"KeyError: 'column_{i}'" in prompt
+    # 查询和原始代码都被截断
+    assert "中间省略" in prompt.split("原始代码")[0]
+    assert "value_0" in prompt and "value_1999" in prompt
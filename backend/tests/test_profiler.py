@@ -0,0 +1,25 @@
+"""数据概要缓存：多个线程同时生成概要"""
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from app.services import profiler
+
+
+def test_concurrent_summaries_share_bounded_cache(monkeypatch):
+    monkeypatch.setattr(profiler, "_SUMMARY_CACHE_SIZE", 8)
+    monkeypatch.setattr(profiler, "_summary_cache", profiler.OrderedDict())
+    monkeypatch.setattr(profiler, "_stats_cache", profiler.OrderedDict())
+    frames = [pd.DataFrame({"v": range(i, i + 50), "g": ["a", "b"] * 25}) for i in range(32)]
+
+    def summarize(i):
+        return profiler.summarize_dataset(frames[i % 32], data_key=f"key-{i % 32}")
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        summaries = list(pool.map(summarize, range(512)))
+
+    assert all(summaries)
+    assert len(profiler._summary_cache) <= 8
+    assert len(profiler._stats_cache) <= 8
+    # 命中缓存时返回与首次生成相同的概要
+    assert profiler.summarize_dataset(frames[3], data_key="key-3") == summaries[3]
@@ -0,0 +1,117 @@
+"""全文检索：中英文切分、BM25排序、筛选、删除和多进程同步"""
+import pytest
+
+from app.services.search_index import SearchIndex, query_terms, tokenize
+
+
+def _put(index: SearchIndex, doc_id: str, name: str, description: str = "", kind: str = "example",
+         tags=None, code: str = "", version=None):
+    index.put(doc_id, kind, fields={"name": name, "description": description, "tags": " ".join(tags or []),
+                                    "code": code},
+              title=name, tags=tags, meta={"id": doc_id}, version=version)
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = SearchIndex(str(tmp_path / "search" / "index.sqlite3"))
+    yield index
+    index.close()
+
+
+def _ids(results) -> list:
+    return [item["id"] for item in results]
+
+
+def test_tokenize_cjk_into_characters_and_bigrams():
+    assert tokenize("销售额 Top_10") == ["销", "售", "额", "销售", "售额", "top", "10"]
+    # 平假名、韩文同样按单字和二字切分
+    assert tokenize("データ") == ["デ", "ー", "タ", "デー", "ータ"]
+    assert tokenize("매출") == ["매", "출", "매출"]
+
+
+def test_query_terms_use_bigrams_and_english_prefixes():
+    assert query_terms("月度销售") == [("月度", False), ("度销", False), ("销售", False)]
+    assert query_terms("销") == [("销", False)]
+    assert query_terms("Sales sales 2024") == [("sales", True), ("2024", True)]
+
+
+def test_cjk_search_ranks_by_bm25(index):
+    _put(index, "trend", "销售趋势", "按月统计销售额的变化趋势")
+    _put(index, "stock", "库存分析", "各仓库的库存周转情况")
+    _put(index, "mention", "客户分析", "客户数量，附带销售渠道")
+
+    results = index.search("销售趋势")
+
+    # 名称命中全部检索词的示例排在只在描述中部分命中的示例之前，不相关的示例不返回
+    assert _ids(results) == ["trend", "mention"]
+    assert results[0]["score"] > results[1]["score"] > 0
+    assert results[0]["title"] == "销售趋势"
+    assert results[0]["snippet"] == "按月统计销售额的变化趋势"
+
+
+def test_field_weights_affect_ranking(index):
+    _put(index, "in_code", "数据汇总", code="df.groupby('region').sum()")
+    _put(index, "in_name", "region 汇总")
+
+    assert _ids(index.search("region")) == ["in_name", "in_code"]
+
+
+def test_english_prefix_match_scores_lower_than_exact(index):
+    _put(index, "exact", "revenue report")
+    _put(index, "prefix", "revenues by month")
+
+    results = index.search("revenue")
+
+    assert _ids(results) == ["exact", "prefix"]
+    assert results[0]["score"] > results[1]["score"]
+
+
+def test_filter_by_kind_and_tags(index):
+    _put(index, "e1", "销售趋势", tags=["销售", "月报"])
+    _put(index, "e2", "销售明细", tags=["销售"])
+    _put(index, "q1", "销售汇总", kind="query")
+
+    assert _ids(index.search("销售", kind="query")) == ["q1"]
+    assert sorted(_ids(index.search("销售", kind="example"))) == ["e1", "e2"]
+    assert _ids(index.search("销售", tags=["销售", "月报"])) == ["e1"]
+    # 检索词为空时按标签筛选，最近写入的在前
+    assert _ids(index.search("", tags=["销售"])) == ["e2", "e1"]
+    assert len(index.search("销售", limit=1)) == 1
+
+
+def test_update_and_remove(index):
+    _put(index, "e1", "销售趋势", version=1)
+    _put(index, "e1", "库存分析", version=1)
+    # 版本相同时不更新
+    assert _ids(index.search("销售")) == ["e1"]
+
+    _put(index, "e1", "库存分析", version=2)
+    assert index.search("销售") == []
+    assert _ids(index.search("库存")) == ["e1"]
+    assert index.versions("example") == {"e1": 2}
+
+    index.remove("e1")
+    assert index.search("库存") == []
+    assert index.versions("example") == {}
+
+
+def test_other_instances_see_writes_and_restart_rebuilds(tmp_path):
+    path = str(tmp_path / "index.sqlite3")
+    first, second = SearchIndex(path), SearchIndex(path)
+    try:
+        _put(first, "e1", "销售趋势")
+        _put(first, "e2", "库存分析")
+        assert _ids(second.search("销售")) == ["e1"]
+
+        second.remove("e1")
+        assert first.search("销售") == []
+    finally:
+        first.close()
+        second.close()
+
+    restarted = SearchIndex(path)
+    try:
+        assert _ids(restarted.search("库存")) == ["e2"]
+        assert restarted.search("销售") == []
+    finally:
+        restarted.close()
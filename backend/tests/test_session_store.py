@@ -0,0 +1,220 @@
+"""会话存储：内存预算、LRU换出、过期清理、换出数据的重新加载和多进程间的同步"""
+import asyncio
+import time
+
+import pandas as pd
+import pytest
+
+from app.services import session_store as session_store_module
+from app.services.dataset_cache import DatasetCache
+from app.services.session_store import SessionStore, frame_memory_usage
+from app.services.state_store import MemoryStateBackend, SQLiteStateBackend
+
+
+def _frame(rows: int = 1000) -> pd.DataFrame:
+    return pd.DataFrame({"v": range(rows), "s": [f"row-{i}" for i in range(rows)]})
+
+
+FRAME_BYTES = frame_memory_usage(_frame())
+
+
+@pytest.fixture
+def dataset_cache(tmp_path, monkeypatch):
+    cache = DatasetCache(str(tmp_path / "cache"))
+
+    async def get_dataset_cache():
+        return cache
+
+    monkeypatch.setattr(session_store_module, "get_dataset_cache", get_dataset_cache)
+    return cache
+
+
+def _session(key: str = None) -> dict:
+    return {"data": _frame(), "data_key": key, "file_path": None, "analysis_history": []}
+
+
+def _put(store: SessionStore, session_id: str, session: dict):
+    asyncio.run(store.put(session_id, session))
+
+
+def _store(budget_frames: float, timeout: float = 3600) -> SessionStore:
+    return SessionStore(memory_budget=int(FRAME_BYTES * budget_frames), timeout=timeout,
+                        backend=MemoryStateBackend())
+
+
+def test_memory_is_accounted_per_session():
+    store = _store(10)
+    _put(store, "a", _session("ka"))
+    _put(store, "b", _session("kb"))
+
+    assert store.total_bytes == 2 * FRAME_BYTES
+    assert asyncio.run(store.remove("a"))
+    assert store.total_bytes == FRAME_BYTES
+    assert store.get("a") is None
+    assert asyncio.run(store.ids()) == ["b"]
+
+
+def test_budget_evicts_least_recently_used():
+    store = _store(2.5)
+    _put(store, "a", _session("ka"))
+    _put(store, "b", _session("kb"))
+    # 访问 a 之后，b 成为最久未使用的会话
+    store.get("a")
+    _put(store, "c", _session("kc"))
+
+    assert store._sessions["b"]["data"] is None
+    assert store._sessions["b"]["spilled"]
+    assert store._sessions["a"]["data"] is not None
+    assert store._sessions["c"]["data"] is not None
+    assert store.total_bytes == 2 * FRAME_BYTES
+    assert store.evictions == 1
+
+
+def test_sessions_without_reloadable_data_are_not_evicted():
+    store = _store(1.5)
+    _put(store, "a", _session())
+    _put(store, "b", _session("kb"))
+    _put(store, "c", _session("kc"))
+
+    # a 没有内容哈希和原始文件，无法换出，只能换出 b
+    assert store._sessions["a"]["data"] is not None
+    assert store._sessions["b"]["data"] is None
+    assert store._sessions["c"]["data"] is not None
+
+
+def test_idle_sessions_expire():
+    store = _store(10, timeout=0.05)
+    _put(store, "a", _session("ka"))
+    time.sleep(0.1)
+    _put(store, "b", _session("kb"))
+
+    assert store.get("a") is None
+    assert store.get("b") is not None
+    assert store.expirations == 1
+    assert store.total_bytes == FRAME_BYTES
+
+
+def test_evicted_data_is_reloaded_from_cache(dataset_cache):
+    store = _store(1.5)
+    frame = _frame()
+    dataset_cache.write("ka", frame)
+    _put(store, "a", _session("ka"))
+    _put(store, "b", _session("kb"))
+    assert store._sessions["a"]["data"] is None
+
+    data = asyncio.run(store.ensure_data("a"))
+
+    pd.testing.assert_frame_equal(data, frame)
+    assert store.rehydrations == 1
+    # 重新加载 a 后超出预算，b 被换出
+    assert store._sessions["b"]["data"] is None
+    assert store.total_bytes == FRAME_BYTES
+
+
+@pytest.fixture
+def shared_backend(tmp_path):
+    backend = SQLiteStateBackend(str(tmp_path / "state.db"))
+    yield backend
+    backend.close()
+
+
+def _worker(backend) -> SessionStore:
+    """共享同一状态后端的工作进程"""
+    return SessionStore(memory_budget=int(FRAME_BYTES * 10), timeout=3600, backend=backend)
+
+
+def _entry(query: str) -> dict:
+    return {"query": query, "status": "success"}
+
+
+def test_metadata_changes_are_synced_by_version(shared_backend):
+    first, second = _worker(shared_backend), _worker(shared_backend)
+    _put(first, "a", _session("ka"))
+
+    session = asyncio.run(second.load("a"))
+    assert session["data_key"] == "ka"
+    # 数据在需要时按内容哈希重新加载
+    assert session["data"] is None and session["spilled"]
+
+    first.get("a")["datasets"] = {"extra": {"name": "extra", "data_key": "kx"}}
+    asyncio.run(first.save("a"))
+    assert asyncio.run(second.load("a"))["datasets"]["extra"]["data_key"] == "kx"
+    assert second.restored == 2
+
+
+def test_unchanged_record_is_not_rewritten(shared_backend):
+    store = _worker(shared_backend)
+    _put(store, "a", _session("ka"))
+    version = shared_backend.version(SessionStore.NAMESPACE, "a")
+
+    store.add_history("a", _entry("q1"))
+    asyncio.run(store.save("a"))
+
+    assert shared_backend.version(SessionStore.NAMESPACE, "a") == version
+    assert "analysis_history" not in shared_backend.get(SessionStore.NAMESPACE, "a")
+    assert [value["query"] for _, value in shared_backend.entries(SessionStore.HISTORY_NAMESPACE, "a")] == ["q1"]
+
+
+def test_history_from_both_workers_is_kept(shared_backend):
+    first, second = _worker(shared_backend), _worker(shared_backend)
+    _put(first, "a", _session("ka"))
+    asyncio.run(second.load("a"))
+
+    # 两个工作进程各自完成分析后写入，互不覆盖
+    first.add_history("a", _entry("q1"))
+    second.add_history("a", _entry("q2"))
+    asyncio.run(first.save("a"))
+    asyncio.run(second.save("a"))
+    first.add_history("a", _entry("q3"))
+    asyncio.run(first.save("a"))
+
+    first_history = [item["query"] for item in asyncio.run(first.load("a"))["analysis_history"]]
+    second_history = [item["query"] for item in asyncio.run(second.load("a"))["analysis_history"]]
+    assert sorted(first_history) == sorted(second_history) == ["q1", "q2", "q3"]
+    # 再次载入不会重复加入已有的历史
+    assert len(asyncio.run(second.load("a"))["analysis_history"]) == 3
+
+
+def test_history_in_progress_is_not_duplicated(shared_backend):
+    store = _worker(shared_backend)
+    _put(store, "a", _session("ka"))
+    entry = _entry("q1")
+    # 分析开始时先加入本进程的历史，结束后再记录
+    store.get("a")["analysis_history"].append(entry)
+    store.add_history("a", entry)
+    asyncio.run(store.save("a"))
+
+    assert len(asyncio.run(store.load("a"))["analysis_history"]) == 1
+    assert len(asyncio.run(_worker(shared_backend).load("a"))["analysis_history"]) == 1
+
+
+def test_replaced_session_starts_new_history(shared_backend):
+    first, second = _worker(shared_backend), _worker(shared_backend)
+    _put(first, "a", _session("ka"))
+    first.add_history("a", _entry("old"))
+    asyncio.run(first.save("a"))
+    assert len(asyncio.run(second.load("a"))["analysis_history"]) == 1
+
+    # 重新上传数据后会话及其历史被替换
+    _put(first, "a", _session("kb"))
+    first.add_history("a", _entry("new"))
+    asyncio.run(first.save("a"))
+
+    session = asyncio.run(second.load("a"))
+    assert session["data_key"] == "kb"
+    assert [item["query"] for item in session["analysis_history"]] == ["new"]
+
+
+def test_removal_propagates_to_other_workers(shared_backend):
+    first, second = _worker(shared_backend), _worker(shared_backend)
+    _put(first, "a", _session("ka"))
+    first.add_history("a", _entry("q1"))
+    asyncio.run(first.save("a"))
+    asyncio.run(second.load("a"))
+
+    assert asyncio.run(second.remove("a"))
+
+    assert asyncio.run(first.load("a")) is None
+    assert asyncio.run(first.ids()) == []
+    assert shared_backend.entries(SessionStore.HISTORY_NAMESPACE, "a") == []
+    assert not asyncio.run(first.remove("a"))
@@ -0,0 +1,110 @@
+"""SQL分析的路由：明显不适合SQL的需求不尝试，大模型回复 NO_SQL 时直接回到代码流程"""
+import asyncio
+
+import pandas as pd
+import pytest
+
+from app.core.config import settings
+from app.services import analysis as analysis_module
+from app.services import dependencies, sql_engine
+
+
+class FakeLLM:
+    """记录调用顺序的模拟大模型服务"""
+
+    def __init__(self, sql_reply: str = sql_engine.NO_SQL):
+        self.sql_reply = sql_reply
+        self.calls = []
+
+    async def generate_sql(self, **kwargs):
+        self.calls.append("sql")
+        return self.sql_reply
+
+    async def generate_analysis_plan(self, **kwargs):
+        self.calls.append("plan")
+        return "按类别汇总"
+
+    async def generate_analysis_code(self, **kwargs):
+        self.calls.append("code")
+        return "result = df.groupby('category', as_index=False)['value'].sum()"
+
+    async def reject_sql(self, *args):
+        self.calls.append("reject_sql")
+
+
+class FakeExecutor:
+    def __init__(self):
+        self.modes = []
+
+    async def run(self, code, data=None, mode="analysis", **kwargs):
+        self.modes.append(mode)
+        return data.groupby("category", as_index=False)["value"].sum()
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(settings, "SQL_ANALYSIS_ENABLED", True)
+    monkeypatch.setattr(settings, "SQL_ENGINE", "sqlite")
+    monkeypatch.setattr(settings, "STATE_BACKEND", "memory")
+    for name in ("state_backend", "search_index", "dataset_cache"):
+        monkeypatch.setattr(dependencies, name, None)
+    return analysis_module.AnalysisService()
+
+
+def _analyze(service, monkeypatch, query: str, llm: FakeLLM):
+    executor = FakeExecutor()
+
+    async def get_llm_service():
+        return llm
+
+    async def get_code_executor():
+        return executor
+
+    monkeypatch.setattr(analysis_module, "get_llm_service", get_llm_service)
+    monkeypatch.setattr(analysis_module, "get_code_executor", get_code_executor)
+    data = pd.DataFrame({"category": ["a", "b", "a"], "value": [1, 2, 3]})
+
+    async def run():
+        await service.sessions.put("s1", {"data": data, "data_info": "列: category, value", "data_key": None,
+                                          "file_path": None, "analysis_history": []})
+        return await service._analyze(query, "s1")
+
+    return asyncio.run(run()), executor
+
+
+def test_suits_sql_skips_plotting_and_modelling():
+    assert sql_engine.suits_sql("按类别统计销售额合计")
+    assert sql_engine.suits_sql("top 10 customers by revenue")
+    assert not sql_engine.suits_sql("画出每月销售额的折线图")
+    assert not sql_engine.suits_sql("预测下个月的销量")
+    assert not sql_engine.suits_sql("Plot revenue by month")
+
+
+def test_no_sql_reply_falls_through_to_code_path(service, monkeypatch):
+    llm = FakeLLM()
+
+    response, executor = _analyze(service, monkeypatch, "按类别汇总 value", llm)
+
+    assert response["status"] == "success"
+    # NO_SQL 之后不再为SQL调用大模型，直接生成计划和代码
+    assert llm.calls == ["sql", "plan", "code"]
+    assert executor.modes == ["analysis"]
+
+
+def test_unsuitable_query_skips_sql(service, monkeypatch):
+    llm = FakeLLM(sql_reply="SELECT 1")
+
+    response, _ = _analyze(service, monkeypatch, "画出各类别 value 的柱状图", llm)
+
+    assert response["status"] == "success"
+    assert llm.calls == ["plan", "code"]
+
+
+def test_sql_analysis_is_off_by_default(service, monkeypatch):
+    monkeypatch.setattr(settings, "SQL_ANALYSIS_ENABLED", False)
+    llm = FakeLLM(sql_reply="SELECT 1")
+
+    _analyze(service, monkeypatch, "按类别汇总 value", llm)
+
+    assert llm.calls == ["plan", "code"]
@@ -0,0 +1,59 @@
+"""上传大小限制：在接收请求体时拒绝超过限制的上传"""
+from fastapi import FastAPI, File, UploadFile
+from fastapi.testclient import TestClient
+
+from app.services.upload import MULTIPART_OVERHEAD, UploadSizeLimitMiddleware
+
+MAX_SIZE = 1024 * 1024
+BOUNDARY = "test-boundary"
+
+
+def _client(received: list) -> TestClient:
+    app = FastAPI()
+    app.add_middleware(UploadSizeLimitMiddleware, max_size=MAX_SIZE)
+
+    @app.post("/upload")
+    async def upload(file: UploadFile = File(...)):
+        received.append(len(await file.read()))
+        return {"size": received[-1]}
+
+    return TestClient(app)
+
+
+def _multipart_chunks(size: int, chunk_size: int = 64 * 1024):
+    yield (f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"d.csv\"\r\n"
+           f"Content-Type: text/csv\r\n\r\n").encode()
+    for start in range(0, size, chunk_size):
+        yield b"x" * min(chunk_size, size - start)
+    yield f"\r\n--{BOUNDARY}--\r\n".encode()
+
+
+def test_small_upload_passes():
+    received = []
+    response = _client(received).post("/upload", files={"file": ("d.csv", b"a,b\n1,2\n", "text/csv")})
+
+    assert response.status_code == 200
+    assert received == [8]
+
+
+def test_content_length_over_limit_rejected_before_body():
+    received = []
+    response = _client(received).post(
+        "/upload",
+        content=b"".join(_multipart_chunks(MAX_SIZE + MULTIPART_OVERHEAD + 1)),
+        headers={"Content-Type": f"multipart/form-data; boundary={BOUNDARY}"}
+    )
+
+    assert response.status_code == 413
+    assert received == []
+
+
+def test_chunked_body_over_limit_aborted_while_receiving():
+    received = []
+    # 生成器请求体以分块传输发送，不带 Content-Length
+    response = _client(received).post(
+        "/upload", content=_multipart_chunks(MAX_SIZE + MULTIPART_OVERHEAD + 1), headers={"Content-Type": f"multipart/form-data; boundary={BOUNDARY}"}
+    )
+
+    assert response.status_code == 413
+    assert received == []
@@ -20,6 +20,7 @@ const { Panel } = Collapse;
 const stepIcons = {
   analysis_plan: <AppstoreOutlined style={{ color: '#1890ff' }} />,
   initial_code: <CodeOutlined style={{ color: '#722ed1' }} />,
+  cached_code: <CodeOutlined style={{ color: '#52c41a' }} />,
   error: <CloseCircleOutlined style={{ color: '#f5222d' }} />,
   error_analysis: <SearchOutlined style={{ color: '#fa8c16' }} />,
   info_code: <ExperimentOutlined style={{ color: '#13c2c2' }} />,
@@ -36,6 +37,7 @@ const stepIcons = {
 const stepTitles = {
   analysis_plan: '分析计划',
   initial_code: '初始分析代码',
+  cached_code: '已缓存的分析代码',
   error: '执行错误',
   error_analysis: '错误分析',
   info_code: '获取额外信息代码',
@@ -61,6 +63,7 @@ const ProcessSteps = ({ steps }) => {
         return <Paragraph style={{ whiteSpace: 'pre-wrap' }}>{step.content}</Paragraph>;
       
       case 'initial_code':
+      case 'cached_code':
       case 'fixed_code':
       case 'fixed_code_fallback':
       case 'info_code':